@@ -0,0 +1,163 @@
+"""
+Activity Buffer for Telegram Bot
+
+Отложенная запись активности пользователей. Отметки last_activity и свежие
+данные профиля копятся в памяти (по одной записи на пользователя) и
+периодически сбрасываются в таблицу users одной транзакцией с UPSERT —
+тысячи мелких коммитов превращаются в несколько крупных. Буфер ограничен
+по размеру и сбрасывается при остановке бота.
+
+При max_pending отметках сброс начинается раньше срока; max_size — жесткий
+предел: если запись не успевает или не удается, сверх него вытесняются
+отметки, которые дольше всех не обновлялись (такой пользователь, скорее
+всего, уже неактивен, и потеря его отметки стоит меньше всего).
+"""
+
+import time
+import asyncio
+import itertools
+import logging
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+# Отметка активности: (username, first_name, last_name, last_activity)
+Touch = Tuple[Optional[str], Optional[str], Optional[str], str]
+
+class ActivityBuffer:
+    """Буфер отметок активности с пакетной записью в SQLite."""
+
+    def __init__(self, db_path: str = 'users.db', flush_interval: float = 5.0, max_pending: int = 5000,
+                 max_size: Optional[int] = None):
+        self.db = get_database(db_path)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_size = max_size if max_size is not None else 2 * max_pending
+        self.touches = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+        self._pending: Dict[int, Touch] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def touch(self, telegram_id: int, username: Optional[str] = None,
+              first_name: Optional[str] = None, last_name: Optional[str] = None):
+        """Запоминает активность пользователя. Повторные отметки до сброса схлопываются."""
+        # Тот же формат, что у CURRENT_TIMESTAMP в SQLite (UTC)
+        now = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+        with self._lock:
+            # Повторная отметка переносит пользователя в конец: вытесняются дольше всех не обновлявшиеся
+            self._pending.pop(telegram_id, None)
+            self._pending[telegram_id] = (username, first_name, last_name, now)
+            self.touches += 1
+            self._evict_oldest()
+            pending = len(self._pending)
+
+        if pending >= self.max_pending:
+            if self._wakeup:
+                self._wakeup.set()
+            else:
+                # Фоновый сброс не запущен — не даем буферу расти
+                self.flush()
+
+    def _evict_oldest(self):
+        # Вызывается под self._lock
+        excess = len(self._pending) - self.max_size
+        if excess <= 0:
+            return
+        for telegram_id in list(itertools.islice(self._pending, excess)):
+            del self._pending[telegram_id]
+        self.dropped += excess
+
+    def pending_count(self) -> int:
+        """Количество пользователей, ожидающих записи."""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Записывает накопленные отметки одной транзакцией. Возвращает число строк."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            try:
+                with self.db.write() as cursor:
+                    cursor.executemany('''
+                    INSERT INTO users (telegram_id, username, first_name, last_name, last_activity)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(telegram_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name,
+                        last_name = excluded.last_name,
+                        last_activity = excluded.last_activity
+                    ''', [(telegram_id, *touch) for telegram_id, touch in pending.items()])
+            except Exception:
+                # Возвращаем отметки в буфер перед более свежими, не затирая их и не выходя за max_size
+                with self._lock:
+                    merged = {telegram_id: touch for telegram_id, touch in pending.items() if telegram_id not in self._pending}
+                    merged.update(self._pending)
+                    self._pending = merged
+                    dropped = self.dropped
+                    self._evict_oldest()
+                    dropped = self.dropped - dropped
+                if dropped:
+                    logger.warning(f"Буфер активности переполнен: отброшено {dropped} отметок")
+                raise
+
+            self.flushes += 1
+            self.rows_written += len(pending)
+            return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики отметок и сбросов."""
+        return {
+            'pending': self.pending_count(),
+            'touches': self.touches,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written
+        }
+
+    def start(self):
+        """Запускает фоновую задачу периодического сброса в текущем цикле событий."""
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает оставшиеся отметки."""
+        if self._task:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for теряет отмену, если событие установлено в том же шаге цикла
+            # (переполненный буфер будит сброс при каждой отметке)
+            if self._stopping:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении активности пользователей: {e}")
@@ -0,0 +1,993 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Telegram Bot
+
+Нагрузочные замеры бота против локальных заглушек внешних API (см. fake_servers.py).
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import tempfile
+import threading
+import warnings
+from collections import Counter
+from typing import Dict, List, Optional
+
+from fake_servers import FakeOpenAIServer, FakeTelegramServer
+from init_data import InitDataValidator, sign_init_data
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.WARNING
+)
+logger = logging.getLogger(__name__)
+
+# Assistants API помечен в SDK как устаревший — не засоряем вывод замеров
+warnings.filterwarnings('ignore', category=DeprecationWarning)
+
+def load_bot(openai_server: FakeOpenAIServer):
+    """Импортирует модуль бота, направив клиент OpenAI на заглушку."""
+    os.environ['OPENAI_API_KEY'] = 'sk-benchmark'
+    os.environ['OPENAI_BASE_URL'] = openai_server.base_url
+    # Лимиты OpenAI в замерах по умолчанию выключены, их можно задать явно
+    for name in ('OPENAI_RPM', 'OPENAI_TPM', 'OPENAI_USER_RPM', 'OPENAI_USER_TPM'):
+        os.environ.setdefault(name, '0')
+    import simple_bot
+    return simple_bot
+
+def percentile(values: List[float], pct: float) -> float:
+    """Возвращает перцентиль по отсортированной выборке."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def _simulate_user(bot, turns: int, latencies: List[float]):
+    """Один синтетический пользователь: поток + несколько сообщений ассистенту."""
+    thread = await bot.client.beta.threads.create()
+    for turn in range(turns):
+        started = time.perf_counter()
+        await bot.ask_assistant('asst_benchmark', thread.id, f"Вопрос {turn}")
+        latencies.append(time.perf_counter() - started)
+
+async def bench_concurrency(levels: List[int], turns: int, run_latency: float):
+    """Пропускная способность ассистентского пути в зависимости от числа пользователей."""
+    server = FakeOpenAIServer(run_latency=run_latency).start()
+    bot = load_bot(server)
+
+    print(f"\n{'='*60}")
+    print(f"ПРОПУСКНАЯ СПОСОБНОСТЬ (run latency {run_latency}s, {turns} сообщений на пользователя)")
+    print(f"{'='*60}")
+    print(f"{'Пользователей':<15} {'Сообщений/с':<15} {'p50, с':<10} {'p99, с':<10}")
+
+    try:
+        for users in levels:
+            latencies: List[float] = []
+            started = time.perf_counter()
+            await asyncio.gather(*(_simulate_user(bot, turns, latencies) for _ in range(users)))
+            elapsed = time.perf_counter() - started
+            print(f"{users:<15} {len(latencies) / elapsed:<15.2f} "
+                  f"{percentile(latencies, 50):<10.2f} {percentile(latencies, 99):<10.2f}")
+    finally:
+        await bot.client.close()
+        server.stop()
+
+    print(f"{'='*60}\n")
+
+class RecordingMessage:
+    """Сообщение Telegram для замеров: запоминает время отправок и редактирований."""
+
+    def __init__(self):
+        self.events: List[tuple] = []
+
+    async def reply_text(self, text, **kwargs):
+        self.events.append(('send', time.perf_counter(), len(text)))
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.events.append(('edit', time.perf_counter(), len(text)))
+        return self
+
+    async def reply_chat_action(self, action, **kwargs):
+        return True
+
+async def bench_ttft(samples: int, run_latency: float, first_token_latency: float):
+    """Время до первого видимого фрагмента ответа: опрос выполнения против потокового режима."""
+    text = "Анализ рынка кофеен. " * 200
+    server = FakeOpenAIServer(run_latency=run_latency, response_text=text,
+                              first_token_latency=first_token_latency).start()
+    bot = load_bot(server)
+    from streaming import StreamingReply
+
+    polling: List[float] = []
+    streaming: List[float] = []
+    try:
+        for _ in range(samples):
+            thread = await bot.client.beta.threads.create()
+            started = time.perf_counter()
+            await bot.ask_assistant('asst_benchmark', thread.id, "Вопрос")
+            polling.append(time.perf_counter() - started)
+
+            message = RecordingMessage()
+            started = time.perf_counter()
+            reply = StreamingReply(message, max_length=bot.MAX_MESSAGE_LENGTH,
+                                   edit_interval=bot.STREAM_EDIT_INTERVAL)
+            await bot.stream_assistant('asst_benchmark', thread.id, "Вопрос", reply.feed)
+            await reply.finish()
+            streaming.append(message.events[0][1] - started)
+    finally:
+        await bot.client.close()
+        server.stop()
+
+    print(f"\n{'='*60}")
+    print(f"ВРЕМЯ ДО ПЕРВОГО ВИДИМОГО ТЕКСТА (генерация {run_latency}s, первый токен {first_token_latency}s)")
+    print(f"{'='*60}")
+    print(f"Опрос выполнения:  p50 {percentile(polling, 50):.2f}с, p99 {percentile(polling, 99):.2f}с")
+    print(f"Потоковый режим:   p50 {percentile(streaming, 50):.2f}с, p99 {percentile(streaming, 99):.2f}с")
+    print(f"{'='*60}\n")
+
+async def bench_fetch(sizes: List[int], samples: int):
+    """Получение ответа после выполнения: весь список сообщений против фильтра по run_id."""
+    server = FakeOpenAIServer(run_latency=0.0).start()
+    bot = load_bot(server)
+    messages_api = bot.client.beta.threads.messages
+
+    print(f"\n{'='*72}")
+    print(f"ПОЛУЧЕНИЕ ОТВЕТА ПОСЛЕ ВЫПОЛНЕНИЯ ({samples} замеров)")
+    print(f"{'='*72}")
+    print(f"{'Сообщений':<12} {'Весь список, мс':<18} {'байт':<10} {'По run_id, мс':<18} {'байт':<10}")
+
+    try:
+        for size in sizes:
+            thread_id = server.seed_thread(size, "Подробный разбор бизнес-модели. " * 60)
+            await bot.client.beta.threads.messages.create(thread_id=thread_id, role="user", content="Вопрос")
+            run = await bot.client.beta.threads.runs.create(thread_id=thread_id, assistant_id='asst_benchmark')
+            await bot.client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+            results = {}
+            for mode, params in (('full', {}), ('scoped', {'run_id': run.id, 'order': 'desc', 'limit': 1})):
+                timings = []
+                for _ in range(samples):
+                    started = time.perf_counter()
+                    raw = await messages_api.with_raw_response.list(thread_id=thread_id, **params)
+                    timings.append(time.perf_counter() - started)
+                results[mode] = (percentile(timings, 50) * 1000, len(raw.http_response.content))
+
+            print(f"{size:<12} {results['full'][0]:<18.2f} {results['full'][1]:<10} "
+                  f"{results['scoped'][0]:<18.2f} {results['scoped'][1]:<10}")
+    finally:
+        await bot.client.close()
+        server.stop()
+
+    print(f"{'='*72}\n")
+
+async def bench_activity(touches: int, users: int):
+    """Отметки активности пользователей: коммит на каждое обновление против пакетной записи."""
+    # Отдельная база во временном каталоге, чтобы не трогать рабочую users.db
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    server = FakeOpenAIServer().start()
+    bot = load_bot(server)
+    bot.init_database()
+    for user_id in range(users):
+        bot.save_user(user_id, f"user{user_id}", "Имя", None)
+
+    print(f"\n{'='*72}")
+    print(f"ОТМЕТКИ АКТИВНОСТИ ({touches} обновлений от {users} пользователей)")
+    print(f"{'='*72}")
+    print(f"{'Режим':<20} {'мкс на обновление':<20} {'Коммитов':<12} {'Коммитов/с':<12}")
+
+    try:
+        spent = 0.0
+        started = time.perf_counter()
+        for touch in range(touches):
+            call_started = time.perf_counter()
+            bot.save_user(touch % users, f"user{touch % users}", "Имя", None)
+            spent += time.perf_counter() - call_started
+        elapsed = time.perf_counter() - started
+        print(f"{'Коммит на запрос':<20} {spent / touches * 1e6:<20.1f} {touches:<12} {touches / elapsed:<12.0f}")
+
+        buffer = bot.activity_buffer
+        buffer.flush_interval = 0.05
+        buffer.start()
+        spent = 0.0
+        started = time.perf_counter()
+        for touch in range(touches):
+            call_started = time.perf_counter()
+            await bot.add_or_update_user(touch % users, f"user{touch % users}", "Имя", None)
+            spent += time.perf_counter() - call_started
+            if touch % 50 == 0:
+                # Даем циклу событий обработать фоновый сброс, как между обновлениями Telegram
+                await asyncio.sleep(0.001)
+        await buffer.stop()
+        elapsed = time.perf_counter() - started
+        print(f"{'Буфер активности':<20} {spent / touches * 1e6:<20.1f} {buffer.flushes:<12} {buffer.flushes / elapsed:<12.0f}")
+    finally:
+        await bot.client.close()
+        server.stop()
+
+    print(f"{'='*72}\n")
+
+async def _measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """Максимальное опоздание цикла событий относительно расписания тиков."""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+async def bench_db_blocking(hold: float, requests: int):
+    """Отзывчивость цикла событий, пока чужая транзакция держит блокировку записи SQLite."""
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    server = FakeOpenAIServer().start()
+    bot = load_bot(server)
+    bot.init_database()
+
+    def hold_write_lock(ready: threading.Event):
+        # Как долгая миграция или очистка из user_utils.py в другом процессе
+        conn = sqlite3.connect('users.db', isolation_level=None)
+        conn.execute('BEGIN IMMEDIATE')
+        ready.set()
+        time.sleep(hold)
+        conn.execute('COMMIT')
+        conn.close()
+
+    async def run(mode: str, first_user: int) -> tuple:
+        ready = threading.Event()
+        holder = threading.Thread(target=hold_write_lock, args=(ready,))
+        holder.start()
+        ready.wait()
+
+        stop = asyncio.Event()
+        lag = asyncio.create_task(_measure_loop_lag(stop))
+        await asyncio.sleep(0)  # замер задержки должен начаться до запросов
+        started = time.perf_counter()
+        for user_id in range(first_user, first_user + requests):
+            if mode == 'sync':
+                bot.save_user(user_id, f"user{user_id}", "Имя", None)
+            else:
+                await bot.add_or_update_user(user_id, f"user{user_id}", "Имя", None)
+        elapsed = time.perf_counter() - started
+        stop.set()
+        worst_lag = await lag
+        await asyncio.to_thread(holder.join)
+        return elapsed, worst_lag
+
+    print(f"\n{'='*72}")
+    print(f"ОТЗЫВЧИВОСТЬ ЦИКЛА СОБЫТИЙ (чужая транзакция держит запись {hold}s, {requests} новых пользователей)")
+    print(f"{'='*72}")
+    print(f"{'Режим':<28} {'Время запросов, с':<20} {'Макс. задержка цикла, с':<24}")
+
+    try:
+        for mode, title, first_user in (('sync', 'Синхронно в обработчике', 0),
+                                        ('async', 'Через AsyncDatabase', 1_000_000)):
+            elapsed, worst_lag = await run(mode, first_user)
+            print(f"{title:<28} {elapsed:<20.2f} {worst_lag:<24.3f}")
+    finally:
+        await bot.client.close()
+        bot.adb.close()
+        server.stop()
+
+    print(f"{'='*72}")
+    for query, summary in bot.adb.stats()['queries'].items():
+        print(f"{query}: {summary}")
+    print()
+
+def user_init_data(user: dict, bot_token: str, auth_date: Optional[int] = None) -> str:
+    """initData Telegram WebApp с корректной подписью для заданного пользователя."""
+    return sign_init_data({
+        'auth_date': str(int(time.time()) if auth_date is None else auth_date),
+        'query_id': 'AAHdF6IQAAAAAN0XohDhrOrc',
+        'user': json.dumps(user, ensure_ascii=False, separators=(',', ':'))
+    }, bot_token)
+
+def bench_init_data(count: int, distinct: int):
+    """Проверок initData в секунду: ключ на каждый запрос, ключ один раз и ключ один раз с LRU-кэшем.
+
+    Подписанные строки повторяются по кругу (distinct разных) — как повторные открытия Mini App.
+    """
+    bot_token = '123456:benchmark'
+    payloads = [user_init_data({'id': 100000 + index, 'first_name': 'Имя', 'username': f"user_{index}"}, bot_token)
+                for index in range(distinct)]
+
+    def run(validate) -> float:
+        started = time.perf_counter()
+        for index in range(count):
+            if validate(payloads[index % distinct]) is None:
+                raise RuntimeError("Корректная initData не прошла проверку")
+        return time.perf_counter() - started
+
+    cached = InitDataValidator(bot_token, cache_size=max(1024, distinct))
+    modes = [
+        ("ключ на каждый запрос", lambda data: InitDataValidator(bot_token, cache_size=0).validate(data)),
+        ("ключ один раз", InitDataValidator(bot_token, cache_size=0).validate),
+        ("ключ один раз + LRU", cached.validate)
+    ]
+
+    print(f"\n{'='*60}")
+    print(f"initData: {count} проверок, {distinct} разных строк")
+    print(f"{'='*60}")
+    print(f"{'Режим':<24}{'Проверок/с':>14}{'мкс/проверку':>16}")
+    for name, validate in modes:
+        elapsed = run(validate)
+        print(f"{name:<24}{count / elapsed:>14.0f}{elapsed / count * 1e6:>16.2f}")
+
+    forged = payloads[0].replace('100000', '100001', 1)
+    expired = user_init_data({'id': 1, 'first_name': 'Имя'}, bot_token, auth_date=int(time.time()) - 2 * 86400)
+    checker = InitDataValidator(bot_token)
+    assert checker.validate(forged) is None and checker.validate(expired) is None
+    print(f"Кэш: {cached.stats()}")
+    print(f"Подделанная и просроченная строки отклонены: {checker.stats()['rejected']}")
+    print(f"{'='*60}\n")
+
+def serve_in_thread(start_server) -> tuple:
+    """Запускает сервер в отдельном потоке со своим циклом событий, как в процессе бота.
+
+    start_server — корутина-функция без аргументов, возвращающая сервер с атрибутом port.
+    Возвращает (port, функция остановки).
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    box = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        box['server'] = loop.run_until_complete(start_server())
+        started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(box['server'].stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return box['server'].port, stop
+
+async def _http_client(port: int, requests: List[bytes], latencies: List[float], statuses: Dict[int, int]):
+    """Одно keep-alive соединение, последовательно отправляющее запросы."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for raw in requests:
+            started = time.perf_counter()
+            writer.write(raw)
+            head = await reader.readuntil(b'\r\n\r\n')
+            status = int(head.split(b' ', 2)[1])
+            length = 0
+            for line in head.split(b'\r\n'):
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':', 1)[1])
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def bench_http_load(connections: int, total: int, endpoint: str):
+    """Нагрузка на HTTP API бота: запросов в секунду и задержки при параллельных соединениях."""
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    bot_token = '123456:benchmark'
+    os.environ['TELEGRAM_BOT_TOKEN'] = bot_token
+    server = FakeOpenAIServer().start()
+    bot = load_bot(server)
+    bot.init_database()
+
+    def build_request(index: int) -> bytes:
+        if endpoint == 'register':
+            user = {'id': index, 'first_name': 'Имя'}
+            body = json.dumps({'initData': user_init_data(user, bot_token)}).encode('utf-8')
+            return (f"POST /api/register HTTP/1.1\r\nHost: localhost\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+        return b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+    port, stop = serve_in_thread(lambda: bot.start_api_server(0))
+    per_connection = max(1, total // connections)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _http_client(port, [build_request(c * per_connection + i) for i in range(per_connection)], latencies, statuses)
+            for c in range(connections)
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        stop()
+        bot.adb.close()
+        server.stop()
+
+    print(f"\n{'='*60}")
+    print(f"HTTP API: {endpoint}, {connections} соединений, {len(latencies)} запросов (keep-alive)")
+    print(f"{'='*60}")
+    print(f"Запросов/с: {len(latencies) / elapsed:.0f}")
+    print(f"p50: {percentile(latencies, 50) * 1000:.2f} мс, p99: {percentile(latencies, 99) * 1000:.2f} мс")
+    print(f"Коды ответов: {statuses}")
+    print(f"{'='*60}\n")
+
+def synthetic_updates(count: int, users: int) -> List[dict]:
+    """Текстовые сообщения от users пользователей в формате Telegram Bot API."""
+    now = int(time.time())
+    return [
+        {
+            'update_id': index + 1,
+            'message': {
+                'message_id': index + 1,
+                'date': now,
+                'chat': {'id': 1000 + index % users, 'type': 'private'},
+                'from': {'id': 1000 + index % users, 'is_bot': False, 'first_name': 'Имя'},
+                'text': f"Вопрос {index}"
+            }
+        }
+        for index in range(count)
+    ]
+
+def load_updates(path: str) -> List[dict]:
+    """Записанные обновления: по одному JSON-объекту Update в строке."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def bench_webhook_replay(connections: int, updates: List[dict]):
+    """Прием обновлений через webhook: сколько обновлений в секунду сервер подтверждает и ставит в очередь."""
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    server = FakeOpenAIServer().start()
+    bot = load_bot(server)
+    # Приложение без initialize: для приема нужны только очередь обновлений и объект бота
+    application = bot.build_application('123456:benchmark')
+    secret = bot.WEBHOOK_SECRET
+
+    def build_request(update: dict, token: str) -> bytes:
+        body = json.dumps(update).encode('utf-8')
+        return (f"POST {bot.WEBHOOK_PATH} HTTP/1.1\r\nHost: localhost\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {token}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+
+    port, stop = serve_in_thread(lambda: bot.start_api_server(0, application))
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    try:
+        # Запрос с неверным секретом должен быть отклонен
+        rejected: Dict[int, int] = {}
+        await _http_client(port, [build_request(updates[0], 'wrong-secret')], [], rejected)
+
+        batches = [updates[c::connections] for c in range(connections)]
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            _http_client(port, [build_request(update, secret) for update in batch], latencies, statuses)
+            for batch in batches if batch
+        ))
+        elapsed = time.perf_counter() - started
+    finally:
+        stop()
+        bot.adb.close()
+        server.stop()
+
+    print(f"\n{'='*60}")
+    print(f"WEBHOOK: {len(latencies)} обновлений, {connections} соединений")
+    print(f"{'='*60}")
+    print(f"Обновлений/с: {len(latencies) / elapsed:.0f}")
+    print(f"Подтверждение: p50 {percentile(latencies, 50) * 1000:.2f} мс, p99 {percentile(latencies, 99) * 1000:.2f} мс")
+    print(f"Коды ответов: {statuses}, с неверным секретом: {rejected}")
+    print(f"В очереди приложения: {application.update_queue.qsize()}")
+    print(f"{'='*60}\n")
+
+async def bench_sharding(levels: List[int], count: int, users: int, connections: int = 32):
+    """Обработка /start несколькими процессами-воркерами: обновлений/с до отправки ответа."""
+    import sharding
+
+    telegram = FakeTelegramServer(latency=0.005).start()
+    openai_server = FakeOpenAIServer().start()
+    token = '123456:benchmark'
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': token,
+        'TELEGRAM_API_BASE_URL': telegram.base_url,
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': openai_server.base_url,
+        'WEBHOOK_SECRET': 'benchmark-secret'
+    })
+    os.environ.pop('WEBHOOK_URL', None)
+    updates = synthetic_updates(count, users)
+    for update in updates:
+        update['message']['text'] = '/start'
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+
+    results = []
+    try:
+        for run, workers in enumerate(levels):
+            # Каждый прогон — с чистой базой и свободным диапазоном портов
+            os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+            supervisor = sharding.ShardSupervisor(workers, base_port=19100 + run * 64)
+            supervisor.start()
+            router = sharding.ShardRouter(supervisor.ports, os.environ['WEBHOOK_SECRET'])
+            try:
+                await sharding.wait_for_workers(supervisor.ports)
+                with telegram._lock:
+                    telegram.sent.clear()
+
+                async def send(batch: List[dict]):
+                    for update in batch:
+                        await router.forward_update(json.dumps(update).encode('utf-8'), update)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(send(updates[c::connections]) for c in range(connections)))
+                # Ждем, пока воркеры ответят на все обновления
+                while len(telegram.sent) < count and time.perf_counter() - started < 120:
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - started
+                results.append((workers, len(telegram.sent), elapsed, list(router.forwarded)))
+            finally:
+                await router.close()
+                await asyncio.to_thread(supervisor.stop)
+    finally:
+        telegram.stop()
+        openai_server.stop()
+
+    print(f"\n{'='*60}")
+    print(f"ШАРДИРОВАНИЕ: {count} обновлений /start от {users} пользователей, ядер: {os.cpu_count()}")
+    print(f"{'='*60}")
+    print(f"{'Воркеров':>8} | {'Ответов':>8} | {'Время, с':>9} | {'Обновлений/с':>12} | По воркерам")
+    for workers, sent, elapsed, forwarded in results:
+        print(f"{workers:>8} | {sent:>8} | {elapsed:>9.2f} | {sent / elapsed:>12.0f} | {forwarded}")
+    print(f"{'='*60}\n")
+
+def user_update(update_id: int, user_id: int, **message) -> dict:
+    """Обновление с сообщением от пользователя в личном чате (text, entities, web_app_data...)."""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Имя', 'username': f"user{user_id}"},
+            **message
+        }
+    }
+
+async def start_bot(openai_server: FakeOpenAIServer, telegram: FakeTelegramServer):
+    """Запускает приложение бота (без polling и webhook) против заглушек. Обновления подаются в update_queue."""
+    os.environ['TELEGRAM_API_BASE_URL'] = telegram.base_url
+    # Ответ на сообщение — одно sendMessage без редактирований (потоковый режим замеряет ttft)
+    os.environ.setdefault('ASSISTANT_STREAMING', 'false')
+    for assistant_type in ('market', 'founder', 'business', 'adapter'):
+        os.environ.setdefault(f"OPENAI_ASSISTANT_ID_{assistant_type.upper()}", f"asst_{assistant_type}")
+    for name in ('PORT', 'WEBHOOK_URL'):
+        os.environ.pop(name, None)
+
+    bot = load_bot(openai_server)
+    bot.init_database()
+    application = bot.build_application('123456:benchmark')
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    return bot, application
+
+async def stop_bot(bot, application):
+    await application.stop()
+    await bot.post_shutdown(application)
+    await application.shutdown()
+
+async def bench_e2e(users: int, turns: int, run_latency: float, failure_rate: float, error_rate: float,
+                    reply_timeout: float = 30.0):
+    """Полный путь пользователя через бота против заглушек Telegram и OpenAI.
+
+    Каждый пользователь: /start, регистрация и выбор ассистента из Mini App (web_app_data),
+    затем turns сообщений ассистенту, каждое — после ответа на предыдущее.
+    """
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    openai_server = FakeOpenAIServer(run_latency=run_latency, run_failure_rate=failure_rate,
+                                     error_rate=error_rate, seed=1).start()
+    telegram = FakeTelegramServer(error_rate=error_rate, seed=2).start()
+    bot, application = await start_bot(openai_server, telegram)
+    from telegram import Update
+    assistant_types = list(bot.ASSISTANTS)
+
+    update_ids = iter(range(1, 10 ** 9))
+    latencies: Dict[str, List[float]] = {'start': [], 'register': [], 'select': [], 'message': []}
+    lost: Dict[str, int] = {kind: 0 for kind in latencies}
+
+    async def step(user_id: int, kind: str, **message):
+        expected = telegram.sent_by_chat[user_id] + 1
+        started = time.perf_counter()
+        update = Update.de_json(user_update(next(update_ids), user_id, **message), application.bot)
+        await application.update_queue.put(update)
+        while telegram.sent_by_chat[user_id] < expected:
+            if time.perf_counter() - started > reply_timeout:
+                lost[kind] += 1
+                return
+            await asyncio.sleep(0.005)
+        latencies[kind].append(time.perf_counter() - started)
+
+    async def run_user(index: int):
+        user_id = 100000 + index
+        web_app = lambda data: {'data': json.dumps(data), 'button_text': 'Выбрать ассистента'}
+        await step(user_id, 'start', text='/start', entities=[{'type': 'bot_command', 'offset': 0, 'length': 6}])
+        await step(user_id, 'register', web_app_data=web_app({'action': 'register_user'}))
+        await step(user_id, 'select', web_app_data=web_app({
+            'action': 'select_assistant', 'assistant_type': assistant_types[index % len(assistant_types)]
+        }))
+        for turn in range(turns):
+            await step(user_id, 'message', text=f"Вопрос {turn} от пользователя {index}")
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_user(index) for index in range(users)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await stop_bot(bot, application)
+        telegram.stop()
+        openai_server.stop()
+
+    # Потоки для пула и их удаление идут в фоне и не относятся к сообщениям пользователей
+    openai_calls = Counter({name: count for name, count in openai_server.calls.items()
+                            if name not in ('threads.create', 'threads.delete')})
+    messages = users * turns
+
+    print(f"\n{'='*60}")
+    print(f"E2E: {users} пользователей x {turns} сообщений, run latency {run_latency}s, "
+          f"сбои выполнения {failure_rate:.0%}, ошибки API {error_rate:.0%}")
+    print(f"{'='*60}")
+    print(f"Время: {elapsed:.2f} с, сообщений ассистенту/с: {len(latencies['message']) / elapsed:.2f}")
+    print(f"{'Шаг':<10} {'Ответов':>8} {'Потеряно':>9} {'p50, с':>8} {'p95, с':>8} {'p99, с':>8}")
+    for kind, values in latencies.items():
+        print(f"{kind:<10} {len(values):>8} {lost[kind]:>9} {percentile(values, 50):>8.3f} "
+              f"{percentile(values, 95):>8.3f} {percentile(values, 99):>8.3f}")
+    print(f"Вызовов OpenAI на сообщение: {sum(openai_calls.values()) / max(1, messages):.2f} {dict(openai_calls)}")
+    print(f"Вызовы Telegram: {dict(telegram.calls)}")
+    print(f"{'='*60}\n")
+
+async def bench_replay(path: str, speed: Optional[float]):
+    """Воспроизведение записанного трафика против бота с заглушками.
+
+    Выполнения ассистента длятся столько же, сколько в записи. Все пользователи из записи
+    заранее зарегистрированы и имеют открытый разговор, поэтому запись можно начинать с любого момента.
+    """
+    from traffic_recorder import Replayer, expand_paths, load_records, update_user_id
+
+    records = load_records(*expand_paths(path))
+    updates = [record for record in records if record['type'] == 'update']
+    runs = [record for record in records if record['type'] == 'run']
+    durations = [record['duration'] for record in runs if record['outcome'] == 'completed']
+    failure_rate = sum(1 for record in runs if record['outcome'] != 'completed') / len(runs) if runs else 0.0
+
+    os.chdir(tempfile.mkdtemp(prefix='bot-bench-'))
+    openai_server = FakeOpenAIServer(run_latencies=durations or None, run_failure_rate=failure_rate, seed=1).start()
+    telegram = FakeTelegramServer().start()
+    bot, application = await start_bot(openai_server, telegram)
+    from telegram import Update
+
+    users = {update_user_id(record['update']) for record in updates} - {None}
+    assistant_types = list(bot.ASSISTANTS)
+    for index, user_id in enumerate(sorted(users)):
+        bot.save_user(user_id, status='registered')
+        assistant_type = assistant_types[index % len(assistant_types)]
+        bot.active_threads[user_id] = (bot.ASSISTANTS[assistant_type], openai_server.seed_thread(0, ''), assistant_type)
+
+    async def deliver(update: dict):
+        await application.update_queue.put(Update.de_json(update, application.bot))
+
+    replayer = Replayer(updates, deliver, speed)
+    try:
+        elapsed = await replayer.run()
+        # Ждем, пока бот ответит на поданное: нет новых вызовов Telegram в течение секунды
+        drained_at = time.perf_counter()
+        last_calls, idle_since = -1, time.perf_counter()
+        while time.perf_counter() - idle_since < 1.0 and time.perf_counter() - drained_at < 300:
+            calls = sum(telegram.calls.values())
+            if calls != last_calls:
+                last_calls, idle_since = calls, time.perf_counter()
+            await asyncio.sleep(0.05)
+        finished = idle_since - drained_at + elapsed
+    finally:
+        await stop_bot(bot, application)
+        telegram.stop()
+        openai_server.stop()
+
+    source_span = updates[-1]['t'] - updates[0]['t'] if updates else 0.0
+    print(f"\n{'='*60}")
+    print(f"REPLAY: {len(updates)} обновлений от {len(users)} пользователей, "
+          f"запись {source_span:.1f} с, скорость {'max' if speed is None else f'{speed:g}x'}")
+    print(f"{'='*60}")
+    print(replayer.report(elapsed))
+    print(f"Выполнения из записи: {len(runs)}, доля неуспешных {failure_rate:.1%}")
+    print(f"До последнего ответа: {finished:.2f} с")
+    print(f"Вызовы Telegram: {dict(telegram.calls)}")
+    print(f"Вызовы OpenAI: {dict(openai_server.calls)}")
+    print(f"{'='*60}\n")
+
+# Фрагменты ответов бизнес-ассистентов для корпуса замера форматирования
+_ANSWER_WORDS = ("рынок", "выручка", "клиент", "сегмент", "гипотеза", "канал", "маржа", "конверсия", "юнит-экономика",
+                 "CAC", "LTV", "MVP", "B2B", "подписка", "воронка", "retention_rate", "churn", "интервью", "ценность",
+                 "конкурент", "стратегия", "метрика", "партнер", "продукт", "спрос", "оффер", "цена", "запуск")
+
+def _answer_sentence(rnd) -> str:
+    words = [rnd.choice(_ANSWER_WORDS) for _ in range(rnd.randint(6, 18))]
+    for _ in range(rnd.randint(0, 3)):
+        index = rnd.randrange(len(words))
+        words[index] = rnd.choice((
+            f"**{words[index]}**", f"*{words[index]}*", f"_{words[index]}_", f"`{words[index]}`",
+            f"[{words[index]}](https://example.com/{words[index]}?utm_source=bot&id={rnd.randint(1, 999)})",
+            "https://docs.example.com/guides/unit_economics_v2?lang=ru#cac_ltv", "2*3=6", "50%*", "snake_case_name",
+            "📈", "🚀", "[1]", "C:\\path\\"
+        ))
+    return ' '.join(words).capitalize() + rnd.choice(('.', '.', '!', '?', ':'))
+
+def _answer_block(rnd) -> str:
+    kind = rnd.random()
+    if kind < 0.15:
+        return f"{'#' * rnd.randint(1, 3)} {rnd.choice(('Анализ рынка', 'Шаг 2: **гипотезы**', 'Итоги 🎯', 'Риски'))}"
+    if kind < 0.35:
+        return '\n'.join(f"{rnd.choice(('-', '*', '1.', '  -'))} {_answer_sentence(rnd)}" for _ in range(rnd.randint(2, 8)))
+    if kind < 0.45:
+        lines = [f"    value_{index} = compute(data['*'], factor_{index}) * 1.5  # `шаг` {index}"
+                 for index in range(rnd.choice((5, 20, 200)))]
+        return '```python\n' + '\n'.join(lines) + '\n```'
+    if kind < 0.5:
+        return "| Метрика | Значение |\n|---|---|\n" + '\n'.join(
+            f"| {rnd.choice(_ANSWER_WORDS)} | {rnd.randint(1, 100)}% |" for _ in range(rnd.randint(3, 10)))
+    if kind < 0.53:
+        return '---'
+    if kind < 0.56:
+        # Абзац без единого переноса строки длиннее сообщения
+        return ' '.join(_answer_sentence(rnd) for _ in range(60))
+    return ' '.join(_answer_sentence(rnd) for _ in range(rnd.randint(2, 8)))
+
+def assistant_answer(size: int, seed: int) -> str:
+    """Ответ ассистента в Markdown размером около size байт: заголовки, списки, код, ссылки, таблицы."""
+    import random
+    rnd = random.Random(seed)
+    blocks: List[str] = []
+    total = 0
+    while total < size:
+        block = _answer_block(rnd)
+        blocks.append(block)
+        total += len(block.encode('utf-8')) + 2
+    return '\n\n'.join(blocks)
+
+def _entities_error(message) -> Optional[str]:
+    """Ошибка выделений сообщения так, как ее вернул бы Telegram, или None."""
+    from fake_servers import check_entities
+    try:
+        check_entities(message.text, [entity.to_dict() for entity in message.entities])
+    except ValueError as e:
+        return str(e)
+    return None
+
+def bench_format(answers: int, min_kb: int, max_kb: int):
+    """Форматирование и разбиение больших ответов: скорость, потоковый режим и ошибки выделений."""
+    import random
+    import re
+    from telegram_format import MAX_MESSAGE_LENGTH, MarkdownChunker, format_response, utf16_len
+
+    rnd = random.Random(7)
+    corpus = [assistant_answer(rnd.randint(min_kb, max_kb) * 1024, seed) for seed in range(answers)]
+    corpus_bytes = sum(len(answer.encode('utf-8')) for answer in corpus)
+
+    timings: List[float] = []
+    results: List[list] = []
+    for answer in corpus:
+        started = time.perf_counter()
+        results.append(format_response(answer))
+        timings.append(time.perf_counter() - started)
+    total = sum(timings)
+
+    # Потоковый режим: те же ответы фрагментами по 1-40 символов, как дельты от OpenAI
+    stream_started = time.perf_counter()
+    mismatches = 0
+    for answer, expected in zip(corpus, results):
+        chunker = MarkdownChunker()
+        chunks: list = []
+        position = 0
+        while position < len(answer):
+            step = rnd.randint(1, 40)
+            chunks += chunker.feed(answer[position:position + step])
+            position += step
+        chunks += chunker.finish()
+        mismatches += chunks != expected
+    stream_elapsed = time.perf_counter() - stream_started
+
+    # Проверки каждого сообщения так, как их делает Telegram, и целостность URL
+    entity_errors = too_long = lost_urls = messages = entities = 0
+    url_pattern = re.compile(r'https?://[^\s<>()\[\]"\'*`]*[^\s<>()\[\]"\'*`.,;:!?]')
+    for answer, chunks in zip(corpus, results):
+        for chunk in chunks:
+            messages += 1
+            entities += len(chunk.entities)
+            if utf16_len(chunk.text) > MAX_MESSAGE_LENGTH:
+                too_long += 1
+            if _entities_error(chunk):
+                entity_errors += 1
+        # URL цел, если одно сообщение содержит его целиком в тексте или в адресе ссылки
+        for url in set(url_pattern.findall(answer)):
+            if not any(url in chunk.text or any(url in (entity.url or '') for entity in chunk.entities)
+                       for chunk in chunks):
+                lost_urls += 1
+
+    print(f"\n{'='*60}")
+    print(f"FORMAT: {answers} ответов по {min_kb}-{max_kb} КБ, всего {corpus_bytes / 1024 / 1024:.1f} МБ")
+    print(f"{'='*60}")
+    print(f"Целиком: {corpus_bytes / total / 1024 / 1024:.1f} МБ/с, p50 {percentile(timings, 50) * 1000:.2f} мс "
+          f"и p99 {percentile(timings, 99) * 1000:.2f} мс на ответ")
+    print(f"Потоком: {corpus_bytes / stream_elapsed / 1024 / 1024:.1f} МБ/с, расхождений с целым ответом: {mismatches}")
+    print(f"Сообщений: {messages}, выделений: {entities}, некорректных выделений: {entity_errors}, "
+          f"длиннее лимита: {too_long}, разорванных URL: {lost_urls}")
+    print(f"{'='*60}\n")
+
+# Фрагменты случайного Markdown для format-fuzz: непарные маркеры, вложенные выделения, ссылки,
+# ограничители блоков кода и символы вне BMP, которые в UTF-16 занимают две единицы
+_FUZZ_TOKENS = ('*', '**', '_', '__', '`', '```', '```py', '[', ']', '(', ')', 'https://a.b/c_d', '\\', ' ', '\n',
+                '\n\n', '\r\n', '# ', '- ', '  * ', 'a', 'bc', 'слово', '😀', '👨‍👩‍👧', '𝔘', '.', ' x. ', '---',
+                'tg://x', '[t](https://x.y/z_w)', '**[ж](https://x.y)**', '*a `c` b*', 'é')
+
+def bench_format_fuzz(cases: int, seed: int):
+    """Случайный Markdown через format_response и MarkdownChunker: инварианты сообщений и выделений."""
+    import random
+    import re
+    from telegram_format import MarkdownChunker, format_response, utf16_len
+
+    rnd = random.Random(seed)
+    failures: Counter = Counter()
+    examples: Dict[str, str] = {}
+    messages = 0
+
+    def fail(kind: str, text: str, limit: int):
+        failures[kind] += 1
+        examples.setdefault(kind, f"limit={limit} text={text[:300]!r}")
+
+    def visible(chunks) -> str:
+        return re.sub(r'\s+', '', ''.join(chunk.text for chunk in chunks))
+
+    started = time.perf_counter()
+    for _ in range(cases):
+        text = ''.join(rnd.choice(_FUZZ_TOKENS) for _ in range(rnd.randint(1, 400)))
+        limit = rnd.choice((40, 64, 100, 300, 4096))
+        chunks = format_response(text, limit)
+        messages += len(chunks)
+        for chunk in chunks:
+            if utf16_len(chunk.text) > limit:
+                fail('длиннее лимита', text, limit)
+            if not chunk.text.strip():
+                fail('пустое сообщение', text, limit)
+            if _entities_error(chunk):
+                fail('некорректные выделения', text, limit)
+
+        # Поток фрагментами по 1-9 символов: те же сообщения, корректный промежуточный показ
+        chunker = MarkdownChunker(limit)
+        streamed: list = []
+        position = 0
+        while position < len(text):
+            step = rnd.randint(1, 9)
+            streamed += chunker.feed(text[position:position + step])
+            preview = chunker.preview()
+            if utf16_len(preview.text) > limit or _entities_error(preview):
+                fail('некорректный промежуточный показ', text, limit)
+            position += step
+        streamed += chunker.finish()
+        if streamed != chunks:
+            fail('поток отличается от целого ответа', text, limit)
+
+        # Разбиение не теряет и не повторяет текст, если в ответе нет строк длиннее 2 * limit
+        if max(len(line) for line in text.split('\n')) <= 2 * limit:
+            if visible(chunks) != visible(format_response(text, 4 * len(text) + 16)):
+                fail('текст потерян при разбиении', text, limit)
+    elapsed = time.perf_counter() - started
+
+    print(f"\n{'='*60}")
+    print(f"FORMAT FUZZ: {cases} случайных ответов, seed {seed}")
+    print(f"{'='*60}")
+    print(f"Сообщений: {messages}, {cases / elapsed:.0f} ответов/с (целиком и потоком)")
+    if not failures:
+        print("Нарушений нет")
+    for kind, count in failures.most_common():
+        print(f"{kind}: {count}, например {examples[kind]}")
+    print(f"{'='*60}\n")
+
+def main():
+    """Главная функция CLI."""
+    if len(sys.argv) < 2:
+        print("Использование:")
+        print("  python benchmarks.py concurrency [1,2,4,8,16] [turns] [run_latency]")
+        print("      - пропускная способность ассистентского пути против fake OpenAI")
+        print("  python benchmarks.py ttft [samples] [run_latency] [first_token_latency]")
+        print("      - время до первого видимого текста: опрос против потокового режима")
+        print("  python benchmarks.py fetch [10,50,200] [samples]")
+        print("      - размер и время получения ответа в зависимости от длины потока")
+        print("  python benchmarks.py activity [touches] [users]")
+        print("      - коммиты SQLite при обновлении last_activity: по одному против пакетов")
+        print("  python benchmarks.py db-blocking [hold_seconds] [requests]")
+        print("      - задержка цикла событий, пока другая транзакция держит блокировку записи")
+        print("  python benchmarks.py http-load [connections] [requests] [health|register]")
+        print("      - запросов/с и p99 HTTP API бота на localhost")
+        print("  python benchmarks.py init-data [count] [distinct]")
+        print("      - проверок initData Mini App в секунду: без кэша ключа, с ключом, с LRU")
+        print("  python benchmarks.py webhook-replay [connections] [count|updates.jsonl]")
+        print("      - прием обновлений Telegram через webhook: обновлений/с и задержка подтверждения")
+        print("  python benchmarks.py e2e [users] [turns] [run_latency] [failure_rate] [error_rate]")
+        print("      - путь пользователя от /start до разговора с ассистентом: сообщений/с, p50/p95/p99")
+        print("  python benchmarks.py replay traffic.jsonl.gz [1|10|max]")
+        print("      - воспроизведение записанного трафика (traffic_recorder.py) с исходными интервалами")
+        print("  python benchmarks.py format [answers] [min_kb] [max_kb]")
+        print("      - форматирование и разбиение ответов 20-50 КБ: МБ/с и ошибки выделений Telegram")
+        print("  python benchmarks.py format-fuzz [cases] [seed]")
+        print("      - случайный Markdown: длина и выделения сообщений, поток против целого ответа")
+        print("  python benchmarks.py sharding [1,2,4] [updates] [users]")
+        print("      - обработка обновлений несколькими процессами-воркерами (sharding.py)")
+        return
+
+    command = sys.argv[1].lower()
+
+    if command == 'concurrency':
+        levels = [int(x) for x in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4, 8, 16, 32]
+        turns = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+        run_latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+        asyncio.run(bench_concurrency(levels, turns, run_latency))
+    elif command == 'ttft':
+        samples = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+        run_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+        first_token_latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+        asyncio.run(bench_ttft(samples, run_latency, first_token_latency))
+    elif command == 'fetch':
+        sizes = [int(x) for x in sys.argv[2].split(',')] if len(sys.argv) > 2 else [10, 50, 200]
+        samples = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        asyncio.run(bench_fetch(sizes, samples))
+    elif command == 'activity':
+        touches = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+        users = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+        asyncio.run(bench_activity(touches, users))
+    elif command == 'db-blocking':
+        hold = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+        requests = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        asyncio.run(bench_db_blocking(hold, requests))
+    elif command == 'http-load':
+        connections = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        total = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+        endpoint = sys.argv[4] if len(sys.argv) > 4 else 'health'
+        asyncio.run(bench_http_load(connections, total, endpoint))
+    elif command == 'init-data':
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        distinct = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+        bench_init_data(count, distinct)
+    elif command == 'webhook-replay':
+        connections = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+        source = sys.argv[3] if len(sys.argv) > 3 else '10000'
+        updates = synthetic_updates(int(source), 500) if source.isdigit() else load_updates(source)
+        asyncio.run(bench_webhook_replay(connections, updates))
+    elif command == 'e2e':
+        users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        turns = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+        run_latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.5
+        failure_rate = float(sys.argv[5]) if len(sys.argv) > 5 else 0.0
+        error_rate = float(sys.argv[6]) if len(sys.argv) > 6 else 0.0
+        asyncio.run(bench_e2e(users, turns, run_latency, failure_rate, error_rate))
+    elif command == 'replay':
+        from traffic_recorder import parse_speed
+        speed = parse_speed(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        asyncio.run(bench_replay(sys.argv[2], speed))
+    elif command == 'format':
+        answers = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        min_kb = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+        max_kb = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+        bench_format(answers, min_kb, max_kb)
+    elif command == 'format-fuzz':
+        cases = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+        seed = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        bench_format_fuzz(cases, seed)
+    elif command == 'sharding':
+        levels = [int(x) for x in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 4]
+        count = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+        users = int(sys.argv[4]) if len(sys.argv) > 4 else 500
+        asyncio.run(bench_sharding(levels, count, users))
+    else:
+        print(f"Неизвестная команда: {command}")
+
+if __name__ == '__main__':
+    main()
@@ -7,12 +7,13 @@ Database Migration Script for Telegram Bot
 Этот скрипт управляет миграциями базы данных для системы регистрации пользователей.
 """
 
-import sqlite3
 import os
 import logging
 from datetime import datetime
 from typing import List, Dict, Any
 
+from storage import get_database
+
 # Настройка логирования
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
@@ -25,6 +26,7 @@ class DatabaseMigrator:
     
     def __init__(self, db_path: str = 'users.db'):
         self.db_path = db_path
+        self.db = get_database(db_path)
         self.migrations = self._get_migrations()
     
     def _get_migrations(self) -> List[Dict[str, Any]]:
@@ -93,35 +95,58 @@ class DatabaseMigrator:
                 CREATE INDEX IF NOT EXISTS idx_sessions_started_at ON user_sessions(started_at);
                 ''',
                 'rollback': 'DROP TABLE IF EXISTS user_sessions;'
+            },
+            {
+                'version': '2.2.0',
+                'description': 'Индексы для восстановления активных сессий',
+                'sql': '''
+                CREATE INDEX IF NOT EXISTS idx_sessions_open ON user_sessions(telegram_id) WHERE ended_at IS NULL;
+                CREATE INDEX IF NOT EXISTS idx_sessions_thread_id ON user_sessions(thread_id);
+                ''',
+                'rollback': '''
+                DROP INDEX IF EXISTS idx_sessions_open;
+                DROP INDEX IF EXISTS idx_sessions_thread_id;
+                '''
+            },
+            {
+                'version': '2.3.0',
+                'description': 'Добавление очереди удаления потоков OpenAI',
+                'sql': '''
+                CREATE TABLE IF NOT EXISTS thread_deletions (
+                    thread_id TEXT PRIMARY KEY,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    next_attempt_at REAL NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_thread_deletions_next ON thread_deletions(next_attempt_at);
+                ''',
+                'rollback': 'DROP TABLE IF EXISTS thread_deletions;'
             }
         ]
     
     def get_current_version(self) -> str:
         """Получает текущую версию базы данных."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Проверяем, существует ли таблица migration_history
-            cursor.execute('''
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='migration_history'
-            ''')
-            
-            if not cursor.fetchone():
-                conn.close()
-                return '0.0.0'
-            
-            # Получаем последнюю примененную миграцию
-            cursor.execute('''
-                SELECT version FROM migration_history 
-                WHERE success = TRUE 
-                ORDER BY applied_at DESC 
-                LIMIT 1
-            ''')
-            
-            result = cursor.fetchone()
-            conn.close()
+            with self.db.read() as cursor:
+                # Проверяем, существует ли таблица migration_history
+                cursor.execute('''
+                    SELECT name FROM sqlite_master 
+                    WHERE type='table' AND name='migration_history'
+                ''')
+                
+                if not cursor.fetchone():
+                    return '0.0.0'
+                
+                # Получаем последнюю примененную миграцию
+                cursor.execute('''
+                    SELECT version FROM migration_history 
+                    WHERE success = TRUE 
+                    ORDER BY applied_at DESC 
+                    LIMIT 1
+                ''')
+                
+                result = cursor.fetchone()
             
             return result[0] if result else '0.0.0'
             
@@ -132,16 +157,11 @@ class DatabaseMigrator:
     def record_migration(self, version: str, description: str, success: bool = True):
         """Записывает информацию о миграции в историю."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO migration_history (version, description, success)
-                VALUES (?, ?, ?)
-            ''', (version, description, success))
-            
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                cursor.execute('''
+                    INSERT INTO migration_history (version, description, success)
+                    VALUES (?, ?, ?)
+                ''', (version, description, success))
             
         except Exception as e:
             logger.error(f"Ошибка при записи миграции: {e}")
@@ -151,17 +171,12 @@ class DatabaseMigrator:
         try:
             logger.info(f"Применение миграции {migration['version']}: {migration['description']}")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Выполняем SQL команды
-            for sql_command in migration['sql'].split(';'):
-                sql_command = sql_command.strip()
-                if sql_command:
-                    cursor.execute(sql_command)
-            
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                # Выполняем SQL команды
+                for sql_command in migration['sql'].split(';'):
+                    sql_command = sql_command.strip()
+                    if sql_command:
+                        cursor.execute(sql_command)
             
             # Записываем успешную миграцию
             self.record_migration(migration['version'], migration['description'], True)
@@ -179,17 +194,12 @@ class DatabaseMigrator:
         try:
             logger.info(f"Откат миграции {migration['version']}: {migration['description']}")
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Выполняем команды отката
-            for sql_command in migration['rollback'].split(';'):
-                sql_command = sql_command.strip()
-                if sql_command:
-                    cursor.execute(sql_command)
-            
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                # Выполняем команды отката
+                for sql_command in migration['rollback'].split(';'):
+                    sql_command = sql_command.strip()
+                    if sql_command:
+                        cursor.execute(sql_command)
             
             logger.info(f"Откат миграции {migration['version']} успешно выполнен")
             return True
@@ -302,32 +312,28 @@ class DatabaseMigrator:
     def get_user_stats(self) -> Dict[str, Any]:
         """Возвращает статистику пользователей."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Общее количество пользователей
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            # Количество зарегистрированных пользователей
-            cursor.execute('SELECT COUNT(*) FROM users WHERE status = ?', ('registered',))
-            registered_users = cursor.fetchone()[0]
-            
-            # Количество пользователей за последние 24 часа
-            cursor.execute('''
-                SELECT COUNT(*) FROM users 
-                WHERE created_at > datetime('now', '-1 day')
-            ''')
-            recent_users = cursor.fetchone()[0]
-            
-            # Количество активных пользователей за последние 24 часа
-            cursor.execute('''
-                SELECT COUNT(*) FROM users 
-                WHERE last_activity > datetime('now', '-1 day')
-            ''')
-            active_users = cursor.fetchone()[0]
-            
-            conn.close()
+            with self.db.read() as cursor:
+                # Общее количество пользователей
+                cursor.execute('SELECT COUNT(*) FROM users')
+                total_users = cursor.fetchone()[0]
+                
+                # Количество зарегистрированных пользователей
+                cursor.execute('SELECT COUNT(*) FROM users WHERE status = ?', ('registered',))
+                registered_users = cursor.fetchone()[0]
+                
+                # Количество пользователей за последние 24 часа
+                cursor.execute('''
+                    SELECT COUNT(*) FROM users 
+                    WHERE created_at > datetime('now', '-1 day')
+                ''')
+                recent_users = cursor.fetchone()[0]
+                
+                # Количество активных пользователей за последние 24 часа
+                cursor.execute('''
+                    SELECT COUNT(*) FROM users 
+                    WHERE last_activity > datetime('now', '-1 day')
+                ''')
+                active_users = cursor.fetchone()[0]
             
             return {
                 'total_users': total_users,
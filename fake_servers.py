@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+"""
+Fake API Servers for Telegram Bot Benchmarks
+
+Локальные заглушки внешних API для нагрузочного тестирования бота без сети.
+"""
+
+import json
+import re
+import time
+import random
+import socket
+import logging
+import itertools
+from threading import Thread, Lock
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class _FakeServer:
+    """Общая часть заглушек: HTTP сервер в фоновом потоке и счетчики вызовов.
+
+    error_rate — доля запросов, на которые сервер отвечает ошибкой 500.
+    """
+
+    name = 'Fake'
+
+    def __init__(self, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.calls: Counter = Counter()
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def inject_error(self) -> bool:
+        """Решает, ответить ли на очередной запрос ошибкой (и считает такие ответы)."""
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return False
+            self.calls['injected_errors'] += 1
+            return True
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Запускает сервер на свободном порту в фоновом потоке."""
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _make_handler(self))
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, daemon=True).start()
+        logger.info(f"{self.name} сервер запущен: {self.address}")
+        return self
+
+    def stop(self):
+        """Останавливает сервер."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Dict[str, Any]):
+        raise NotImplementedError
+
+class FakeOpenAIServer(_FakeServer):
+    """Заглушка OpenAI Assistants API (threads, messages, runs)."""
+
+    name = 'Fake OpenAI'
+
+    def __init__(self, run_latency: float = 0.5, response_text: str = "Ответ ассистента.",
+                 first_token_latency: float = 0.2, stream_chunks: int = 20,
+                 run_failure_rate: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None,
+                 run_latencies: Optional[List[float]] = None):
+        super().__init__(error_rate, seed)
+        self.run_latency = run_latency
+        # Если задано, длительность каждого выполнения выбирается из этой выборки (например, из записи трафика)
+        self.run_latencies = run_latencies
+        # Доля выполнений, которые завершаются статусом failed
+        self.run_failure_rate = run_failure_rate
+        self.response_text = response_text
+        self.first_token_latency = min(first_token_latency, run_latency)
+        self.stream_chunks = stream_chunks
+        self.threads: Dict[str, List[Dict[str, Any]]] = {}
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/v1"
+
+    def seed_thread(self, message_count: int, text: str) -> str:
+        """Создает поток с историей из чередующихся сообщений пользователя и ассистента."""
+        with self._lock:
+            thread_id = self._new_id('thread')
+            self.threads[thread_id] = [
+                self._message(thread_id, 'user' if i % 2 == 0 else 'assistant', text,
+                              None if i % 2 == 0 else self._new_id('run'))
+                for i in range(message_count)
+            ]
+            return thread_id
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids):08d}"
+
+    def _message(self, thread_id: str, role: str, text: str, run_id: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            'id': self._new_id('msg'),
+            'object': 'thread.message',
+            'created_at': int(time.time()),
+            'thread_id': thread_id,
+            'role': role,
+            'run_id': run_id,
+            'assistant_id': None,
+            'attachments': [],
+            'metadata': {},
+            'content': [{'type': 'text', 'text': {'value': text, 'annotations': []}}]
+        }
+
+    def _settle(self, run: Dict[str, Any]):
+        """Переводит выполнение в итоговый статус, когда истекло время генерации."""
+        if run['status'] not in ('completed', 'failed', 'cancelled') and time.time() >= run['_finish_at']:
+            if run['_fail']:
+                run['status'] = 'failed'
+                run['failed_at'] = int(run['_finish_at'])
+                run['last_error'] = {'code': 'server_error', 'message': 'Fake run failure'}
+                return
+            run['status'] = 'completed'
+            run['completed_at'] = int(run['_finish_at'])
+            self.threads[run['thread_id']].append(
+                self._message(run['thread_id'], 'assistant', self.response_text, run['id'])
+            )
+
+    def _has_active_run(self, thread_id: str) -> bool:
+        for run in self.runs.values():
+            if run['thread_id'] == thread_id:
+                self._settle(run)
+                if run['status'] not in ('completed', 'failed', 'cancelled'):
+                    return True
+        return False
+
+    def _public_run(self, run: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v for k, v in run.items() if not k.startswith('_')}
+
+    def _stream_run(self, run: Dict[str, Any]):
+        """Генератор SSE-событий выполнения: дельты текста, затем завершение."""
+        with self._lock:
+            created = self._public_run(run)
+        yield 'thread.run.created', created
+        if run['_fail']:
+            time.sleep(self.run_latency)
+            with self._lock:
+                run['_finish_at'] = min(run['_finish_at'], time.time())
+                self._settle(run)
+                failed = self._public_run(run)
+            yield 'thread.run.failed', failed
+            return
+        message_id = self._new_id('msg')
+        text = self.response_text
+        step = max(1, len(text) // self.stream_chunks)
+        pieces = [text[i:i + step] for i in range(0, len(text), step)]
+        pause = (self.run_latency - self.first_token_latency) / max(1, len(pieces))
+
+        time.sleep(self.first_token_latency)
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(pause)
+            yield 'thread.message.delta', {
+                'id': message_id,
+                'object': 'thread.message.delta',
+                'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': piece, 'annotations': []}}]}
+            }
+
+        with self._lock:
+            run['_finish_at'] = min(run['_finish_at'], time.time())
+            self._settle(run)
+            completed = self._public_run(run)
+        yield 'thread.run.completed', completed
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Dict[str, Any]):
+        """Маршрутизирует запрос и возвращает (status, payload)."""
+        if self.inject_error():
+            return 500, {'error': {'message': 'The server had an error processing your request.', 'type': 'server_error'}}
+        with self._lock:
+            if method == 'POST' and path == '/v1/threads':
+                self.calls['threads.create'] += 1
+                thread_id = self._new_id('thread')
+                self.threads[thread_id] = []
+                return 200, {'id': thread_id, 'object': 'thread', 'created_at': int(time.time()), 'metadata': {}}
+
+            match = re.fullmatch(r'/v1/threads/([^/]+)', path)
+            if match and method == 'DELETE':
+                self.calls['threads.delete'] += 1
+                deleted = self.threads.pop(match.group(1), None) is not None
+                return 200, {'id': match.group(1), 'object': 'thread.deleted', 'deleted': deleted}
+
+            match = re.fullmatch(r'/v1/threads/([^/]+)/messages', path)
+            if match:
+                thread_id = match.group(1)
+                if thread_id not in self.threads:
+                    return 404, {'error': {'message': 'No thread found', 'type': 'invalid_request_error'}}
+                if method == 'POST':
+                    self.calls['messages.create'] += 1
+                    if self._has_active_run(thread_id):
+                        return 400, {'error': {
+                            'message': f"Can't add messages to {thread_id} while a run is active.",
+                            'type': 'invalid_request_error'
+                        }}
+                    message = self._message(thread_id, body.get('role', 'user'), str(body.get('content', '')))
+                    self.threads[thread_id].append(message)
+                    return 200, message
+                self.calls['messages.list'] += 1
+                for run in self.runs.values():
+                    if run['thread_id'] == thread_id:
+                        self._settle(run)
+                data = self.threads[thread_id]
+                if 'run_id' in query:
+                    data = [m for m in data if m['run_id'] == query['run_id'][0]]
+                if query.get('order', ['desc'])[0] == 'desc':
+                    data = list(reversed(data))
+                data = data[:int(query.get('limit', ['20'])[0])]
+                return 200, {
+                    'object': 'list',
+                    'data': data,
+                    'first_id': data[0]['id'] if data else None,
+                    'last_id': data[-1]['id'] if data else None,
+                    'has_more': False
+                }
+
+            match = re.fullmatch(r'/v1/threads/([^/]+)/runs', path)
+            if match and method == 'POST':
+                self.calls['runs.create'] += 1
+                thread_id = match.group(1)
+                if thread_id not in self.threads:
+                    return 404, {'error': {'message': 'No thread found', 'type': 'invalid_request_error'}}
+                now = time.time()
+                run = {
+                    'id': self._new_id('run'),
+                    'object': 'thread.run',
+                    'created_at': int(now),
+                    'thread_id': thread_id,
+                    'assistant_id': body.get('assistant_id'),
+                    'status': 'queued',
+                    'completed_at': None,
+                    '_finish_at': now + (self._random.choice(self.run_latencies)
+                                         if self.run_latencies else self.run_latency),
+                    '_fail': self._random.random() < self.run_failure_rate
+                }
+                self.runs[run['id']] = run
+                if body.get('stream'):
+                    return 200, self._stream_run(run)
+                return 200, self._public_run(run)
+
+            match = re.fullmatch(r'/v1/threads/([^/]+)/runs/([^/]+)', path)
+            if match and method == 'GET':
+                self.calls['runs.retrieve'] += 1
+                run = self.runs.get(match.group(2))
+                if not run:
+                    return 404, {'error': {'message': 'No run found', 'type': 'invalid_request_error'}}
+                self._settle(run)
+                if run['status'] == 'queued':
+                    run['status'] = 'in_progress'
+                return 200, self._public_run(run)
+
+            match = re.fullmatch(r'/v1/threads/([^/]+)/runs/([^/]+)/cancel', path)
+            if match and method == 'POST':
+                self.calls['runs.cancel'] += 1
+                run = self.runs.get(match.group(2))
+                if not run:
+                    return 404, {'error': {'message': 'No run found', 'type': 'invalid_request_error'}}
+                self._settle(run)
+                if run['status'] not in ('completed', 'failed', 'cancelled'):
+                    run['status'] = 'cancelled'
+                    run['cancelled_at'] = int(time.time())
+                return 200, self._public_run(run)
+
+        return 404, {'error': {'message': f'Unknown route {method} {path}', 'type': 'invalid_request_error'}}
+
+def parse_telegram_markdown(text: str) -> str:
+    """Разбор текста с parse_mode='Markdown' по правилам Telegram; возвращает текст без разметки.
+
+    Вне выделений \\ экранирует _ * ` [; внутри выделения ищется только его закрывающий символ.
+    Незакрытое выделение — ошибка ValueError, как ответ 400 "can't parse entities" от Telegram.
+    """
+    result: List[str] = []
+    size = len(text)
+    i = 0
+    while i < size:
+        char = text[i]
+        if char == '\\' and i + 1 < size and text[i + 1] in '_*`[':
+            result.append(text[i + 1])
+            i += 2
+            continue
+        if char not in '_*`[':
+            result.append(char)
+            i += 1
+            continue
+        begin = i
+        end_char = ']' if char == '[' else char
+        is_pre = char == '`' and text[i + 1:i + 3] == '``'
+        i += 3 if is_pre else 1
+        if is_pre:
+            # Язык блока до конца первой строки и сам перенос строки в текст не входят
+            language_end = i
+            while language_end < size and not text[language_end].isspace() and text[language_end] != '`':
+                language_end += 1
+            if language_end < size and text[language_end] != '`':
+                i = language_end
+            if i < size and text[i] in '\r\n':
+                i += 1
+            end = text.find('```', i)
+        else:
+            end = text.find(end_char, i)
+        if end < 0:
+            raise ValueError(f"Can't find end of the entity starting at byte offset {len(text[:begin].encode('utf-8'))}")
+        result.append(text[i:end])
+        i = end + (3 if is_pre else 1)
+        if char == '[' and i < size and text[i] == '(':
+            url_end = text.find(')', i)
+            if url_end < 0:
+                raise ValueError(f"Can't find end of a URL at byte offset {len(text[:i].encode('utf-8'))}")
+            i = url_end + 1
+    return ''.join(result)
+
+# Выделения, которые не могут содержать другие выделения и находиться внутри них (кроме форматирования текста)
+_ATOMIC_ENTITIES = {'code', 'pre'}
+_TEXT_STYLES = {'bold', 'italic', 'underline', 'strikethrough', 'spoiler'}
+_ENTITY_TYPES = _ATOMIC_ENTITIES | _TEXT_STYLES | {
+    'url', 'text_link', 'mention', 'hashtag', 'cashtag', 'bot_command', 'email', 'phone_number',
+    'text_mention', 'blockquote', 'custom_emoji'
+}
+
+def check_entities(text: str, entities: List[Dict[str, Any]]):
+    """Проверка выделений сообщения (entities): смещения и длины в UTF-16 и вложенность.
+
+    Нарушение — ValueError. Границы выделения не должны делить суррогатную пару, а два выделения
+    с общими символами должны быть вложены одно в другое; pre и code не пересекаются с другими,
+    кроме форматирования текста, url и text_link не вкладываются друг в друга.
+    """
+    units = text.encode('utf-16-le')
+    size = len(units) // 2
+    spans = []
+    for entity in entities:
+        kind = entity.get('type')
+        offset, length = entity.get('offset'), entity.get('length')
+        if kind not in _ENTITY_TYPES:
+            raise ValueError(f"unsupported entity type {kind!r}")
+        if not isinstance(offset, int) or not isinstance(length, int) or offset < 0 or length <= 0:
+            raise ValueError(f"invalid entity offset or length: {entity}")
+        if offset + length > size:
+            raise ValueError(f"entity ends beyond the end of the text: {entity}")
+        for position in (offset, offset + length):
+            if position < size and 0xDC00 <= int.from_bytes(units[2 * position:2 * position + 2], 'little') <= 0xDFFF:
+                raise ValueError(f"entity boundary splits a UTF-16 surrogate pair: {entity}")
+        if kind == 'text_link' and not entity.get('url'):
+            raise ValueError("text_link entity without url")
+        spans.append((offset, offset + length, kind))
+    for index, (start, end, kind) in enumerate(spans):
+        for other_start, other_end, other_kind in spans[index + 1:]:
+            if other_start >= end or start >= other_end:
+                continue
+            nested = (start <= other_start and other_end <= end) or (other_start <= start and end <= other_end)
+            if not nested:
+                raise ValueError(f"entities {kind} and {other_kind} partially overlap")
+            if kind in _TEXT_STYLES or other_kind in _TEXT_STYLES:
+                if kind in _ATOMIC_ENTITIES or other_kind in _ATOMIC_ENTITIES:
+                    raise ValueError(f"entity {kind} can't be nested with {other_kind}")
+                continue
+            raise ValueError(f"entity {kind} can't be nested with {other_kind}")
+
+class FakeTelegramServer(_FakeServer):
+    """Заглушка Telegram Bot API: отвечает на вызовы бота и считает отправленные сообщения."""
+
+    name = 'Fake Telegram'
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, seed: Optional[int] = None):
+        super().__init__(error_rate, seed)
+        self.latency = latency
+        self.sent: List[Dict[str, Any]] = []
+        self.sent_by_chat: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def base_url(self) -> str:
+        """Базовый URL для ApplicationBuilder.base_url (токен дописывается ботом)."""
+        return f"{self.address}/bot"
+
+    def _message(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(body.get('chat_id', 0))
+        return {
+            'message_id': int(body.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'fake_bot'},
+            'text': body.get('text', '')
+        }
+
+    @staticmethod
+    def _check_text(body: Dict[str, Any]) -> Optional[str]:
+        """Проверки текста сообщения, которые делает Telegram: разметка, выделения и длина."""
+        text = body.get('text', '')
+        if body.get('parse_mode') == 'Markdown':
+            try:
+                text = parse_telegram_markdown(text)
+            except ValueError as e:
+                return f"can't parse entities: {e}"
+        elif body.get('entities'):
+            entities = body['entities']
+            try:
+                check_entities(text, json.loads(entities) if isinstance(entities, str) else entities)
+            except ValueError as e:
+                return f"can't parse entities: {e}"
+        if not text.strip():
+            return "message text is empty"
+        if len(text.encode('utf-16-le')) // 2 > 4096:
+            return "message is too long"
+        return None
+
+    def handle(self, method: str, path: str, query: Dict[str, List[str]], body: Dict[str, Any]):
+        """Маршрутизирует вызов метода Bot API и возвращает (status, payload)."""
+        api_method = path.rsplit('/', 1)[-1]
+        if self.latency:
+            time.sleep(self.latency)
+        if api_method != 'getMe' and self.inject_error():
+            return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        with self._lock:
+            self.calls[api_method] += 1
+            if api_method == 'getMe':
+                result: Any = {
+                    'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'fake_bot',
+                    'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': True
+                }
+            elif api_method in ('sendMessage', 'editMessageText'):
+                error = self._check_text(body)
+                if error:
+                    self.calls['rejected_messages'] += 1
+                    return 400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {error}"}
+                result = self._message(body)
+                self.sent.append({'method': api_method, 'chat_id': result['chat']['id'], 'text': result['text']})
+                if api_method == 'sendMessage':
+                    self.sent_by_chat[result['chat']['id']] += 1
+            elif api_method == 'getUpdates':
+                result = []
+            else:
+                result = True
+        return 200, {'ok': True, 'result': result}
+
+def _make_handler(server: _FakeServer):
+    """Создает класс обработчика HTTP, привязанный к заглушке."""
+
+    class FakeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _dispatch(self, method: str):
+            parsed = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if raw and self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+                # Так параметры отправляет python-telegram-bot
+                body = {key: values[0] for key, values in parse_qs(raw.decode('utf-8')).items()}
+            else:
+                body = json.loads(raw) if raw else {}
+            status, payload = server.handle(method, parsed.path, parse_qs(parsed.query), body)
+            if not isinstance(payload, dict):
+                self._send_events(payload)
+                return
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_events(self, events):
+            """Отдает поток server-sent events и закрывает соединение."""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            for event, data in events:
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"event: done\ndata: [DONE]\n\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def do_DELETE(self):
+            self._dispatch('DELETE')
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeHandler
@@ -0,0 +1,203 @@
+"""
+Async HTTP Server for Telegram Bot
+
+Небольшой HTTP/1.1 сервер на asyncio для API бота (health check,
+регистрация из Mini App). Работает в цикле событий бота: соединения
+обслуживаются параллельно, поддерживается keep-alive, размер запроса и
+время ожидания на каждом этапе ограничены.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Request:
+    """Разобранный HTTP-запрос."""
+    method: str
+    path: str
+    query: str
+    headers: Dict[str, str]
+    body: bytes = b''
+
+@dataclass
+class Response:
+    """HTTP-ответ обработчика."""
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'application/json'
+    headers: Dict[str, str] = field(default_factory=dict)
+
+# Обработчик запроса: Request -> Response
+Handler = Callable[[Request], Awaitable[Response]]
+
+class HTTPError(Exception):
+    """Ошибка разбора запроса, после которой соединение закрывается."""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+class AsyncHTTPServer:
+    """HTTP/1.1 сервер с keep-alive и ограничениями на размер и время запроса."""
+
+    def __init__(self, handler: Handler, host: str = '0.0.0.0', port: int = 8080,
+                 max_body_size: int = 64 * 1024, max_header_size: int = 16 * 1024,
+                 request_timeout: float = 10.0, keepalive_timeout: float = 15.0,
+                 max_connections: int = 1000):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.max_header_size = max_header_size
+        self.request_timeout = request_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.max_connections = max_connections
+        self.requests = 0
+        self.errors = 0
+        self.rejected = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Начинает принимать соединения в текущем цикле событий."""
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port, limit=self.max_header_size
+        )
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"API сервер запущен на порту {self.port}")
+
+    async def stop(self):
+        """Перестает принимать соединения и закрывает открытые."""
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики запросов и открытых соединений."""
+        return {
+            'connections': len(self._connections),
+            'requests': self.requests,
+            'errors': self.errors,
+            'rejected': self.rejected
+        }
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        if len(self._connections) >= self.max_connections:
+            self.rejected += 1
+            await self._write(writer, Response(503), keep_alive=False)
+            writer.close()
+            return
+
+        self._connections.add(task)
+        try:
+            first = True
+            while True:
+                # Первый запрос ждем request_timeout, следующие на том же соединении — keepalive_timeout
+                timeout = self.request_timeout if first else self.keepalive_timeout
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, Response(431), keep_alive=False)
+                    break
+                first = False
+
+                try:
+                    request, keep_alive = self._parse_head(head)
+                    length = int(request.headers.get('content-length', '0') or 0)
+                    if length < 0:
+                        raise HTTPError(400)
+                    if length > self.max_body_size:
+                        raise HTTPError(413)
+                    if length:
+                        request.body = await asyncio.wait_for(reader.readexactly(length), self.request_timeout)
+                except HTTPError as e:
+                    await self._write(writer, Response(e.status), keep_alive=False)
+                    break
+                except ValueError:
+                    await self._write(writer, Response(400), keep_alive=False)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+
+                self.requests += 1
+                try:
+                    response = await self.handler(request)
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Ошибка обработки {request.method} {request.path}: {e}")
+                    response = Response(500)
+
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _parse_head(self, head: bytes):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HTTPError(400)
+        if not version.startswith('HTTP/1.'):
+            raise HTTPError(505)
+
+        headers: Dict[str, str] = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HTTPError(400)
+            headers[name.strip().lower()] = value.strip()
+
+        # Тела по частям (chunked) API бота не принимает
+        if 'transfer-encoding' in headers:
+            raise HTTPError(501)
+
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            keep_alive = connection == 'keep-alive'
+        else:
+            keep_alive = connection != 'close'
+
+        url = urlsplit(target)
+        return Request(method.upper(), url.path, url.query, headers), keep_alive
+
+    async def _write(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        try:
+            reason = HTTPStatus(response.status).phrase
+        except ValueError:
+            reason = ''
+        lines = [
+            f"HTTP/1.1 {response.status} {reason}",
+            f"Content-Type: {response.content_type}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}"
+        ]
+        lines += [f"{name}: {value}" for name, value in response.headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + response.body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
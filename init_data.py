@@ -0,0 +1,151 @@
+"""
+Mini App initData Validation for Telegram Bot
+
+Проверка подписи initData, которую Mini App передает в /api/register.
+Ключ проверки (HMAC-SHA256 токена бота с ключом "WebAppData") вычисляется
+один раз при создании валидатора. Строка разбирается как query string с
+URL-декодированием значений, хэш сравнивается за постоянное время, а
+слишком старые данные (auth_date) отклоняются. Недавно проверенные строки
+хранятся в небольшом LRU-кэше: повторное открытие Mini App с теми же
+данными не требует вычисления HMAC.
+"""
+
+import hmac
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+logger = logging.getLogger(__name__)
+
+def derive_secret_key(bot_token: str) -> bytes:
+    """Ключ проверки initData для токена бота."""
+    return hmac.new(b'WebAppData', bot_token.encode('utf-8'), hashlib.sha256).digest()
+
+def data_check_string(fields: Dict[str, str]) -> bytes:
+    """Строка для подписи: все поля, кроме hash, в виде key=value по алфавиту через перевод строки."""
+    return '\n'.join(f"{key}={value}" for key, value in sorted(fields.items())).encode('utf-8')
+
+def sign_init_data(fields: Dict[str, str], bot_token: str) -> str:
+    """initData с подписью, как ее формирует Telegram (для замеров и проверок)."""
+    fields = dict(fields)
+    fields['hash'] = hmac.new(derive_secret_key(bot_token), data_check_string(fields), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+class InitDataValidator:
+    """Проверка initData Mini App с вычисленным заранее ключом и кэшем проверенных строк.
+
+    max_age — сколько секунд после auth_date данные считаются действительными (0 — без ограничения).
+    cache_size — сколько последних проверенных строк помнить (0 — без кэша).
+    """
+
+    # Допустимое опережение auth_date относительно часов сервера, в секундах
+    CLOCK_SKEW = 60
+
+    def __init__(self, bot_token: str = '', max_age: float = 86400.0, cache_size: int = 1024):
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.validations = 0
+        self.cache_hits = 0
+        self.rejected: Dict[str, int] = {'malformed': 0, 'bad_hash': 0, 'expired': 0}
+        self._hmac = None
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.set_bot_token(bot_token)
+
+    def set_bot_token(self, bot_token: str):
+        """Задает токен бота: ключ проверки вычисляется здесь, а не на каждом запросе."""
+        # Шаблон HMAC с уже обработанным ключом; на каждую проверку делается его копия
+        self._hmac = hmac.new(derive_secret_key(bot_token), digestmod=hashlib.sha256) if bot_token else None
+        with self._lock:
+            self._entries.clear()
+
+    def validate(self, init_data: Any) -> Optional[dict]:
+        """Возвращает данные пользователя (поле user) из проверенной initData или None."""
+        self.validations += 1
+        if not isinstance(init_data, str) or not init_data or self._hmac is None:
+            self._reject('malformed')
+            return None
+
+        with self._lock:
+            entry = self._entries.get(init_data)
+            if entry is not None:
+                self._entries.move_to_end(init_data)
+        if entry is not None:
+            user, auth_date = entry
+            if not self._fresh(auth_date):
+                with self._lock:
+                    self._entries.pop(init_data, None)
+                self._reject('expired')
+                return None
+            self.cache_hits += 1
+            return dict(user)
+
+        verified = self._verify(init_data)
+        if verified is None:
+            return None
+        user, auth_date = verified
+        if self.cache_size > 0:
+            with self._lock:
+                self._entries[init_data] = (user, auth_date)
+                while len(self._entries) > self.cache_size:
+                    self._entries.popitem(last=False)
+        return dict(user)
+
+    def _verify(self, init_data: str) -> Optional[Tuple[dict, int]]:
+        try:
+            pairs = parse_qsl(init_data, keep_blank_values=True, strict_parsing=True)
+        except ValueError:
+            self._reject('malformed')
+            return None
+        fields = dict(pairs)
+        received_hash = fields.pop('hash', '')
+        # Повторяющиеся поля неоднозначны: подпись могла быть вычислена для другого значения
+        if len(fields) + 1 != len(pairs) or not received_hash:
+            self._reject('malformed')
+            return None
+
+        signature = self._hmac.copy()
+        signature.update(data_check_string(fields))
+        if not hmac.compare_digest(signature.hexdigest().encode('ascii'), received_hash.encode('utf-8')):
+            self._reject('bad_hash')
+            return None
+
+        try:
+            auth_date = int(fields.get('auth_date', '0'))
+            user = json.loads(fields['user'])
+        except (KeyError, ValueError) as e:
+            logger.warning(f"Подписанная initData без корректных auth_date или user: {e}")
+            self._reject('malformed')
+            return None
+        if not isinstance(user, dict) or 'id' not in user:
+            self._reject('malformed')
+            return None
+        if not self._fresh(auth_date):
+            self._reject('expired')
+            return None
+        return user, auth_date
+
+    def _fresh(self, auth_date: int) -> bool:
+        if self.max_age <= 0:
+            return True
+        age = time.time() - auth_date
+        return -self.CLOCK_SKEW <= age <= self.max_age
+
+    def _reject(self, reason: str):
+        self.rejected[reason] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики проверок, попаданий в кэш и отказов по причинам."""
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            'validations': self.validations,
+            'cache_hits': self.cache_hits,
+            'cache_entries': entries,
+            'rejected': dict(self.rejected)
+        }
@@ -0,0 +1,91 @@
+"""
+Message Inbox for Telegram Bot
+
+Личные очереди сообщений пользователей. Пока у пользователя идет выполнение
+ассистента, новые сообщения накапливаются и затем отправляются вместе одним
+следующим выполнением — серия из N сообщений стоит одного запуска, а не N
+отклоненных попыток добавить сообщение в поток с активным выполнением.
+
+Очередь владеет выполнением пользователя: команды, меняющие активный поток
+(выбор ассистента, остановка разговора), сначала вызывают cancel — он
+отбрасывает ожидающие сообщения, отменяет текущее выполнение и дожидается
+его завершения, так что старый поток больше никто не использует.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Обработчик пачки: (user_id, тексты сообщений, последнее сообщение Telegram)
+BatchHandler = Callable[[int, List[str], Any], Awaitable[None]]
+
+class MessageInbox:
+    """Буферизует сообщения пользователя на время активного выполнения."""
+
+    def __init__(self, handler: BatchHandler):
+        self.handler = handler
+        self.batches = 0
+        self.coalesced = 0
+        self._pending: Dict[int, List[Tuple[str, Any]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    def is_busy(self, user_id: int) -> bool:
+        """Идет ли сейчас выполнение для пользователя."""
+        return user_id in self._workers
+
+    def active_count(self) -> int:
+        """Количество пользователей, для которых сейчас идет выполнение."""
+        return len(self._workers)
+
+    def submit(self, user_id: int, text: str, message: Any) -> bool:
+        """Добавляет сообщение в очередь пользователя.
+
+        Возвращает True, если сообщение ждет окончания текущего выполнения.
+        """
+        self._pending.setdefault(user_id, []).append((text, message))
+        if user_id in self._workers:
+            return True
+        self._workers[user_id] = asyncio.create_task(self._drain(user_id))
+        return False
+
+    def discard(self, user_id: int) -> int:
+        """Отбрасывает еще не отправленные сообщения пользователя."""
+        return len(self._pending.pop(user_id, []))
+
+    async def cancel(self, user_id: int) -> int:
+        """Отбрасывает ожидающие сообщения, отменяет текущее выполнение и дожидается его завершения.
+
+        Возвращает число отброшенных сообщений (без обрабатываемых в отмененном выполнении).
+        """
+        discarded = self.discard(user_id)
+        task = self._workers.get(user_id)
+        if task and task is not asyncio.current_task():
+            task.cancel()
+            # wait не поднимает CancelledError отмененной задачи и не глушит отмену вызывающего
+            await asyncio.wait([task])
+            logger.info(f"Выполнение для пользователя {user_id} отменено")
+        return discarded
+
+    async def close(self):
+        """Отменяет выполнения всех пользователей (остановка бота)."""
+        for user_id in list(self._workers):
+            await self.cancel(user_id)
+
+    async def _drain(self, user_id: int):
+        try:
+            while self._pending.get(user_id):
+                batch = self._pending.pop(user_id)
+                texts = [text for text, _ in batch]
+                self.batches += 1
+                self.coalesced += len(texts) - 1
+                if len(texts) > 1:
+                    logger.info(f"Объединено {len(texts)} сообщений пользователя {user_id} в одно выполнение")
+                try:
+                    await self.handler(user_id, texts, batch[-1][1])
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке сообщений пользователя {user_id}: {e}")
+        finally:
+            if self._workers.get(user_id) is asyncio.current_task():
+                del self._workers[user_id]
@@ -0,0 +1,239 @@
+"""
+Metrics for Telegram Bot
+
+Счетчики, гистограммы задержек и показатели состояния бота в текстовом
+формате Prometheus (эндпоинт GET /metrics). Гистограммы построены на
+LatencyHistogram из storage.py, поэтому задержки запросов к базе
+публикуются без дополнительного учета. Вызовы OpenAI замеряются через
+event hooks httpx, вызовы Telegram Bot API — через InstrumentedRequest
+(он же записывает их в трассу обновления, см. tracing.py).
+"""
+
+import re
+import time
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+from storage import LatencyHistogram
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Тип ассистента, для которого выполняется текущая задача (метка assistant_type)
+current_assistant: ContextVar[str] = ContextVar('current_assistant', default='none')
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+# Границы корзин гистограмм (в секундах). У каждой гистограммы свои: запросы к SQLite укладываются
+# в миллисекунды (LatencyHistogram.BOUNDS), вызовы API — в секунды, long polling getUpdates длится
+# до 30 с, а выполнение ассистента — 10-40 с и дольше
+API_BUCKETS: Tuple[float, ...] = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RUN_BUCKETS: Tuple[float, ...] = (0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0, 180.0)
+
+def _format_number(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+class Counter:
+    """Монотонный счетчик с метками."""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}"
+
+class Histogram:
+    """Гистограмма задержек (в секундах) с метками: по LatencyHistogram на набор меток.
+
+    buckets — границы корзин (по умолчанию LatencyHistogram.BOUNDS). children можно передать
+    готовым словарем гистограмм (например, AsyncDatabase.histograms) — тогда гистограмма публикует
+    их как есть, с их собственными границами. Ключом с одной меткой может быть строка.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 children: Optional[Dict[Any, LatencyHistogram]] = None,
+                 buckets: Optional[Tuple[float, ...]] = None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.children: Dict[Any, LatencyHistogram] = children if children is not None else {}
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        histogram = self.children.get(key)
+        if histogram is None:
+            histogram = self.children[key] = LatencyHistogram(self.buckets)
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[str]:
+        for key, histogram in sorted(self.children.items(), key=lambda item: str(item[0])):
+            values = key if isinstance(key, tuple) else (key,)
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {histogram.count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {_format_number(round(histogram.total, 6))}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {histogram.count}"
+
+class Gauge:
+    """Текущее значение, которое вычисляется функцией в момент чтения метрик.
+
+    Без меток read возвращает число, с метками — словарь {значения меток: число}
+    (ключом с одной меткой может быть строка).
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Any], labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.labels = labels
+
+    def samples(self) -> Iterator[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.warning(f"Не удалось получить значение метрики {self.name}: {e}")
+            return
+        if not self.labels:
+            yield f"{self.name} {_format_number(value)}"
+            return
+        for key, item in sorted(value.items(), key=lambda item: str(item[0])):
+            values = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_number(item)}"
+
+class CollectedCounter(Gauge):
+    """Счетчик, который ведет сам компонент (например, в stats()): читается функцией, как Gauge."""
+
+    kind = 'counter'
+
+class MetricsRegistry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  children: Optional[Dict[Any, LatencyHistogram]] = None,
+                  buckets: Optional[Tuple[float, ...]] = None) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, children, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], Any], labels: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, read, labels))
+
+    def collected_counter(self, name: str, help_text: str, read: Callable[[], Any],
+                          labels: Tuple[str, ...] = ()) -> CollectedCounter:
+        return self._register(CollectedCounter(name, help_text, read, labels))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+# Общий набор метрик процесса
+registry = MetricsRegistry()
+
+# Идентификаторы в путях API (thread_..., run_..., msg_..., asst_...) заменяются на {id},
+# чтобы число наборов меток не росло с числом потоков
+_API_ID = re.compile(r'/(?:thread|run|msg|asst|step|file)_[A-Za-z0-9]+')
+
+def api_route(path: str) -> str:
+    """Путь запроса без идентификаторов: /v1/threads/thread_abc/runs -> /v1/threads/{id}/runs."""
+    return _API_ID.sub('/{id}', path)
+
+class HTTPXTimer:
+    """Event hooks httpx, замеряющие время до получения заголовков ответа по маршруту и коду."""
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    async def on_request(self, request: Any):
+        request.extensions['metrics_started'] = time.perf_counter()
+
+    async def on_response(self, response: Any):
+        started = response.request.extensions.get('metrics_started')
+        if started is not None:
+            self.histogram.observe(
+                time.perf_counter() - started,
+                route=f"{response.request.method} {api_route(response.request.url.path)}",
+                status=response.status_code
+            )
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest для python-telegram-bot, замеряющий каждый вызов Bot API по методу и результату."""
+
+    def __init__(self, histogram: Histogram, **kwargs):
+        super().__init__(**kwargs)
+        self.histogram = histogram
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            with tracer.span(f"telegram {api_method}") as span:
+                code, payload = await super().do_request(url, method, *args, **kwargs)
+                status = str(code)
+                if span:
+                    span.attrs['status'] = code
+            return code, payload
+        finally:
+            self.histogram.observe(
+                time.perf_counter() - started,
+                method=api_method,
+                status=status
+            )
@@ -0,0 +1,138 @@
+"""
+OpenAI Rate Limiter for Telegram Bot
+
+Ограничение запросов к OpenAI токен-бакетами: общие бакеты на запросы (RPM)
+и оценку токенов (TPM) плюс такие же бакеты на каждого пользователя. Когда
+бакет пуст, вызывающий ждет своей очереди (FIFO), а не получает ошибку.
+Подключается как event hook общего httpx-клиента, поэтому стоит перед каждым
+вызовом OpenAI, включая повторы SDK.
+"""
+
+import time
+import asyncio
+import logging
+import contextvars
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Пользователь, от имени которого выполняются текущие запросы к OpenAI
+current_user: contextvars.ContextVar = contextvars.ContextVar('openai_current_user', default=None)
+
+class TokenBucket:
+    """Токен-бакет с очередью ожидающих в порядке поступления."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.waiting = 0
+        self.total_wait = 0.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def level(self) -> float:
+        """Заполненность бакета от 0 до 1."""
+        self._refill()
+        return self.tokens / self.capacity if self.capacity else 1.0
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """Забирает amount токенов, дожидаясь своей очереди. Возвращает время ожидания."""
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            # asyncio.Lock пропускает ожидающих строго по очереди
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        break
+                    await asyncio.sleep((amount - self.tokens) / self.rate)
+        finally:
+            self.waiting -= 1
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        return waited
+
+class OpenAIRateLimiter:
+    """Общие и персональные лимиты на запросы и токены OpenAI."""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 user_requests_per_minute: float, user_tokens_per_minute: float,
+                 run_token_estimate: int = 1000, max_tracked_users: int = 10000):
+        self.user_requests_per_minute = user_requests_per_minute
+        self.user_tokens_per_minute = user_tokens_per_minute
+        self.run_token_estimate = run_token_estimate
+        self.max_tracked_users = max_tracked_users
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._users: Dict[int, tuple] = {}
+
+    def estimate_tokens(self, method: str, path: str, body: bytes) -> int:
+        """Грубая оценка токенов запроса: ~4 байта на токен плюс ожидаемый ответ для запуска."""
+        if method != 'POST':
+            return 0
+        estimate = len(body) // 4
+        if path.endswith('/runs'):
+            estimate += self.run_token_estimate
+        return estimate
+
+    def _user_buckets(self, user_id: int) -> tuple:
+        buckets = self._users.get(user_id)
+        if buckets is None:
+            if len(self._users) >= self.max_tracked_users:
+                self._forget_idle_users()
+            buckets = (
+                TokenBucket(self.user_requests_per_minute) if self.user_requests_per_minute > 0 else None,
+                TokenBucket(self.user_tokens_per_minute) if self.user_tokens_per_minute > 0 else None
+            )
+            self._users[user_id] = buckets
+        return buckets
+
+    def _forget_idle_users(self):
+        """Убирает пользователей с полными бакетами — их состояние совпадает с новым."""
+        for user_id in [uid for uid, buckets in self._users.items()
+                        if all(b is None or (b.waiting == 0 and b.level() >= 1.0) for b in buckets)]:
+            del self._users[user_id]
+
+    async def acquire(self, user_id: Optional[int], tokens: int) -> float:
+        """Ждет разрешения на запрос. Сначала персональные бакеты, затем общие."""
+        waited = 0.0
+        buckets = []
+        if user_id is not None:
+            user_requests, user_tokens = self._user_buckets(user_id)
+            buckets += [(user_requests, 1), (user_tokens, tokens)]
+        buckets += [(self.requests, 1), (self.tokens, tokens)]
+
+        for bucket, amount in buckets:
+            if bucket is not None and amount > 0:
+                waited += await bucket.acquire(amount)
+
+        if waited > 1.0:
+            logger.warning(f"Запрос к OpenAI ждал лимита {waited:.2f}с (пользователь {user_id})")
+        return waited
+
+    async def httpx_hook(self, request: Any):
+        """Event hook httpx: ограничивает каждый исходящий запрос к OpenAI."""
+        tokens = self.estimate_tokens(request.method, request.url.path, request.content)
+        await self.acquire(current_user.get(), tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """Заполненность бакетов и число ожидающих."""
+        result: Dict[str, Any] = {'tracked_users': len(self._users)}
+        for name, bucket in (('requests', self.requests), ('tokens', self.tokens)):
+            if bucket is not None:
+                result[f'{name}_level'] = round(bucket.level(), 4)
+                result[f'{name}_waiting'] = bucket.waiting
+                result[f'{name}_total_wait'] = round(bucket.total_wait, 4)
+        user_levels = [bucket.level() for buckets in self._users.values() for bucket in buckets[:1] if bucket]
+        if user_levels:
+            result['user_requests_level_min'] = round(min(user_levels), 4)
+        return result
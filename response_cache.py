@@ -0,0 +1,97 @@
+"""
+Response Cache for Telegram Bot
+
+Кэш ответов ассистентов на первые сообщения новых разговоров. Ключ — тип
+ассистента и нормализованный текст запроса. Вытеснение по LRU, время жизни
+записей и ограничение общего размера в байтах.
+"""
+
+import re
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r'\s+')
+_EDGE_PUNCTUATION = re.compile(r'^[\s\W_]+|[\s\W_]+$')
+
+class ResponseCache:
+    """LRU-кэш ответов с TTL и лимитом размера."""
+
+    def __init__(self, max_bytes: int = 10 * 1024 * 1024, ttl: float = 3600.0, max_prompt_length: int = 1000):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_prompt_length = max_prompt_length
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Приводит запрос к каноническому виду: регистр, пробелы, пунктуация по краям."""
+        text = text.lower().replace('ё', 'е')
+        text = _WHITESPACE.sub(' ', text)
+        return _EDGE_PUNCTUATION.sub('', text)
+
+    def _key(self, assistant_type: str, prompt: str) -> Optional[Tuple[str, str]]:
+        if len(prompt) > self.max_prompt_length:
+            return None
+        normalized = self.normalize(prompt)
+        return (assistant_type, normalized) if normalized else None
+
+    def get(self, assistant_type: str, prompt: str) -> Optional[str]:
+        """Возвращает сохраненный ответ или None."""
+        key = self._key(assistant_type, prompt)
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        response, size, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return response
+
+    def put(self, assistant_type: str, prompt: str, response: str):
+        """Сохраняет ответ, вытесняя самые давние записи при превышении размера."""
+        key = self._key(assistant_type, prompt)
+        if not key or not response:
+            return
+        size = len(response.encode('utf-8')) + len(key[1].encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (response, size, time.monotonic() + self.ttl)
+        self.size_bytes += size
+
+        while self.size_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]):
+        _, size, _ = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и заполненность кэша."""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'size_bytes': self.size_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+        }
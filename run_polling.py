@@ -0,0 +1,112 @@
+"""
+Run Polling Policy for Telegram Bot
+
+Политика опроса выполнения ассистента: частые опросы в начале, затем
+экспоненциальная задержка со случайным разбросом, общий дедлайн.
+Параметры берутся из переменных окружения RUN_POLL_*.
+"""
+
+import os
+import time
+import random
+import logging
+from collections import deque
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from storage import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class PollPolicy:
+    """Параметры опроса статуса выполнения (все времена в секундах)."""
+    initial_delay: float = 0.25
+    max_delay: float = 3.0
+    multiplier: float = 1.5
+    jitter: float = 0.2
+    deadline: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> 'PollPolicy':
+        """Создает политику из переменных окружения RUN_POLL_*."""
+        return cls(
+            initial_delay=float(os.getenv("RUN_POLL_INITIAL_DELAY", cls.initial_delay)),
+            max_delay=float(os.getenv("RUN_POLL_MAX_DELAY", cls.max_delay)),
+            multiplier=float(os.getenv("RUN_POLL_MULTIPLIER", cls.multiplier)),
+            jitter=float(os.getenv("RUN_POLL_JITTER", cls.jitter)),
+            deadline=float(os.getenv("RUN_POLL_DEADLINE", cls.deadline))
+        )
+
+    def delays(self) -> Iterator[float]:
+        """Бесконечная последовательность пауз между опросами."""
+        delay = self.initial_delay
+        while True:
+            yield max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+            delay = min(delay * self.multiplier, self.max_delay)
+
+# Границы корзин гистограммы задержки обнаружения (в секундах): она не превышает паузы между опросами
+DETECTION_LAG_BUCKETS: Tuple[float, ...] = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0)
+
+class PollStats:
+    """Статистика опросов: число опросов на выполнение и задержка обнаружения завершения.
+
+    Задержка обнаружения — верхняя оценка времени от завершения выполнения до опроса, который
+    его увидел. Оценок две, берется меньшая: окно между отправкой предыдущего опроса, видевшего
+    выполнение незавершенным, и получением ответа, в котором статус стал итоговым (локальные
+    монотонные часы), и время с момента завершения по данным OpenAI. Второе огрублено до целых
+    секунд (completed_at и аналоги — целые unix-секунды, округленные вниз) и потому точнее первого
+    только при редких опросах.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.runs = 0
+        self.polls = 0
+        self.by_status: Dict[str, int] = {}
+        self.polls_per_run: deque = deque(maxlen=window)
+        self.detection_lag: deque = deque(maxlen=window)
+        self.lag_histogram = LatencyHistogram(DETECTION_LAG_BUCKETS)
+        self._lock = Lock()
+
+    def record(self, run_id: str, status: str, polls: int,
+               observed_window: Optional[float], finished_at: Optional[float]):
+        """Записывает результат опроса одного выполнения.
+
+        observed_window — время (с) от отправки предыдущего опроса до ответа с итоговым статусом,
+        finished_at — момент завершения по данным OpenAI; для выполнений без итогового статуса оба None.
+        """
+        bounds = []
+        if observed_window is not None:
+            bounds.append(observed_window)
+        if finished_at:
+            bounds.append(time.time() - finished_at)
+        lag = max(0.0, min(bounds)) if bounds else None
+        with self._lock:
+            self.runs += 1
+            self.polls += polls
+            self.by_status[status] = self.by_status.get(status, 0) + 1
+            self.polls_per_run.append(polls)
+            if lag is not None:
+                self.detection_lag.append(lag)
+                self.lag_histogram.observe(lag)
+
+        lag_text = f"до {lag:.2f}с" if lag is not None else "н/д"
+        logger.info(f"Выполнение {run_id}: статус {status}, опросов {polls}, задержка обнаружения {lag_text}")
+
+    def summary(self) -> Dict[str, Any]:
+        """Возвращает сводку по последним выполнениям."""
+        with self._lock:
+            lags = sorted(self.detection_lag)
+            return {
+                'runs': self.runs,
+                'polls': self.polls,
+                'by_status': dict(self.by_status),
+                'avg_polls_per_run': round(sum(self.polls_per_run) / len(self.polls_per_run), 2) if self.polls_per_run else 0,
+                'detection_lag_p50': round(lags[len(lags) // 2], 3) if lags else 0,
+                'detection_lag_max': round(lags[-1], 3) if lags else 0
+            }
+
+def run_finished_at(run: Any) -> Optional[float]:
+    """Момент завершения выполнения по данным OpenAI (unix time)."""
+    return run.completed_at or run.failed_at or run.cancelled_at or run.expired_at
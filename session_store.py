@@ -0,0 +1,186 @@
+"""
+Session Store for Telegram Bot
+
+Активные разговоры пользователей с ассистентами. Горячий путь читает и пишет
+словарь в памяти, а изменения пакетами сбрасываются в таблицу user_sessions
+(write-behind). При старте открытые сессии загружаются одним запросом.
+"""
+
+import asyncio
+import logging
+from collections.abc import MutableMapping
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+# Активная сессия: (assistant_id, thread_id, assistant_type)
+Session = Tuple[str, str, str]
+
+class SessionStore(MutableMapping):
+    """Словарь user_id -> (assistant_id, thread_id, assistant_type) с отложенной записью в SQLite."""
+
+    def __init__(self, assistants: Dict[str, Optional[str]], db_path: str = 'users.db',
+                 flush_interval: float = 2.0, max_pending: int = 500, shard: Tuple[int, int] = (0, 1)):
+        self.assistants = assistants
+        # (номер, всего): в многопроцессном режиме процесс владеет пользователями с telegram_id % всего == номер
+        self.shard = shard
+        self.db = get_database(db_path)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._sessions: Dict[int, Session] = {}
+        self._counts: Dict[int, int] = {}
+        self._ops: List[tuple] = []
+        self._message_counts: Dict[str, int] = {}
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    # --- Интерфейс словаря (горячий путь, только память) ---
+
+    def __getitem__(self, user_id: int) -> Session:
+        return self._sessions[user_id]
+
+    def __setitem__(self, user_id: int, session: Session):
+        _, thread_id, assistant_type = session
+        self._sessions[user_id] = session
+        self._counts[user_id] = 0
+        self._enqueue(('open', user_id, assistant_type, thread_id))
+
+    def __delitem__(self, user_id: int):
+        del self._sessions[user_id]
+        self._counts.pop(user_id, None)
+        self._enqueue(('close', user_id))
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._sessions)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, user_id) -> bool:
+        return user_id in self._sessions
+
+    def record_message(self, user_id: int):
+        """Увеличивает счетчик сообщений текущей сессии пользователя."""
+        session = self._sessions.get(user_id)
+        if not session:
+            return
+        self._counts[user_id] = self._counts.get(user_id, 0) + 1
+        with self._lock:
+            self._message_counts[session[1]] = self._message_counts.get(session[1], 0) + 1
+
+    def message_count(self, user_id: int) -> int:
+        """Количество сообщений пользователя в текущей сессии."""
+        return self._counts.get(user_id, 0)
+
+    def _enqueue(self, op: tuple):
+        with self._lock:
+            self._ops.append(op)
+            pending = len(self._ops)
+        if pending >= self.max_pending and self._wakeup:
+            self._wakeup.set()
+
+    # --- Работа с базой данных ---
+
+    def load(self) -> int:
+        """Загружает открытые сессии своих пользователей одним запросом. Возвращает их количество."""
+        index, count = self.shard
+        with self.db.read() as cursor:
+            cursor.execute('''
+            SELECT telegram_id, assistant_type, thread_id, message_count
+            FROM user_sessions
+            WHERE ended_at IS NULL AND telegram_id % ? = ?
+            ORDER BY id
+            ''', (count, index))
+            rows = cursor.fetchall()
+
+        for telegram_id, assistant_type, thread_id, message_count in rows:
+            assistant_id = self.assistants.get(assistant_type)
+            if assistant_id and thread_id:
+                self._sessions[telegram_id] = (assistant_id, thread_id, assistant_type)
+                self._counts[telegram_id] = message_count or 0
+
+        logger.info(f"Восстановлено активных разговоров: {len(self._sessions)}")
+        return len(self._sessions)
+
+    def flush(self) -> int:
+        """Записывает накопленные изменения одной транзакцией. Возвращает число операций."""
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            ops, self._ops = self._ops, []
+            counts, self._message_counts = self._message_counts, {}
+
+        if not ops and not counts:
+            return 0
+
+        try:
+            with self.db.write() as cursor:
+                for op in ops:
+                    # Открытие новой сессии всегда закрывает предыдущую
+                    cursor.execute('''
+                    UPDATE user_sessions SET ended_at = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ? AND ended_at IS NULL
+                    ''', (op[1],))
+                    if op[0] == 'open':
+                        cursor.execute('''
+                        INSERT INTO user_sessions (telegram_id, assistant_type, thread_id)
+                        VALUES (?, ?, ?)
+                        ''', op[1:])
+
+                cursor.executemany('''
+                UPDATE user_sessions SET message_count = message_count + ?
+                WHERE thread_id = ?
+                ''', [(count, thread_id) for thread_id, count in counts.items()])
+        except Exception:
+            # Возвращаем изменения в очередь, чтобы не потерять их
+            with self._lock:
+                self._ops[:0] = ops
+                for thread_id, count in counts.items():
+                    self._message_counts[thread_id] = self._message_counts.get(thread_id, 0) + count
+            raise
+
+        return len(ops) + len(counts)
+
+    # --- Фоновый сброс ---
+
+    def start(self):
+        """Запускает фоновую задачу периодического сброса в текущем цикле событий."""
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает оставшиеся изменения."""
+        if self._task:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run_flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for теряет отмену, если событие установлено в том же шаге цикла
+            # (заполненная очередь изменений будит сброс при каждой записи)
+            if self._stopping:
+                return
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении сессий: {e}")
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Sharding for Telegram Bot
+
+Многопроцессный режим: управляющий процесс получает обновления Telegram
+(webhook или long polling) и передает их N процессам-воркерам по
+telegram_id % N. Каждый воркер — обычный бот из simple_bot.py, который
+владеет сессиями своих пользователей и принимает обновления по HTTP на
+localhost. Регистрация и статусы пользователей общие через SQLite (WAL,
+storage.py). Запросы /api/register тоже уходят воркеру пользователя, чтобы
+его кэш статусов обновился сразу.
+
+Воркеры слушают только 127.0.0.1, поэтому GET /metrics и /api/stats
+управляющего процесса собирают данные всех воркеров: метрики каждого
+воркера получают метку shard, к ним добавляются метрики маршрутизации.
+
+Запуск: python sharding.py [число воркеров]
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import asyncio
+import secrets
+import signal
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+from dotenv import load_dotenv
+
+from http_api import AsyncHTTPServer, Request, Response
+from metrics import MetricsRegistry
+
+# Загрузка переменных окружения
+load_dotenv()
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "9100"))
+
+def update_routing_key(update: Dict[str, Any]) -> Optional[int]:
+    """Ключ маршрутизации обновления: ID пользователя, а без него — ID чата.
+
+    Совпадает с ключом упорядочивания в update_dispatch.py.
+    """
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = value.get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+        message = value.get('message')
+        if isinstance(message, dict) and isinstance(message.get('chat'), dict):
+            return message['chat'].get('id')
+    return None
+
+def init_data_user_id(init_data: str) -> Optional[int]:
+    """ID пользователя из initData Mini App (без проверки подписи — ее делает воркер)."""
+    try:
+        user = dict(parse_qsl(init_data)).get('user')
+        return int(json.loads(user)['id']) if user else None
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def run_worker(index: int, count: int, port: int):
+    """Точка входа процесса-воркера."""
+    os.environ.update({
+        'SHARD_INDEX': str(index),
+        'SHARD_COUNT': str(count),
+        'PORT': str(port),
+        'API_HOST': '127.0.0.1'
+    })
+    # Webhook в Telegram регистрирует только управляющий процесс
+    os.environ.pop('WEBHOOK_URL', None)
+
+    import simple_bot
+    simple_bot.init_database()
+    application = simple_bot.build_application(os.environ['TELEGRAM_BOT_TOKEN'])
+    asyncio.run(simple_bot.run_webhook(application, register=False))
+
+class ShardRouter:
+    """Передает обновления и запросы API воркерам по ключу пользователя."""
+
+    def __init__(self, ports: List[int], secret: str, connect_retries: int = 20,
+                 max_connections_per_shard: int = 32):
+        self.ports = ports
+        self.secret = secret
+        self.connect_retries = connect_retries
+        self.forwarded = [0] * len(ports)
+        self.failures = [0] * len(ports)
+        self._round_robin = 0
+        self._clients = [
+            httpx.AsyncClient(
+                base_url=f"http://127.0.0.1:{port}",
+                limits=httpx.Limits(max_connections=max_connections_per_shard,
+                                    max_keepalive_connections=max_connections_per_shard),
+                timeout=10.0
+            )
+            for port in ports
+        ]
+
+    def shard_for(self, key: Optional[int]) -> int:
+        if key is None:
+            self._round_robin += 1
+            return self._round_robin % len(self.ports)
+        return key % len(self.ports)
+
+    async def forward(self, shard: int, method: str, path: str, body: bytes,
+                      headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+        """Отправляет запрос воркеру, повторяя попытку, пока воркер запускается."""
+        for attempt in range(self.connect_retries):
+            try:
+                response = await self._clients[shard].request(method, path, content=body, headers=headers)
+                self.forwarded[shard] += 1
+                return response
+            except httpx.TransportError:
+                if attempt == self.connect_retries - 1:
+                    self.failures[shard] += 1
+                    raise
+                await asyncio.sleep(min(0.05 * 2 ** attempt, 1.0))
+
+    async def forward_update(self, body: bytes, update: Dict[str, Any]) -> int:
+        """Передает обновление воркеру его пользователя. Возвращает HTTP-статус воркера."""
+        shard = self.shard_for(update_routing_key(update))
+        response = await self.forward(shard, 'POST', WEBHOOK_PATH, body, {
+            'Content-Type': 'application/json',
+            'X-Telegram-Bot-Api-Secret-Token': self.secret
+        })
+        return response.status_code
+
+    async def collect(self, path: str) -> List[Optional[httpx.Response]]:
+        """GET path у всех воркеров параллельно; None на месте недоступного воркера."""
+        async def fetch(shard: int) -> Optional[httpx.Response]:
+            try:
+                response = await self._clients[shard].get(path)
+            except httpx.TransportError as e:
+                logger.warning(f"Воркер {shard} не ответил на {path}: {e}")
+                return None
+            return response if response.status_code == 200 else None
+
+        return list(await asyncio.gather(*(fetch(shard) for shard in range(len(self.ports)))))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'shards': len(self.ports),
+            'forwarded': self.forwarded,
+            'failures': self.failures
+        }
+
+    async def close(self):
+        await asyncio.gather(*(client.aclose() for client in self._clients))
+
+def label_shard(line: str, shard: int) -> str:
+    """Добавляет метку shard к строке значения метрики: name{a="b"} 1 -> name{shard="0",a="b"} 1."""
+    name_end = min(index for index in (line.find('{'), line.find(' '), len(line)) if index >= 0)
+    name, rest = line[:name_end], line[name_end:]
+    label = f'shard="{shard}"'
+    if rest.startswith('{}'):
+        return f'{name}{{{label}}}{rest[2:]}'
+    if rest.startswith('{'):
+        return f'{name}{{{label},{rest[1:]}'
+    return f'{name}{{{label}}}{rest}'
+
+def merge_metrics(texts: List[Optional[str]]) -> str:
+    """Объединяет вывод /metrics воркеров (None — воркер недоступен) с меткой shard.
+
+    Значения одной метрики от всех воркеров идут подряд под одними HELP и TYPE,
+    как того требует текстовый формат Prometheus.
+    """
+    headers: Dict[str, Dict[str, str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for shard, text in enumerate(texts):
+        if text is None:
+            continue
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                parts = line.split(' ', 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = parts[2]
+                    headers.setdefault(family, {}).setdefault(parts[1], line)
+                    samples.setdefault(family, [])
+                continue
+            if line.strip() and family is not None:
+                samples[family].append(label_shard(line, shard))
+
+    lines: List[str] = []
+    for family, header in headers.items():
+        lines.extend(header[kind] for kind in ('HELP', 'TYPE') if kind in header)
+        lines.extend(samples[family])
+    return '\n'.join(lines) + '\n' if lines else ''
+
+class FrontHandler:
+    """HTTP API управляющего процесса: webhook Telegram и API Mini App с передачей воркерам."""
+
+    def __init__(self, router: ShardRouter, secret: str, supervisor: Optional['ShardSupervisor'] = None):
+        self.router = router
+        self.secret = secret.encode('utf-8')
+        self.supervisor = supervisor
+        # Ответил ли воркер на последний сбор метрик
+        self.shards_up = [0] * len(router.ports)
+
+        # Метрики самого управляющего процесса
+        self.registry = MetricsRegistry()
+        self.registry.gauge('bot_shard_up', 'Воркер ответил на последний сбор метрик',
+                            lambda: dict(enumerate(self.shards_up)), ('shard',))
+        self.registry.collected_counter('bot_shard_forwarded_total', 'Запросы, переданные воркеру',
+                                        lambda: dict(enumerate(self.router.forwarded)), ('shard',))
+        self.registry.collected_counter('bot_shard_forward_failures_total', 'Запросы, не доставленные воркеру',
+                                        lambda: dict(enumerate(self.router.failures)), ('shard',))
+        self.registry.collected_counter('bot_shard_restarts_total', 'Перезапуски упавших воркеров',
+                                        lambda: self.supervisor.restarts if self.supervisor else 0)
+
+    async def __call__(self, request: Request) -> Response:
+        if request.method == 'GET' and request.path == '/':
+            return Response(200, b'Bot is running!', content_type='text/html')
+        if request.method == 'GET' and request.path == '/api/stats':
+            return await self.handle_stats()
+        if request.method == 'GET' and request.path == '/metrics':
+            return await self.handle_metrics()
+        if request.method == 'POST' and request.path == WEBHOOK_PATH:
+            return await self.handle_webhook(request)
+        if request.method == 'POST' and request.path == '/api/register':
+            return await self.handle_register(request)
+        if request.method == 'OPTIONS':
+            return Response(200, headers={
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type'
+            })
+        return Response(404)
+
+    async def handle_stats(self) -> Response:
+        """Статистика маршрутизации и /api/stats каждого воркера (None — воркер недоступен)."""
+        responses = await self.router.collect('/api/stats')
+        stats = {
+            'router': dict(self.router.stats(), restarts=self.supervisor.restarts if self.supervisor else 0),
+            'workers': [response.json() if response is not None else None for response in responses]
+        }
+        return Response(200, json.dumps(stats).encode('utf-8'))
+
+    async def handle_metrics(self) -> Response:
+        """Метрики всех воркеров с меткой shard и метрики маршрутизации."""
+        responses = await self.router.collect('/metrics')
+        self.shards_up = [int(response is not None) for response in responses]
+        text = merge_metrics([response.text if response is not None else None for response in responses])
+        return Response(200, (text + self.registry.render()).encode('utf-8'),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    async def handle_webhook(self, request: Request) -> Response:
+        secret = request.headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8')
+        if not hmac.compare_digest(secret, self.secret):
+            return Response(403)
+        try:
+            update = json.loads(request.body)
+        except ValueError:
+            return Response(400)
+        try:
+            return Response(await self.router.forward_update(request.body, update))
+        except httpx.TransportError as e:
+            logger.error(f"Воркер недоступен: {e}")
+            # Telegram повторит доставку
+            return Response(503)
+
+    async def handle_register(self, request: Request) -> Response:
+        try:
+            init_data = json.loads(request.body).get('initData') or ''
+        except (ValueError, AttributeError):
+            init_data = ''
+        shard = self.router.shard_for(init_data_user_id(init_data))
+        try:
+            response = await self.router.forward(shard, 'POST', '/api/register', request.body,
+                                                 {'Content-Type': 'application/json'})
+        except httpx.TransportError as e:
+            logger.error(f"Воркер недоступен: {e}")
+            return Response(503, headers={'Access-Control-Allow-Origin': '*'})
+        return Response(response.status_code, response.content, headers={'Access-Control-Allow-Origin': '*'})
+
+class ShardSupervisor:
+    """Запускает процессы-воркеры и перезапускает упавшие."""
+
+    def __init__(self, workers: int, base_port: int = SHARD_BASE_PORT):
+        self.workers = workers
+        self.ports = [base_port + index for index in range(workers)]
+        self.restarts = 0
+        # spawn: воркер импортирует бота с нуля, без унаследованных клиентов и циклов событий
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=run_worker, args=(index, self.workers, self.ports[index]),
+            name=f"bot-shard-{index}", daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f"Воркер {index} запущен (pid {process.pid}, порт {self.ports[index]})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def check(self):
+        """Перезапускает завершившихся воркеров."""
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+                self.restarts += 1
+                self._spawn(index)
+
+    def stop(self, timeout: float = 30.0):
+        """Останавливает воркеров (SIGTERM) и дожидается их завершения."""
+        processes = [process for process in self._processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+        self._processes = [None] * self.workers
+
+async def wait_for_workers(ports: List[int], timeout: float = 60.0):
+    """Ждет, пока все воркеры начнут отвечать на health check."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=1.0) as client:
+        for port in ports:
+            while True:
+                try:
+                    if (await client.get(f"http://127.0.0.1:{port}/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Воркер на порту {port} не запустился")
+                await asyncio.sleep(0.2)
+
+async def poll_updates(token: str, router: ShardRouter, stop_event: asyncio.Event):
+    """Long polling в управляющем процессе: обновления передаются воркерам по мере получения."""
+    from telegram import Bot, Update
+
+    base_url = os.getenv("TELEGRAM_API_BASE_URL")
+    bot = Bot(token, base_url=base_url) if base_url else Bot(token)
+    async with bot:
+        await bot.delete_webhook(drop_pending_updates=True)
+        offset = 0
+        while not stop_event.is_set():
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                data = update.to_dict()
+                body = json.dumps(data).encode('utf-8')
+                # Обновление подтверждается (offset) только после передачи воркеру. Повторяются только
+                # временные отказы: 503 (очередь воркера полна или он запускается) и ошибки соединения;
+                # обновление, отклоненное по другой причине, не пройдет и при повторе — оно пропускается
+                while not stop_event.is_set():
+                    try:
+                        status = await router.forward_update(body, data)
+                    except httpx.TransportError:
+                        status = None
+                    if status == 200:
+                        break
+                    if status is not None and status != 503:
+                        logger.error(f"Воркер отклонил обновление {update.update_id} со статусом {status}, обновление пропущено")
+                        break
+                    await asyncio.sleep(0.5)
+                offset = update.update_id + 1
+
+async def run_front(workers: int):
+    """Управляющий процесс: воркеры, прием обновлений и HTTP API."""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        logger.error("Переменная окружения TELEGRAM_BOT_TOKEN не установлена!")
+        return
+
+    # Общий секрет для webhook Telegram и передачи обновлений воркерам
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    os.environ['WEBHOOK_SECRET'] = secret
+
+    supervisor = ShardSupervisor(workers)
+    supervisor.start()
+    router = ShardRouter(supervisor.ports, secret)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = AsyncHTTPServer(FrontHandler(router, secret, supervisor), port=int(os.getenv("PORT", "8080")))
+    await server.start()
+
+    webhook_url = os.getenv("WEBHOOK_URL")
+    poller = None
+    try:
+        await wait_for_workers(supervisor.ports)
+        logger.info(f"Запущено воркеров: {workers}")
+
+        if webhook_url:
+            from telegram import Bot, Update
+            async with Bot(token) as bot:
+                await bot.set_webhook(
+                    url=webhook_url.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=secret,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True,
+                    max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+                )
+            logger.info("Запуск в webhook режиме")
+        else:
+            logger.info("Запуск в polling режиме")
+            poller = asyncio.create_task(poll_updates(token, router, stop_event))
+
+        while not stop_event.is_set():
+            supervisor.check()
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        logger.info("Остановка бота")
+        if poller:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        await server.stop()
+        await router.close()
+        await asyncio.to_thread(supervisor.stop)
+
+def main():
+    """Главная функция CLI."""
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print("Использование:")
+        print("  python sharding.py [workers]")
+        print("      - запуск бота в нескольких процессах (по умолчанию по числу ядер)")
+        return
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+    asyncio.run(run_front(workers))
+
+if __name__ == '__main__':
+    main()
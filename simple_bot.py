@@ -3,13 +3,12 @@ import logging
 import asyncio
 import textwrap
 import json
-import sqlite3
-import hashlib
 import hmac
-from typing import Dict, Any, Tuple, Optional
-from threading import Thread
+import signal
+import secrets
+from typing import Any, Dict, List, Optional
+from contextlib import contextmanager
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
 from datetime import datetime
 
@@ -17,29 +16,274 @@ from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, ReplyKeyboardMarkup, KeyboardButton, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters, InlineQueryHandler
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from rate_limiter import OpenAIRateLimiter, current_user
+from response_cache import ResponseCache
+from session_store import SessionStore
+from storage import AsyncDatabase, close_all, get_database
+from user_cache import user_status_cache
+from activity_buffer import ActivityBuffer
+from thread_prewarm import PrewarmedThreadPool
+from thread_cleanup import ThreadDeletionQueue
+from message_inbox import MessageInbox
+from update_dispatch import UserOrderedUpdateProcessor
+from run_polling import PollPolicy, PollStats, run_finished_at
+from streaming import StreamingReply
+from telegram_format import MarkdownChunker, format_response
+from http_api import AsyncHTTPServer, Request, Response
+from metrics import API_BUCKETS, RUN_BUCKETS, STAGE_BUCKETS, HTTPXTimer, InstrumentedRequest, current_assistant, registry
+from tracing import install_log_correlation, tracer
+from traffic_recorder import traffic_recorder
+from init_data import InitDataValidator
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
+# Настройка логирования (trace_id связывает строки лога одного обновления)
+install_log_correlation()
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s", level=logging.INFO
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Общие долгоживущие соединения с базой пользователей (WAL)
+db = get_database('users.db')
+
+# Запросы из асинхронных обработчиков выполняются в отдельных потоках
+adb = AsyncDatabase(
+    db,
+    workers=int(os.getenv("DB_WORKERS", "2")),
+    max_pending=int(os.getenv("DB_MAX_PENDING", "1000"))
+)
+
+# Кэш статусов пользователей: проверки доступа без запросов к базе
+user_status_cache.max_size = int(os.getenv("USER_STATUS_CACHE_SIZE", "10000"))
+user_status_cache.ttl = float(os.getenv("USER_STATUS_CACHE_TTL", "60"))
+
+# Отметки активности известных пользователей пишутся пакетами в фоне
+activity_buffer = ActivityBuffer(
+    flush_interval=float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5.0")),
+    max_pending=int(os.getenv("ACTIVITY_MAX_PENDING", "5000")),
+    max_size=int(os.getenv("ACTIVITY_MAX_SIZE", "0")) or None
+)
+
+# Многопроцессный режим (см. sharding.py): номер процесса и их общее число
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_WORKER = "SHARD_COUNT" in os.environ
+
+def shard_file(path: str) -> str:
+    """Путь файла процесса: у воркера в него добавляется номер (traffic.jsonl.gz -> traffic.3.jsonl.gz).
+
+    Воркеры наследуют одни и те же переменные окружения, а одновременная дозапись
+    из нескольких процессов портит файл.
+    """
+    if not path or not SHARD_WORKER:
+        return path
+    directory, name = os.path.split(path)
+    stem, dot, extension = name.partition('.')
+    return os.path.join(directory, f"{stem}.{SHARD_INDEX}{dot}{extension}")
+
+# Параллельная обработка обновлений разных пользователей, строгий порядок внутри пользователя
+update_processor = UserOrderedUpdateProcessor(
+    workers=int(os.getenv("UPDATE_WORKERS", "16")),
+    max_pending=int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+)
+
+# Метрики для GET /metrics: задержки внешних API и этапов ответа ассистента
+openai_request_seconds = registry.histogram(
+    'bot_openai_request_seconds', 'Время запроса к OpenAI API до получения заголовков ответа', ('route', 'status'),
+    buckets=API_BUCKETS
+)
+telegram_request_seconds = registry.histogram(
+    'bot_telegram_request_seconds', 'Время вызова Telegram Bot API', ('method', 'status'),
+    buckets=API_BUCKETS
+)
+stage_seconds = registry.histogram(
+    'bot_stage_seconds', 'Время этапов ответа ассистента', ('stage', 'assistant_type'),
+    buckets=STAGE_BUCKETS
+)
+run_seconds = registry.histogram(
+    'bot_assistant_run_seconds', 'Время выполнения ассистента до итогового статуса', ('assistant_type', 'outcome'),
+    buckets=RUN_BUCKETS
+)
+runs_total = registry.counter(
+    'bot_assistant_runs_total', 'Выполнения ассистента по итогу (error — исключение в обработке)',
+    ('assistant_type', 'outcome')
+)
+registry.histogram(
+    'bot_db_query_seconds', 'Время запроса к SQLite, включая ожидание в очереди', ('query',),
+    children=adb.histograms
+)
+registry.gauge('bot_active_threads', 'Активные разговоры с ассистентами', lambda: len(active_threads))
+registry.gauge('bot_runs_in_flight', 'Пользователи, для которых сейчас выполняется ассистент',
+               lambda: message_inbox.active_count())
+registry.gauge('bot_update_queue_depth', 'Обновления в очереди воркера обработки',
+               lambda: {str(worker['worker']): worker['queue_depth'] for worker in update_processor.stats()}, ('worker',))
+registry.collected_counter('bot_updates_processed_total', 'Обновления, взятые воркером в обработку',
+                           lambda: {str(worker['worker']): worker['processed'] for worker in update_processor.stats()}, ('worker',))
+registry.collected_counter('bot_update_queue_wait_seconds_total', 'Суммарное ожидание обновлений в очереди воркера',
+                           lambda: {str(worker['worker']): worker['total_wait'] for worker in update_processor.stats()}, ('worker',))
+registry.gauge('bot_update_queue_wait_max_seconds', 'Наибольшее ожидание обновления в очереди воркера',
+               lambda: {str(worker['worker']): worker['max_wait'] for worker in update_processor.stats()}, ('worker',))
+registry.gauge('bot_activity_pending', 'Отметки активности, ожидающие записи', lambda: activity_buffer.pending_count())
+registry.collected_counter('bot_activity_dropped_total', 'Отметки активности, вытесненные из переполненного буфера',
+                           lambda: activity_buffer.dropped)
+
+# Трассировка обновлений: доля сохраняемых трасс и порог, медленнее которого трасса сохраняется всегда
+tracer.path = shard_file(os.getenv("TRACE_FILE", "traces.jsonl"))
+tracer.sample_rate = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+tracer.slow_threshold = float(os.getenv("TRACE_SLOW_THRESHOLD", "0"))
+
+# Запись трафика для воспроизведения под нагрузкой (см. traffic_recorder.py); пустой путь — выключена
+traffic_recorder.path = shard_file(os.getenv("TRAFFIC_RECORD_FILE", ""))
+traffic_recorder.anonymize = os.getenv("TRAFFIC_RECORD_ANONYMIZE", "true").lower() in ("1", "true", "yes")
+# Тексты кнопок клавиатуры определяют обработчик, поэтому не анонимизируются
+traffic_recorder.keep_texts = {"🎮 Выбрать ассистента", "🛑 Остановить обсуждение", "👤 Профиль"}
+
+@contextmanager
+def stage_timer(stage: str):
+    """Замер этапа ответа для текущего ассистента: метрика и интервал трассы."""
+    with tracer.span(stage), stage_seconds.time(stage=stage, assistant_type=current_assistant.get()):
+        yield
+
+def record_run(outcome: str, seconds: Optional[float] = None):
+    """Учитывает итог выполнения ассистента."""
+    assistant_type = current_assistant.get()
+    runs_total.inc(assistant_type=assistant_type, outcome=outcome)
+    if seconds is not None:
+        run_seconds.observe(seconds, assistant_type=assistant_type, outcome=outcome)
+        traffic_recorder.record_run(assistant_type, outcome, seconds)
+
+# Проверка initData из Mini App: ключ из токена вычисляется один раз, проверенные строки кэшируются.
+# INIT_DATA_MAX_AGE — срок действия initData после auth_date в секундах (0 — без ограничения).
+init_data_validator = InitDataValidator(
+    bot_token=os.getenv("TELEGRAM_BOT_TOKEN", ""),
+    max_age=float(os.getenv("INIT_DATA_MAX_AGE", "86400")),
+    cache_size=int(os.getenv("INIT_DATA_CACHE_SIZE", "1024"))
+)
+
+# Размер общего пула соединений с OpenAI
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+# Лимиты OpenAI: общие и на пользователя, запросы и оценка токенов в минуту (0 — без лимита).
+# Общие лимиты делятся между процессами; пользователь всегда обслуживается одним процессом.
+rate_limiter = OpenAIRateLimiter(
+    requests_per_minute=float(os.getenv("OPENAI_RPM", "500")) / SHARD_COUNT,
+    tokens_per_minute=float(os.getenv("OPENAI_TPM", "200000")) / SHARD_COUNT,
+    user_requests_per_minute=float(os.getenv("OPENAI_USER_RPM", "60")),
+    user_tokens_per_minute=float(os.getenv("OPENAI_USER_TPM", "20000")),
+    run_token_estimate=int(os.getenv("OPENAI_RUN_TOKEN_ESTIMATE", "1000"))
+)
+
+def rate_limit_metric(field: str) -> Dict[str, float]:
+    """Поле stats() лимитера для общих бакетов: {'requests': ..., 'tokens': ...}."""
+    stats = rate_limiter.stats()
+    return {name: stats[f'{name}_{field}'] for name in ('requests', 'tokens') if f'{name}_{field}' in stats}
+
+registry.gauge('bot_openai_bucket_level', 'Заполненность общего бакета лимитов OpenAI (от 0 до 1)',
+               lambda: rate_limit_metric('level'), ('bucket',))
+registry.gauge('bot_openai_bucket_waiting', 'Запросы, ожидающие общий бакет лимитов OpenAI',
+               lambda: rate_limit_metric('waiting'), ('bucket',))
+registry.collected_counter('bot_openai_bucket_wait_seconds_total', 'Суммарное ожидание в общем бакете лимитов OpenAI',
+                           lambda: rate_limit_metric('total_wait'), ('bucket',))
+registry.gauge('bot_openai_user_bucket_level_min', 'Наименьшая заполненность бакета запросов пользователя',
+               lambda: rate_limiter.stats().get('user_requests_level_min', 1.0))
+
+# Инициализация асинхронного клиента OpenAI с общим пулом соединений.
+# Все вызовы Assistants API не блокируют цикл событий бота и проходят через лимитер.
+# Время запроса замеряется после ожидания в лимитере.
+openai_timer = HTTPXTimer(openai_request_seconds)
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        event_hooks={
+            'request': [rate_limiter.httpx_hook, openai_timer.on_request, tracer.on_request, traffic_recorder.on_request],
+            'response': [openai_timer.on_response, tracer.on_response, traffic_recorder.on_response]
+        }
+    )
+)
 
 # Максимальная длина сообщения Telegram
 MAX_MESSAGE_LENGTH = 4096
 
+# Фоновая очередь удаления потоков OpenAI (таблица thread_deletions)
+thread_cleanup = ThreadDeletionQueue(
+    client,
+    concurrency=int(os.getenv("THREAD_CLEANUP_CONCURRENCY", "4"))
+)
+registry.gauge('bot_thread_deletions_pending', 'Потоки OpenAI в очереди на удаление', lambda: thread_cleanup.depth)
+registry.collected_counter(
+    'bot_thread_deletion_attempts_total', 'Попытки удаления потоков по результату',
+    lambda: {'deleted': thread_cleanup.deleted, 'failed': thread_cleanup.failed_attempts}, ('result',)
+)
+registry.collected_counter('bot_thread_deletion_retries_total', 'Повторные попытки удаления после ошибки',
+                           lambda: thread_cleanup.retries)
+
+# Пул заранее созданных потоков OpenAI для мгновенного запуска ассистента
+thread_pool = PrewarmedThreadPool(
+    client,
+    min_size=int(os.getenv("THREAD_POOL_MIN_SIZE", "2")),
+    max_size=int(os.getenv("THREAD_POOL_MAX_SIZE", "20")),
+    lead_time=float(os.getenv("THREAD_POOL_LEAD_TIME", "60")),
+    deletion_queue=thread_cleanup
+)
+registry.gauge('bot_thread_pool_size', 'Готовые потоки в пуле', lambda: thread_pool.stats()['size'])
+registry.gauge('bot_thread_pool_target_size', 'Целевой размер пула потоков', lambda: thread_pool.stats()['target_size'])
+registry.collected_counter(
+    'bot_thread_pool_acquires_total', 'Выдачи потоков из пула (miss — поток создан на месте)',
+    lambda: {'hit': thread_pool.hits, 'miss': thread_pool.misses}, ('result',)
+)
+registry.collected_counter(
+    'bot_thread_pool_refills_total', 'Попытки пополнения пула по результату',
+    lambda: {'ok': thread_pool.refills, 'failed': thread_pool.refill_failures}, ('result',)
+)
+registry.collected_counter('bot_thread_pool_refill_seconds_total', 'Суммарное время успешных пополнений пула',
+                           lambda: round(thread_pool.total_refill_latency, 6))
+registry.gauge('bot_thread_pool_refill_last_seconds', 'Время последнего успешного пополнения пула',
+               lambda: round(thread_pool.last_refill_latency, 6))
+
+# Потоковый вывод ответов ассистента (постепенное редактирование сообщения)
+ASSISTANT_STREAMING = os.getenv("ASSISTANT_STREAMING", "true").lower() in ("1", "true", "yes")
+
+# Минимальный интервал между редактированиями потокового ответа, в секундах
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Политика опроса выполнения ассистента и статистика опросов
+poll_policy = PollPolicy.from_env()
+poll_stats = PollStats()
+registry.collected_counter('bot_run_polls_total', 'Опросы статуса выполнений ассистента', lambda: poll_stats.polls)
+registry.collected_counter(
+    'bot_run_poll_results_total', 'Опрошенные выполнения по итоговому статусу',
+    lambda: poll_stats.summary()['by_status'], ('status',)
+)
+registry.histogram(
+    'bot_run_detection_lag_seconds', 'Верхняя оценка задержки обнаружения завершения выполнения',
+    children={(): poll_stats.lag_histogram}
+)
+
+# Кэш ответов на первые сообщения новых разговоров (включается явно)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(10 * 1024 * 1024))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+)
+
+# Ответы пользователю, когда ассистент не справился
+NO_RESPONSE_TEXT = "Нет ответа от ассистента."
+RUN_FAILED_TEXT = "Извините, я не смог выполнить запрос."
+RUN_TIMEOUT_TEXT = "Ответ занимает слишком много времени. Пожалуйста, попробуйте позже."
+
 # URL Mini App для выбора ассистента
 MINI_APP_URL = "https://ai4business-ai.github.io/front-bot-repo/"
 
-# Хранение активных разговоров: user_id -> (assistant_id, thread_id, assistant_type)
-active_threads: Dict[int, Tuple[str, str, str]] = {}
-
 # ID ассистентов из переменных окружения
 ASSISTANTS = {
     "market": os.getenv("OPENAI_ASSISTANT_ID_MARKET"),
@@ -48,6 +292,14 @@ ASSISTANTS = {
     "adapter": os.getenv("OPENAI_ASSISTANT_ID_ADAPTER")
 }
 
+# Хранение активных разговоров: user_id -> (assistant_id, thread_id, assistant_type).
+# Чтение из памяти, запись в таблицу user_sessions пакетами в фоне.
+active_threads = SessionStore(
+    ASSISTANTS,
+    flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "2.0")),
+    shard=(SHARD_INDEX, SHARD_COUNT)
+)
+
 # Названия ассистентов
 ASSISTANT_NAMES = {
     "market": "📊 Анализ рынка",
@@ -67,9 +319,10 @@ ASSISTANT_DESCRIPTIONS = {
 # Инициализация базы данных
 def init_database():
     """Инициализация базы данных пользователей."""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
+    with db.write() as cursor:
+        _create_schema(cursor)
 
+def _create_schema(cursor):
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
         telegram_id INTEGER PRIMARY KEY,
@@ -83,103 +336,109 @@ def init_database():
     )
     ''')
 
-    conn.commit()
-    conn.close()
-
-def add_or_update_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None, status: str = 'user'):
-    """Добавляет или обновляет пользователя в базе данных."""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-
-    # Проверяем, существует ли пользователь
-    cursor.execute('SELECT status FROM users WHERE telegram_id = ?', (telegram_id,))
-    existing_user = cursor.fetchone()
-
-    if existing_user:
-        # Обновляем существующего пользователя
-        cursor.execute('''
-        UPDATE users 
-        SET username = ?, first_name = ?, last_name = ?, last_activity = CURRENT_TIMESTAMP
-        WHERE telegram_id = ?
-        ''', (username, first_name, last_name, telegram_id))
-    else:
-        # Добавляем нового пользователя
-        cursor.execute('''
-        INSERT INTO users (telegram_id, username, first_name, last_name, status)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (telegram_id, username, first_name, last_name, status))
-
-    conn.commit()
-    conn.close()
-
-def register_user(telegram_id: int):
-    """Регистрирует пользователя (меняет статус на 'registered')."""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
+    # Активные разговоры с ассистентами (см. миграции 2.1.0 и 2.2.0)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS user_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER NOT NULL,
+        assistant_type TEXT,
+        thread_id TEXT,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ended_at TIMESTAMP,
+        message_count INTEGER DEFAULT 0,
+        FOREIGN KEY (telegram_id) REFERENCES users (telegram_id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_open ON user_sessions(telegram_id) WHERE ended_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_thread_id ON user_sessions(thread_id)')
 
+    # Очередь удаления потоков OpenAI (см. миграцию 2.3.0)
     cursor.execute('''
-    UPDATE users 
-    SET status = 'registered', registered_at = CURRENT_TIMESTAMP
-    WHERE telegram_id = ?
-    ''', (telegram_id,))
+    CREATE TABLE IF NOT EXISTS thread_deletions (
+        thread_id TEXT PRIMARY KEY,
+        attempts INTEGER DEFAULT 0,
+        last_error TEXT,
+        next_attempt_at REAL NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_thread_deletions_next ON thread_deletions(next_attempt_at)')
 
-    conn.commit()
-    conn.close()
+async def add_or_update_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None, status: str = 'user'):
+    """Добавляет или обновляет пользователя в базе данных.
 
-def get_user_status(telegram_id: int) -> str:
-    """Получает статус пользователя."""
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
+    Новые пользователи записываются сразу, у известных обновление профиля и
+    last_activity откладывается в буфер активности.
+    """
+    if await get_user_status(telegram_id) != 'new':
+        activity_buffer.touch(telegram_id, username, first_name, last_name)
+        return
 
-    cursor.execute('SELECT status FROM users WHERE telegram_id = ?', (telegram_id,))
-    result = cursor.fetchone()
+    await adb.run('save_user', save_user, telegram_id, username, first_name, last_name, status)
+
+def save_user(telegram_id: int, username: str = None, first_name: str = None, last_name: str = None, status: str = 'user'):
+    """Сразу записывает пользователя в базу данных (отдельной транзакцией)."""
+    with db.write() as cursor:
+        # Проверяем, существует ли пользователь
+        cursor.execute('SELECT status FROM users WHERE telegram_id = ?', (telegram_id,))
+        existing_user = cursor.fetchone()
+
+        if existing_user:
+            # Обновляем существующего пользователя
+            cursor.execute('''
+            UPDATE users 
+            SET username = ?, first_name = ?, last_name = ?, last_activity = CURRENT_TIMESTAMP
+            WHERE telegram_id = ?
+            ''', (username, first_name, last_name, telegram_id))
+        else:
+            # Добавляем нового пользователя
+            cursor.execute('''
+            INSERT INTO users (telegram_id, username, first_name, last_name, status)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (telegram_id, username, first_name, last_name, status))
 
-    conn.close()
+    user_status_cache.set(telegram_id, existing_user[0] if existing_user else status)
 
-    return result[0] if result else 'new'
+def register_user(telegram_id: int):
+    """Регистрирует пользователя (меняет статус на 'registered')."""
+    with db.write() as cursor:
+        cursor.execute('''
+        UPDATE users 
+        SET status = 'registered', registered_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = ?
+        ''', (telegram_id,))
+        updated = cursor.rowcount > 0
 
-def validate_telegram_data(init_data: str, bot_token: str) -> Optional[dict]:
-    """Валидирует данные, полученные от Telegram WebApp."""
-    try:
-        # Парсим данные
-        parsed_data = {}
-        for item in init_data.split('&'):
-            key, value = item.split('=', 1)
-            parsed_data[key] = value
-
-        # Извлекаем hash
-        received_hash = parsed_data.pop('hash', None)
-        if not received_hash:
-            return None
-
-        # Создаем строку для проверки
-        data_check_string = '\n'.join([f"{k}={v}" for k, v in sorted(parsed_data.items())])
-
-        # Создаем secret key
-        secret_key = hmac.new(
-            'WebAppData'.encode(),
-            bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-
-        # Вычисляем hash
-        calculated_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-
-        # Проверяем hash
-        if calculated_hash == received_hash:
-            # Парсим данные пользователя
-            if 'user' in parsed_data:
-                user_data = json.loads(parsed_data['user'])
-                return user_data
-
-        return None
-    except Exception as e:
-        logger.error(f"Ошибка валидации данных Telegram: {e}")
-        return None
+    if updated:
+        user_status_cache.set(telegram_id, 'registered')
+    else:
+        user_status_cache.invalidate(telegram_id)
+
+async def get_user_status(telegram_id: int) -> str:
+    """Получает статус пользователя (из кэша, при промахе — из базы)."""
+    status = user_status_cache.get(telegram_id)
+    if status is not None:
+        return status
+    return await adb.run('get_user_status', load_user_status, telegram_id)
+
+def load_user_status(telegram_id: int) -> str:
+    """Читает статус пользователя из базы и обновляет кэш."""
+    with db.read() as cursor:
+        cursor.execute('SELECT status FROM users WHERE telegram_id = ?', (telegram_id,))
+        result = cursor.fetchone()
+
+    status = result[0] if result else 'new'
+    user_status_cache.set(telegram_id, status)
+    return status
+
+def load_profile(telegram_id: int) -> Optional[tuple]:
+    """Читает данные профиля пользователя из базы."""
+    with db.read() as cursor:
+        cursor.execute('''
+        SELECT username, first_name, last_name, status, registered_at, created_at 
+        FROM users WHERE telegram_id = ?
+        ''', (telegram_id,))
+        return cursor.fetchone()
 
 def get_main_keyboard():
     """Создание основной клавиатуры с кнопками управления."""
@@ -203,14 +462,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
 
     # Добавляем пользователя в базу данных
-    add_or_update_user(
+    await add_or_update_user(
         telegram_id=user.id,
         username=user.username,
         first_name=user.first_name,
         last_name=user.last_name
     )
 
-    user_status = get_user_status(user.id)
+    user_status = await get_user_status(user.id)
 
     if user_status == 'registered':
         help_text = (
@@ -250,17 +509,10 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показать профиль пользователя."""
     user = update.effective_user
-    user_status = get_user_status(user.id)
+    user_status = await get_user_status(user.id)
 
     # Получаем дополнительную информацию о пользователе
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-    SELECT username, first_name, last_name, status, registered_at, created_at 
-    FROM users WHERE telegram_id = ?
-    ''', (user.id,))
-    user_data = cursor.fetchone()
-    conn.close()
+    user_data = await adb.run('load_profile', load_profile, user.id)
 
     if user_data:
         username, first_name, last_name, status, registered_at, created_at = user_data
@@ -355,7 +607,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
         if action == 'register_user':
             # Обработка регистрации пользователя
             user_id = update.effective_user.id
-            register_user(user_id)
+            await adb.run('register_user', register_user, user_id)
 
             await update.message.reply_text(
                 "✅ **Регистрация завершена!**\n\n"
@@ -372,7 +624,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             logger.info(f"Selected assistant: {selected_assistant}")
 
             # Проверяем статус регистрации
-            user_status = get_user_status(update.effective_user.id)
+            user_status = await get_user_status(update.effective_user.id)
             if user_status != 'registered':
                 await update.message.reply_text(
                     "❌ **Необходима регистрация**\n\n"
@@ -393,7 +645,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             selected_assistant = data.get('selected_assistant') or data.get('assistant_type')
 
             # Проверяем статус регистрации
-            user_status = get_user_status(update.effective_user.id)
+            user_status = await get_user_status(update.effective_user.id)
             if user_status != 'registered':
                 await update.message.reply_text(
                     "❌ **Необходима регистрация**\n\n"
@@ -415,7 +667,7 @@ async def handle_web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE
             
             if selected_assistant and selected_assistant in ASSISTANTS:
                 # Проверяем статус регистрации
-                user_status = get_user_status(update.effective_user.id)
+                user_status = await get_user_status(update.effective_user.id)
                 if user_status != 'registered':
                     await update.message.reply_text(
                         "❌ **Необходима регистрация**\n\n"
@@ -478,7 +730,7 @@ async def start_chat_with_assistant_direct(update: Update, context: ContextTypes
     user_id = update.effective_user.id
 
     # Проверяем статус регистрации
-    user_status = get_user_status(user_id)
+    user_status = await get_user_status(user_id)
     if user_status != 'registered':
         await update.message.reply_text(
             "❌ **Необходима регистрация**\n\n"
@@ -489,13 +741,15 @@ async def start_chat_with_assistant_direct(update: Update, context: ContextTypes
         )
         return
 
-    # Завершение существующего чата, если есть
+    # Завершение существующего чата, если есть: выполнение в старом потоке отменяется до его удаления
     if user_id in active_threads:
+        await message_inbox.cancel(user_id)
         try:
             _, thread_id, _ = active_threads[user_id]
-            client.beta.threads.delete(thread_id)
+            del active_threads[user_id]
+            await thread_cleanup.enqueue(thread_id)
         except Exception as e:
-            logger.error(f"Ошибка при удалении потока: {e}")
+            logger.error(f"Ошибка при постановке потока в очередь удаления: {e}")
 
     assistant_id = ASSISTANTS.get(assistant_type)
 
@@ -506,9 +760,9 @@ async def start_chat_with_assistant_direct(update: Update, context: ContextTypes
         )
         return
 
-    # Создание нового потока
-    thread = client.beta.threads.create()
-    active_threads[user_id] = (assistant_id, thread.id, assistant_type)
+    # Получение готового потока из пула
+    thread_id = await thread_pool.acquire()
+    active_threads[user_id] = (assistant_id, thread_id, assistant_type)
 
     await update.message.reply_text(
         f"✅ *Запущен ассистент: {ASSISTANT_NAMES[assistant_type].replace('📊 ', '').replace('💡 ', '').replace('📝 ', '').replace('🔄 ', '')}*\n\n"
@@ -520,7 +774,7 @@ async def start_chat_with_assistant_direct(update: Update, context: ContextTypes
         reply_markup=get_main_keyboard()
     )
 
-    logger.info(f"Прямой запуск ассистента для пользователя {user_id} с ассистентом '{ASSISTANT_NAMES[assistant_type]}' (ID: {assistant_id}) в потоке {thread.id}")
+    logger.info(f"Прямой запуск ассистента для пользователя {user_id} с ассистентом '{ASSISTANT_NAMES[assistant_type]}' (ID: {assistant_id}) в потоке {thread_id}")
 
 async def handle_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка inline запросов для поддержки menu button."""
@@ -587,7 +841,7 @@ async def send_specific_assistant_message(update: Update, context: ContextTypes.
 
 async def send_general_assistant_selection_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправка общего сообщения с выбором ассистента (fallback)."""
-    user_status = get_user_status(update.effective_user.id)
+    user_status = await get_user_status(update.effective_user.id)
 
     if user_status != 'registered':
         message_text = (
@@ -622,7 +876,7 @@ async def start_chat_with_type(update: Update, context: ContextTypes.DEFAULT_TYP
     user_id = update.effective_user.id
 
     # Проверяем статус регистрации
-    user_status = get_user_status(user_id)
+    user_status = await get_user_status(user_id)
     if user_status != 'registered':
         await update.callback_query.edit_message_text(
             "❌ **Необходима регистрация**\n\n"
@@ -632,13 +886,15 @@ async def start_chat_with_type(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
-    # Завершение существующего чата, если есть
+    # Завершение существующего чата, если есть: выполнение в старом потоке отменяется до его удаления
     if user_id in active_threads:
+        await message_inbox.cancel(user_id)
         try:
             _, thread_id, _ = active_threads[user_id]
-            client.beta.threads.delete(thread_id)
+            del active_threads[user_id]
+            await thread_cleanup.enqueue(thread_id)
         except Exception as e:
-            logger.error(f"Ошибка при удалении потока: {e}")
+            logger.error(f"Ошибка при постановке потока в очередь удаления: {e}")
 
     assistant_id = ASSISTANTS.get(assistant_type)
 
@@ -649,9 +905,9 @@ async def start_chat_with_type(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
-    # Создание нового потока
-    thread = client.beta.threads.create()
-    active_threads[user_id] = (assistant_id, thread.id, assistant_type)
+    # Получение готового потока из пула
+    thread_id = await thread_pool.acquire()
+    active_threads[user_id] = (assistant_id, thread_id, assistant_type)
 
     await update.callback_query.edit_message_text(
         f"✅ *Запущен ассистент: {ASSISTANT_NAMES[assistant_type].replace('📊 ', '').replace('💡 ', '').replace('📝 ', '').replace('🔄 ', '')}*\n\n"
@@ -662,21 +918,22 @@ async def start_chat_with_type(update: Update, context: ContextTypes.DEFAULT_TYP
         parse_mode='Markdown'
     )
 
-    logger.info(f"Начат новый чат для пользователя {user_id} с ассистентом '{ASSISTANT_NAMES[assistant_type]}' (ID: {assistant_id}) в потоке {thread.id}")
+    logger.info(f"Начат новый чат для пользователя {user_id} с ассистентом '{ASSISTANT_NAMES[assistant_type]}' (ID: {assistant_id}) в потоке {thread_id}")
 
 async def stop_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Завершение текущего разговора с ассистентом."""
     user_id = update.effective_user.id
 
     if user_id in active_threads:
+        # Выполнение в потоке отменяется до того, как поток перестанет быть активным
+        await message_inbox.cancel(user_id)
         _, thread_id, assistant_type = active_threads[user_id]
+        del active_threads[user_id]
 
         try:
-            client.beta.threads.delete(thread_id)
+            await thread_cleanup.enqueue(thread_id)
         except Exception as e:
-            logger.error(f"Ошибка при удалении потока: {e}")
-
-        del active_threads[user_id]
+            logger.error(f"Ошибка при постановке потока в очередь удаления: {e}")
 
         await update.message.reply_text(
             f"👋 Разговор с ассистентом *{ASSISTANT_NAMES[assistant_type].replace('📊 ', '').replace('💡 ', '').replace('📝 ', '').replace('🔄 ', '')}* завершен.\n\n"
@@ -710,7 +967,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
     # Проверка наличия активного разговора для обычных сообщений
     if user_id not in active_threads:
-        user_status = get_user_status(user_id)
+        user_status = await get_user_status(user_id)
         if user_status != 'registered':
             await update.message.reply_text(
                 "❌ **Необходима регистрация**\n\n"
@@ -727,137 +984,250 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             )
         return
 
+    active_threads.record_message(user_id)
+
+    # Пока идет выполнение, сообщение ждет в очереди и уйдет вместе со следующими
+    if message_inbox.submit(user_id, message_text, update.message):
+        logger.info(f"Сообщение пользователя {user_id} ожидает окончания текущего выполнения")
+
+async def answer_messages(user_id: int, texts: List[str], message) -> None:
+    """Отвечает на накопленные сообщения пользователя одним выполнением ассистента."""
+    # Разговор мог быть завершен, пока сообщения ждали в очереди
+    if user_id not in active_threads:
+        return
+
     # Получение информации об активном ассистенте
     assistant_id, thread_id, assistant_type = active_threads[user_id]
+    message_text = "\n\n".join(texts)
 
-    # Отправка действия "набирает текст"
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+    # Запросы к OpenAI в этой задаче учитываются в лимитах пользователя, метрики — по типу ассистента
+    current_user.set(user_id)
+    current_assistant.set(assistant_type)
 
-    try:
-        # Добавление сообщения пользователя в поток
-        client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role="user",
-            content=message_text
-        )
+    # Выполнение продолжается после ответа обработчика обновления — отдельный сегмент трассы
+    with tracer.span('answer_messages', user_id=user_id, messages=len(texts), assistant_type=assistant_type):
+        # Первое сообщение нового разговора может быть отвечено из кэша
+        cacheable = RESPONSE_CACHE_ENABLED and len(texts) == 1 and active_threads.message_count(user_id) == 1
 
-        # Запуск ассистента в потоке
-        run = client.beta.threads.runs.create(
-            thread_id=thread_id,
-            assistant_id=assistant_id,
-        )
+        try:
+            if cacheable:
+                cached = response_cache.get(assistant_type, message_text)
+                if cached:
+                    await send_response(message, cached)
+                    await remember_exchange(thread_id, message_text, cached)
+                    return
 
-        # Ожидание ответа
-        response = await poll_run(thread_id, run.id)
+            # Отправка действия "набирает текст"
+            await message.reply_chat_action("typing")
 
-        # Отправка ответа ассистента
-        if response:
-            for message_chunk in split_response(response):
-                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
-                await update.message.reply_text(
-                    message_chunk, 
-                    reply_markup=get_main_keyboard(),
-                    parse_mode='Markdown'
-                )
-        else:
-            await update.message.reply_text(
-                "❌ Не удалось сформировать ответ. Пожалуйста, попробуйте снова.",
+            if ASSISTANT_STREAMING:
+                response = await reply_with_stream(message, assistant_id, thread_id, message_text)
+            else:
+                response = await ask_assistant(assistant_id, thread_id, message_text)
+
+                # Отправка ответа ассистента
+                if response:
+                    await send_response(message, response)
+                else:
+                    await message.reply_text(
+                        "❌ Не удалось сформировать ответ. Пожалуйста, попробуйте снова.",
+                        reply_markup=get_main_keyboard()
+                    )
+
+            if cacheable and response not in ("", NO_RESPONSE_TEXT, RUN_FAILED_TEXT, RUN_TIMEOUT_TEXT):
+                response_cache.put(assistant_type, message_text, response)
+
+        except Exception as e:
+            logger.error(f"Ошибка в разговоре: {e}")
+            record_run("error")
+            await message.reply_text(
+                "❌ Извините, возникла ошибка при обработке вашего запроса. Пожалуйста, попробуйте еще раз.",
                 reply_markup=get_main_keyboard()
             )
 
-    except Exception as e:
-        logger.error(f"Ошибка в разговоре: {e}")
-        await update.message.reply_text(
-            "❌ Извините, возникла ошибка при обработке вашего запроса. Пожалуйста, попробуйте еще раз.",
-            reply_markup=get_main_keyboard()
-        )
+async def send_response(message, response: str) -> None:
+    """Отправляет ответ ассистента частями, не превышающими лимит Telegram."""
+    with stage_timer("split_response"):
+        chunks = format_response(response, MAX_MESSAGE_LENGTH)
+    with stage_timer("send_response"):
+        for message_chunk in chunks:
+            await message.reply_chat_action("typing")
+            # Разметка передается выделениями (entities): Telegram не разбирает текст и не отклонит его
+            await message.reply_text(
+                message_chunk.text,
+                reply_markup=get_main_keyboard(),
+                entities=message_chunk.entities
+            )
 
-def clean_markdown_formatting(text: str) -> str:
-    """Очищает и исправляет markdown форматирование для Telegram."""
-    import re
+async def remember_exchange(thread_id: str, question: str, answer: str) -> None:
+    """Добавляет в поток вопрос и ответ из кэша, чтобы ассистент видел контекст разговора."""
+    await client.beta.threads.messages.create(thread_id=thread_id, role="user", content=question)
+    await client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=answer)
+
+# Очереди сообщений пользователей на время активного выполнения
+message_inbox = MessageInbox(answer_messages)
+
+async def ask_assistant(assistant_id: str, thread_id: str, message_text: str) -> str:
+    """Отправляет сообщение в поток, запускает ассистента и возвращает его ответ."""
+    # Добавление сообщения пользователя в поток
+    await client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=message_text
+    )
 
-    text = re.sub(r'\*\*(.*?)\*\*', r'*\1*', text)
-    text = re.sub(r'###\s*(.*?)(?=\n|$)', r'*\1*', text)
-    text = re.sub(r'##\s*(.*?)(?=\n|$)', r'*\1*', text)
-    text = re.sub(r'#\s*(.*?)(?=\n|$)', r'*\1*', text)
-    text = re.sub(r'^\s*[\-\*]\s+', '• ', text, flags=re.MULTILINE)
-    text = re.sub(r'\*{3,}', '**', text)
+    # Запуск ассистента в потоке
+    run = await client.beta.threads.runs.create(
+        thread_id=thread_id,
+        assistant_id=assistant_id,
+    )
 
-    return text
+    # Ожидание ответа
+    with tracer.span('poll_run', run_id=run.id):
+        return await poll_run(thread_id, run.id)
 
-def split_response(response: str) -> list:
-    """Разбивает длинный ответ на части, не превышающие максимальную длину сообщения Telegram."""
-    response = clean_markdown_formatting(response)
+async def stream_assistant(assistant_id: str, thread_id: str, message_text: str, on_delta) -> str:
+    """Запускает ассистента в потоковом режиме, передавая фрагменты текста в on_delta.
 
-    if len(response) <= MAX_MESSAGE_LENGTH:
-        return [response]
+    Возвращает итоговый статус выполнения; "timeout", если поток не завершился за
+    poll_policy.deadline (выполнение при этом отменяется).
+    """
+    await client.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=message_text
+    )
 
-    chunks = []
-    current_chunk = ""
+    run_id = None
+    status = "incomplete"
+    try:
+        # Тот же дедлайн, что при опросе: зависший поток событий не держит очередь пользователя
+        async with asyncio.timeout(poll_policy.deadline):
+            stream = await client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=assistant_id,
+                stream=True
+            )
 
-    paragraphs = response.split('\n\n')
+            # Поток закрывается и при исключении в on_delta или отмене задачи (/stop, смена ассистента),
+            # иначе соединение не вернется в пул клиента
+            async with stream:
+                async for event in stream:
+                    if event.event == "thread.run.created":
+                        run_id = event.data.id
+                    elif event.event == "thread.message.delta":
+                        for content_part in event.data.delta.content or []:
+                            if content_part.type == "text" and content_part.text and content_part.text.value:
+                                await on_delta(content_part.text.value)
+                    elif event.event in ("thread.run.completed", "thread.run.failed",
+                                         "thread.run.cancelled", "thread.run.expired", "thread.run.incomplete"):
+                        status = event.data.status
+    except TimeoutError:
+        status = "timeout"
+        poll_stats.record(run_id or "-", status, 0, None, None)
+        if run_id:
+            try:
+                await client.beta.threads.runs.cancel(run_id=run_id, thread_id=thread_id)
+            except Exception as e:
+                logger.warning(f"Не удалось отменить выполнение {run_id}: {e}")
 
-    for paragraph in paragraphs:
-        if len(paragraph) > MAX_MESSAGE_LENGTH:
-            sentences = paragraph.replace('. ', '.|').replace('! ', '!|').replace('? ', '?|').split('|')
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) + 2 <= MAX_MESSAGE_LENGTH:
-                    if current_chunk:
-                        current_chunk += " " + sentence
-                    else:
-                        current_chunk = sentence
-                else:
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = sentence
-        else:
-            if len(current_chunk) + len(paragraph) + 2 <= MAX_MESSAGE_LENGTH:
-                if current_chunk:
-                    current_chunk += "\n\n" + paragraph
-                else:
-                    current_chunk = paragraph
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                current_chunk = paragraph
+    return status
 
-    if current_chunk:
-        chunks.append(current_chunk)
+async def reply_with_stream(message, assistant_id: str, thread_id: str, message_text: str) -> str:
+    """Отвечает пользователю потоково: сообщение появляется с первыми токенами и дописывается.
 
-    return chunks
+    Возвращает полный текст ответа или пустую строку, если выполнение не удалось.
+    """
+    reply = StreamingReply(
+        message,
+        max_length=MAX_MESSAGE_LENGTH,
+        edit_interval=STREAM_EDIT_INTERVAL,
+        reply_markup=get_main_keyboard(),
+        formatter=MarkdownChunker(MAX_MESSAGE_LENGTH)
+    )
 
-async def poll_run(thread_id: str, run_id: str) -> str:
-    """Ожидание завершения выполнения и возврат ответа ассистента."""
-    max_attempts = 60
-    for _ in range(max_attempts):
-        await asyncio.sleep(1)
+    started = time.perf_counter()
+    with tracer.span('stream') as span:
+        status = await stream_assistant(assistant_id, thread_id, message_text, reply.feed)
+        await reply.finish()
+        if span:
+            span.attrs.update(status=status, time_to_first_token=reply.time_to_first_token)
+    record_run(status, time.perf_counter() - started)
+
+    if reply.started:
+        logger.info(f"Первый фрагмент ответа в потоке {thread_id} показан через {reply.time_to_first_token:.2f}с")
+
+    if status != "completed":
+        logger.error(f"Выполнение завершилось со статусом: {status}")
+        await message.reply_text(
+            RUN_TIMEOUT_TEXT if status == "timeout" else RUN_FAILED_TEXT,
+            reply_markup=get_main_keyboard()
+        )
+        return ""
+    elif not reply.started:
+        await message.reply_text(
+            NO_RESPONSE_TEXT,
+            reply_markup=get_main_keyboard()
+        )
+
+    return reply.text
 
-        run = client.beta.threads.runs.retrieve(
+async def fetch_run_response(thread_id: str, run_id: str) -> str:
+    """Получает только сообщение ассистента, созданное указанным выполнением."""
+    with stage_timer("fetch_response"):
+        messages = await client.beta.threads.messages.list(
             thread_id=thread_id,
-            run_id=run_id
+            run_id=run_id,
+            order="desc",
+            limit=1
         )
 
-        if run.status == "completed":
-            messages = client.beta.threads.messages.list(
-                thread_id=thread_id
+    for message in messages.data:
+        if message.role == "assistant":
+            return "".join(
+                content_part.text.value
+                for content_part in message.content
+                if content_part.type == "text"
             )
 
-            for message in messages.data:
-                if message.role == "assistant":
-                    content = ""
-                    for content_part in message.content:
-                        if content_part.type == "text":
-                            content += content_part.text.value
+    return NO_RESPONSE_TEXT
 
-                    return content
+async def poll_run(thread_id: str, run_id: str) -> str:
+    """Ожидание завершения выполнения и возврат ответа ассистента."""
+    started = time.monotonic()
+    deadline = started + poll_policy.deadline
+    polls = 0
+    # Отправка предыдущего опроса: после нее выполнение еще могло быть незавершенным
+    previous_sent = started
+    for delay in poll_policy.delays():
+        await asyncio.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+
+        sent = time.monotonic()
+        run = await client.beta.threads.runs.retrieve(
+            thread_id=thread_id,
+            run_id=run_id
+        )
+        polls += 1
 
-            return "Нет ответа от ассистента."
+        if run.status == "completed":
+            poll_stats.record(run_id, run.status, polls, time.monotonic() - previous_sent, run_finished_at(run))
+            record_run(run.status, time.monotonic() - started)
+
+            return await fetch_run_response(thread_id, run_id)
 
         if run.status in ["failed", "cancelled", "expired"]:
+            poll_stats.record(run_id, run.status, polls, time.monotonic() - previous_sent, run_finished_at(run))
+            record_run(run.status, time.monotonic() - started)
             logger.error(f"Выполнение завершилось со статусом: {run.status}")
-            return "Извините, я не смог выполнить запрос."
+            return RUN_FAILED_TEXT
+
+        if time.monotonic() >= deadline:
+            break
+        previous_sent = sent
 
-    return "Ответ занимает слишком много времени. Пожалуйста, попробуйте позже."
+    poll_stats.record(run_id, "timeout", polls, None, None)
+    record_run("timeout", time.monotonic() - started)
+    return RUN_TIMEOUT_TEXT
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработка нажатий на inline кнопки."""
@@ -871,78 +1241,250 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await start_chat_with_type(update, context, assistant_type)
 
 # HTTP сервер для API и health check
-class APIHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b'Bot is running!')
-        else:
-            self.send_response(404)
-            self.end_headers()
-
-    def do_POST(self):
-        if self.path == '/api/register':
+# Режим webhook: Telegram присылает обновления на WEBHOOK_URL вместо long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Секрет, который Telegram передает в X-Telegram-Bot-Api-Secret-Token; без явного значения — случайный на запуск
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "10000"))
+
+# Заголовки CORS для запросов из Mini App
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+def json_response(status: int, data: Any) -> Response:
+    return Response(status, json.dumps(data).encode('utf-8'), headers=CORS_HEADERS)
+
+class APIHandler:
+    """Маршрутизация запросов API бота (health check, регистрация, статистика, webhook)."""
+
+    def __init__(self, webhook_application: Optional[Application] = None, webhook_secret: str = WEBHOOK_SECRET):
+        # Обновления от Telegram принимаются, только если передано приложение бота
+        self.webhook_application = webhook_application
+        self.webhook_secret = webhook_secret.encode('utf-8')
+        self.webhook_updates = 0
+        # Отклоненные обновления по причине: неверный секрет (403), полная очередь (503), некорректное тело (400)
+        self.webhook_rejected: Dict[str, int] = {'secret': 0, 'queue_full': 0, 'invalid': 0}
+
+    def webhook_stats(self) -> Dict[str, Any]:
+        """Принятые и отклоненные обновления webhook и глубина очереди обновлений."""
+        return {
+            'updates': self.webhook_updates,
+            'rejected': dict(self.webhook_rejected),
+            'queue_depth': self.webhook_application.update_queue.qsize() if self.webhook_application else 0
+        }
+
+    async def __call__(self, request: Request) -> Response:
+        if request.method == 'GET':
+            return await self.do_GET(request)
+        if request.method == 'POST':
+            return await self.do_POST(request)
+        if request.method == 'OPTIONS':
+            return await self.do_OPTIONS(request)
+        return Response(405)
+
+    async def do_GET(self, request: Request) -> Response:
+        if request.path == '/':
+            return Response(200, b'Bot is running!', content_type='text/html')
+        elif request.path == '/metrics':
+            return Response(200, registry.render().encode('utf-8'),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+        elif request.path == '/api/stats':
+            # Счетчики кэшей для мониторинга
+            stats = {
+                'user_status_cache': user_status_cache.stats(),
+                'activity_buffer': activity_buffer.stats(),
+                'database': adb.stats(),
+                'response_cache': response_cache.stats(),
+                'tracing': tracer.stats(),
+                'traffic_recorder': traffic_recorder.stats(),
+                'init_data': init_data_validator.stats(),
+                'run_polling': poll_stats.summary(),
+                'thread_pool': thread_pool.stats(),
+                'thread_cleanup': thread_cleanup.stats(),
+                'update_workers': update_processor.stats(),
+                'rate_limiter': rate_limiter.stats(),
+                'api_server': api_server.stats() if api_server else {},
+                'webhook': self.webhook_stats()
+            }
+            return Response(200, json.dumps(stats).encode('utf-8'))
+        return Response(404)
+
+    async def do_POST(self, request: Request) -> Response:
+        if request.path == WEBHOOK_PATH and self.webhook_application:
+            return await self.handle_webhook(request)
+        if request.path == '/api/register':
             try:
-                content_length = int(self.headers['Content-Length'])
-                post_data = self.rfile.read(content_length)
-                data = json.loads(post_data.decode('utf-8'))
+                data = json.loads(request.body.decode('utf-8'))
 
                 # Валидируем данные Telegram
-                init_data = data.get('initData')
-                bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-
-                user_data = validate_telegram_data(init_data, bot_token)
+                user_data = init_data_validator.validate(data.get('initData'))
 
                 if user_data:
                     # Регистрируем пользователя
-                    register_user(user_data['id'])
-
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-
-                    response = {'success': True, 'message': 'Пользователь зарегистрирован'}
-                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    await adb.run('register_user', register_user, user_data['id'])
+                    return json_response(200, {'success': True, 'message': 'Пользователь зарегистрирован'})
                 else:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-
-                    response = {'success': False, 'message': 'Неверные данные'}
-                    self.wfile.write(json.dumps(response).encode('utf-8'))
+                    return json_response(400, {'success': False, 'message': 'Неверные данные'})
 
             except Exception as e:
                 logger.error(f"Ошибка API регистрации: {e}")
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
+                return json_response(500, {'success': False, 'message': 'Ошибка сервера'})
+        return Response(404)
+
+    async def handle_webhook(self, request: Request) -> Response:
+        """Принимает обновление от Telegram: проверка секрета, постановка в очередь, мгновенный ответ."""
+        secret = request.headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8')
+        if not hmac.compare_digest(secret, self.webhook_secret):
+            self.webhook_rejected['secret'] += 1
+            return Response(403)
+
+        update_queue = self.webhook_application.update_queue
+        if update_queue.qsize() >= WEBHOOK_MAX_QUEUE:
+            # Telegram повторит доставку позже
+            self.webhook_rejected['queue_full'] += 1
+            return Response(503)
 
-                response = {'success': False, 'message': 'Ошибка сервера'}
-                self.wfile.write(json.dumps(response).encode('utf-8'))
-        else:
-            self.send_response(404)
-            self.end_headers()
+        try:
+            update = Update.de_json(json.loads(request.body), self.webhook_application.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            self.webhook_rejected['invalid'] += 1
+            return Response(400)
+
+        update_queue.put_nowait(update)
+        self.webhook_updates += 1
+        return Response(200)
+
+    async def do_OPTIONS(self, request: Request) -> Response:
+        return Response(200, headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type'
+        })
+
+# HTTP сервер API, запускается в цикле событий бота при заданном PORT
+api_server: Optional[AsyncHTTPServer] = None
+
+def webhook_stats() -> Dict[str, Any]:
+    """Счетчики webhook запущенного API сервера (без сервера — как у сервера без webhook)."""
+    return (api_server.handler if api_server else APIHandler()).webhook_stats()
+
+registry.collected_counter('bot_webhook_updates_total', 'Обновления, принятые через webhook',
+                           lambda: webhook_stats()['updates'])
+registry.collected_counter('bot_webhook_rejected_total', 'Отклоненные обновления webhook по причине',
+                           lambda: webhook_stats()['rejected'], ('reason',))
+registry.gauge('bot_webhook_queue_depth', 'Обновления webhook, ожидающие обработки',
+               lambda: webhook_stats()['queue_depth'])
+
+async def start_api_server(port: int, webhook_application: Optional[Application] = None) -> AsyncHTTPServer:
+    """Запуск HTTP сервера для API и health check в текущем цикле событий."""
+    global api_server
+    api_server = AsyncHTTPServer(
+        APIHandler(webhook_application),
+        host=os.getenv("API_HOST", "0.0.0.0"),
+        port=port,
+        max_body_size=int(os.getenv("API_MAX_BODY_SIZE", str(64 * 1024))),
+        request_timeout=float(os.getenv("API_REQUEST_TIMEOUT", "10")),
+        keepalive_timeout=float(os.getenv("API_KEEPALIVE_TIMEOUT", "15")),
+        max_connections=int(os.getenv("API_MAX_CONNECTIONS", "1000"))
+    )
+    await api_server.start()
+    return api_server
+
+async def post_init(application: Application) -> None:
+    """Восстановление состояния и запуск фоновых задач после инициализации бота."""
+    active_threads.load()
+    active_threads.start()
+    thread_pool.start()
+    # Очередь удаления потоков общая для всех процессов, разбирает ее только первый
+    if SHARD_INDEX == 0:
+        thread_cleanup.start()
+    activity_buffer.start()
+    tracer.start()
+    traffic_recorder.start()
+
+    # Обновления по HTTP принимаются в режиме webhook и в процессах-воркерах sharding.py
+    accept_updates = bool(WEBHOOK_URL) or SHARD_WORKER
+    port = os.environ.get("PORT")
+    if port or accept_updates:
+        await start_api_server(int(port or "8080"), application if accept_updates else None)
+
+async def post_shutdown(application: Application) -> None:
+    """Освобождение ресурсов при остановке бота."""
+    if api_server:
+        await api_server.stop()
+    await message_inbox.close()
+    await active_threads.stop()
+    await thread_pool.stop()
+    await thread_cleanup.stop()
+    await activity_buffer.stop()
+    await tracer.stop()
+    await traffic_recorder.stop()
+    await client.close()
+    adb.close()
+    close_all()
+
+def build_application(token: str) -> Application:
+    """Создает приложение бота со всеми обработчиками."""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(telegram_request_seconds, connection_pool_size=256))
+        .concurrent_updates(update_processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    # Другой адрес Bot API (локальный Bot API сервер или заглушка для замеров)
+    if os.getenv("TELEGRAM_API_BASE_URL"):
+        builder = builder.base_url(os.getenv("TELEGRAM_API_BASE_URL"))
+    application = builder.build()
+
+    # Добавление обработчиков
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("status", status_command))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_data))
+    application.add_handler(InlineQueryHandler(handle_inline_query))
+    application.add_handler(CallbackQueryHandler(button_callback))
+
+    return application
+
+async def run_webhook(application: Application, register: bool = True) -> None:
+    """Работа в режиме webhook: обновления принимает API сервер и кладет в очередь приложения.
+
+    register=False — не регистрировать webhook в Telegram (воркер sharding.py получает
+    обновления от управляющего процесса).
+    """
+    await application.initialize()
+    await post_init(application)
+
+    if register:
+        webhook_url = WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        )
+        logger.info(f"Webhook установлен: {webhook_url}")
 
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
+    await application.start()
 
-    def log_message(self, format, *args):
-        pass
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
 
-def run_api_server(port):
-    """Запуск HTTP сервера для API и health check."""
-    server = HTTPServer(('0.0.0.0', port), APIHandler)
-    logger.info(f"API сервер запущен на порту {port}")
-    server.serve_forever()
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка бота")
+        await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
 
 def main() -> None:
     """Запуск бота."""
@@ -960,26 +1502,18 @@ def main() -> None:
         logger.error("Проверьте переменные окружения OPENAI_ASSISTANT_ID_*")
         return
 
-    application = Application.builder().token(token).build()
-
-    # Добавление обработчиков
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("status", status_command))
-
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, handle_web_app_data))
-    application.add_handler(InlineQueryHandler(handle_inline_query))
-    application.add_handler(CallbackQueryHandler(button_callback))
+    application = build_application(token)
 
     logger.info("Запуск бота")
 
+    if WEBHOOK_URL:
+        logger.info("Запуск в webhook режиме")
+        asyncio.run(run_webhook(application))
+        return
+
     port = os.environ.get("PORT")
     if port:
-        api_thread = Thread(target=run_api_server, args=(int(port),), daemon=True)
-        api_thread.start()
-        logger.info(f"API сервер запущен на порту {port}")
-
+        # API сервер стартует в post_init, в цикле событий бота
         logger.info("Запуск в polling режиме с API сервером")
         try:
             application.run_polling(drop_pending_updates=True)
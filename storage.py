@@ -0,0 +1,217 @@
+"""
+SQLite Storage for Telegram Bot
+
+Общий слой доступа к users.db. Каждый поток ОС держит одно долгоживущее
+соединение (без открытия файла и разбора схемы на каждый запрос), база
+работает в режиме WAL: читатели не блокируют писателя и друг друга, поэтому
+бот и утилиты командной строки могут работать с одной базой одновременно.
+Записи внутри процесса сериализуются блокировкой, между процессами —
+транзакциями BEGIN IMMEDIATE с ожиданием busy_timeout.
+
+Асинхронный код работает с базой через AsyncDatabase: запросы выполняются
+в выделенных потоках, и медленный диск или чужая долгая транзакция не
+останавливают цикл событий бота.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import bisect
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Настройки соединения, применяемые при его открытии
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -8000',
+)
+
+class Database:
+    """Долгоживущие соединения к одной базе SQLite: по одному на поток."""
+
+    def __init__(self, path: str = 'users.db', busy_timeout: float = 5.0, cached_statements: int = 256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        # Транзакциями управляем сами (isolation_level=None), кэш подготовленных выражений — на соединение
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока, открывается при первом обращении."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Cursor]:
+        """Курсор для чтения. Каждый запрос видит последнее зафиксированное состояние."""
+        cursor = self.connection().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Cursor]:
+        """Курсор внутри транзакции записи: фиксируется при выходе, откатывается при ошибке."""
+        conn = self.connection()
+        with self._write_lock:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                cursor.close()
+
+    def close(self):
+        """Закрывает все соединения, открытые этим объектом."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Ошибка при закрытии соединения с {self.path}: {e}")
+        self._local = threading.local()
+
+class LatencyHistogram:
+    """Гистограмма задержек с фиксированными границами корзин (в секундах).
+
+    bounds — границы корзин по возрастанию; по умолчанию BOUNDS, рассчитанные на запросы к SQLite.
+    """
+
+    BOUNDS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self, bounds: Optional[Tuple[float, ...]] = None):
+        self.bounds = tuple(bounds) if bounds else self.BOUNDS
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'avg': round(self.total / self.count, 6) if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': round(self.max, 6)
+        }
+
+class AsyncDatabase:
+    """Асинхронный доступ к Database через выделенные потоки с ограниченной очередью."""
+
+    def __init__(self, database: Database, workers: int = 2, max_pending: int = 1000):
+        self.database = database
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def run(self, query: str, fn: Callable, *args) -> Any:
+        """Выполняет fn(*args) в потоке базы данных. query — имя запроса для статистики.
+
+        Если в очереди уже max_pending запросов, вызывающий ждет освобождения места.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='sqlite')
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        async with self._slots:
+            self.pending += 1
+            started = time.perf_counter()
+            try:
+                with tracer.span(f"db {query}"):
+                    return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            finally:
+                self.pending -= 1
+                histogram = self.histograms.get(query)
+                if histogram is None:
+                    histogram = self.histograms[query] = LatencyHistogram()
+                histogram.observe(time.perf_counter() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и задержки по типам запросов (включая ожидание в очереди)."""
+        return {
+            'pending': self.pending,
+            'queries': {query: histogram.summary() for query, histogram in self.histograms.items()}
+        }
+
+    def close(self):
+        """Дожидается выполнения начатых запросов и останавливает потоки."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+_databases: Dict[str, Database] = {}
+_databases_lock = threading.Lock()
+
+def get_database(path: str = 'users.db') -> Database:
+    """Возвращает общий для процесса объект Database для файла базы."""
+    key = os.path.abspath(path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = Database(key)
+            _databases[key] = database
+        return database
+
+def close_all():
+    """Закрывает соединения всех баз процесса (при завершении работы)."""
+    with _databases_lock:
+        databases = list(_databases.values())
+    for database in databases:
+        database.close()
@@ -0,0 +1,187 @@
+"""
+Streaming Replies for Telegram Bot
+
+Постепенный вывод ответа ассистента: первое сообщение отправляется с первыми
+токенами, дальше оно редактируется не чаще заданного интервала, а при
+достижении лимита длины ответ продолжается в новом сообщении.
+
+С форматированием (MarkdownChunker из telegram_format.py) фрагменты сразу
+проходят через него: каждое промежуточное и итоговое сообщение уже
+отформатировано (текст и entities, без parse_mode), а границы сообщений
+те же, что у send_response.
+
+Промежуточные правки необязательны: на RetryAfter следующая правка
+откладывается на указанное Telegram время, при сетевой ошибке правка
+пропускается. Законченное сообщение (итоговая правка) отправляется
+повторно, пока Telegram его не примет.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, List, Optional, Tuple
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from telegram_entities import FormattedText
+from telegram_format import MarkdownChunker
+
+logger = logging.getLogger(__name__)
+
+class StreamingReply:
+    """Ответ ассистента, который растет в Telegram по мере генерации."""
+
+    # Попыток отправить законченное сообщение при сетевых ошибках
+    FINAL_ATTEMPTS = 3
+
+    def __init__(self, message: Any, max_length: int, edit_interval: float = 1.0,
+                 reply_markup: Any = None, formatter: Optional[MarkdownChunker] = None):
+        self.message = message
+        self.max_length = max_length
+        self.edit_interval = edit_interval
+        self.reply_markup = reply_markup
+        self.formatter = formatter
+        self.text = ""
+        self.started_at = time.monotonic()
+        self.first_visible_at: Optional[float] = None
+        self._current = ""
+        self._sent: Any = None
+        self._shown: Tuple[str, List[dict]] = ("", [])
+        self._last_edit = 0.0
+        # До этого момента промежуточные правки не отправляются (RetryAfter от Telegram)
+        self._retry_at = 0.0
+
+    @property
+    def started(self) -> bool:
+        """Показан ли пользователю хотя бы один фрагмент ответа."""
+        return self.first_visible_at is not None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        """Время от начала запроса до первого видимого фрагмента, в секундах."""
+        if self.first_visible_at is None:
+            return None
+        return self.first_visible_at - self.started_at
+
+    async def feed(self, delta: str):
+        """Добавляет очередной фрагмент текста и при необходимости обновляет сообщение."""
+        if not delta:
+            return
+        self.text += delta
+
+        if self.formatter:
+            for chunk in self.formatter.feed(delta):
+                await self._show(chunk, final=True)
+                self._next_message()
+            # Промежуточное сообщение собирается, только когда его пора показать
+            if self._edit_due():
+                await self._show(self.formatter.preview())
+            return
+
+        self._current += delta
+        while len(self._current) > self.max_length:
+            cut = self._split_point(self._current)
+            head, self._current = self._current[:cut], self._current[cut:].lstrip()
+            await self._show(head, final=True)
+            self._next_message()
+
+        if self._current.strip() and self._edit_due():
+            await self._show(self._current)
+
+    async def finish(self) -> str:
+        """Показывает окончательный текст текущего сообщения."""
+        if self.formatter:
+            chunks = self.formatter.finish()
+            for index, chunk in enumerate(chunks):
+                if index:
+                    self._next_message()
+                await self._show(chunk, final=True)
+        elif self._current.strip():
+            await self._show(self._current, final=True)
+        return self.text
+
+    def _edit_due(self) -> bool:
+        if time.monotonic() < self._retry_at:
+            return False
+        return self._sent is None or time.monotonic() - self._last_edit >= self.edit_interval
+
+    def _next_message(self):
+        """Следующий текст ответа отправляется новым сообщением."""
+        self._sent = None
+        self._shown = ("", [])
+
+    def _split_point(self, text: str) -> int:
+        """Ищет границу абзаца, строки или слова в пределах лимита длины."""
+        window = text[:self.max_length]
+        for separator in ('\n\n', '\n', ' '):
+            index = window.rfind(separator)
+            if index >= self.max_length // 2:
+                return index + len(separator)
+        return self.max_length
+
+    async def _show(self, content: Any, final: bool = False):
+        """Отправляет новое сообщение или редактирует уже отправленное.
+
+        content — строка или FormattedText от форматирования; final — текст сообщения окончательный
+        и должен быть доставлен, а не пропущен при ошибке.
+        """
+        if isinstance(content, FormattedText):
+            text, entities = content.text, content.entities
+        else:
+            text, entities = content.strip(), []
+        if not text.strip() or (text, [entity.to_dict() for entity in entities]) == self._shown:
+            return
+
+        attempts = 0
+        while True:
+            try:
+                await self._deliver(text, entities)
+                return
+            except RetryAfter as e:
+                delay = float(e.retry_after)
+                if not final:
+                    self._retry_at = time.monotonic() + delay
+                    logger.info(f"Telegram ограничил частоту правок, следующая через {delay:.0f}с")
+                    return
+                await asyncio.sleep(delay)
+            except BadRequest:
+                raise
+            except NetworkError as e:
+                attempts += 1
+                if not final:
+                    logger.warning(f"Промежуточная правка ответа пропущена: {e}")
+                    return
+                if attempts >= self.FINAL_ATTEMPTS:
+                    raise
+                logger.warning(f"Не удалось отправить часть ответа (попытка {attempts}): {e}")
+                await asyncio.sleep(attempts)
+
+    async def _deliver(self, text: str, entities: List[Any]):
+        if entities:
+            try:
+                await self._send_or_edit(text, entities)
+                return
+            except BadRequest as e:
+                if 'not modified' in str(e).lower():
+                    return
+                logger.warning(f"Telegram не принял выделения в ответе, отправляем без них: {e}")
+
+        try:
+            await self._send_or_edit(text)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+
+    async def _send_or_edit(self, text: str, entities: Optional[list] = None):
+        if self._sent is None:
+            self._sent = await self.message.reply_text(
+                text,
+                reply_markup=self.reply_markup,
+                entities=entities
+            )
+            if self.first_visible_at is None:
+                self.first_visible_at = time.monotonic()
+        else:
+            await self._sent.edit_text(text, entities=entities)
+        self._shown = (text, [entity.to_dict() for entity in entities or []])
+        self._last_edit = time.monotonic()
@@ -0,0 +1,99 @@
+"""
+Telegram Message Entities for Telegram Bot
+
+Текст сообщения вместе с разметкой в виде списка MessageEntity вместо
+parse_mode. Telegram не разбирает такой текст, поэтому никакой символ в
+ответе ассистента не может сделать сообщение некорректным. Смещения и
+длины выделений считаются в единицах UTF-16, как того требует Bot API.
+
+Текст собирается из частей, у каждой из которых свой набор стилей;
+соседние части с общим стилем образуют одно выделение. Так выделения
+получаются вложенными (ссылка внутри жирного), а разделение сообщения
+в середине выделения не требует закрывать и открывать его вручную.
+"""
+
+from typing import Dict, List, Tuple
+
+from telegram import MessageEntity
+
+# Стиль части текста: (тип MessageEntity, url ссылки или язык блока кода)
+Style = Tuple[str, str]
+# Часть текста со всеми стилями, которые к ней применяются
+Run = Tuple[str, Tuple[Style, ...]]
+
+def utf16_len(text: str) -> int:
+    """Длина текста в единицах UTF-16, в которых Telegram считает лимиты и смещения."""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+class FormattedText:
+    """Текст сообщения и его выделения для reply_text(text, entities=...)."""
+
+    __slots__ = ('text', 'entities')
+
+    def __init__(self, text: str, entities: List[MessageEntity]):
+        self.text = text
+        self.entities = entities
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, FormattedText) and self.text == other.text
+                and [entity.to_dict() for entity in self.entities] == [entity.to_dict() for entity in other.entities])
+
+    def __repr__(self) -> str:
+        return f"FormattedText({self.text!r}, {[entity.to_dict() for entity in self.entities]!r})"
+
+class EntityBuilder:
+    """Собирает текст из частей со стилями и вычисляет для него MessageEntity."""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        # Смещение в UTF-16 считается только при смене стилей: для частей до _measured
+        self._measured = 0
+        self._offset = 0
+        self._styles: Tuple[Style, ...] = ()
+        # Открытые стили и смещения, с которых они начались
+        self._open: Dict[Style, int] = {}
+        self._entities: List[MessageEntity] = []
+
+    def add(self, text: str, styles: Tuple[Style, ...] = ()):
+        """Добавляет часть текста; стили, которых у нее нет, закрываются перед ней."""
+        if not text:
+            return
+        if styles != self._styles:
+            self._measure()
+            opened = list(self._open)
+            closing = [index for index, style in enumerate(opened) if style not in styles]
+            if closing:
+                # Выделения, открытые позже закрываемого, закрываются вместе с ним и открываются заново:
+                # иначе они пересеклись бы с ним частично, а Telegram допускает только вложенные выделения
+                for style in reversed(opened[closing[0]:]):
+                    self._close(style)
+            for style in styles:
+                self._open.setdefault(style, self._offset)
+            self._styles = styles
+        self._parts.append(text)
+
+    def build(self) -> FormattedText:
+        """Текст и выделения, упорядоченные по смещению (внешнее выделение раньше вложенного)."""
+        self._measure()
+        for style in list(self._open):
+            self._close(style)
+        entities = sorted(self._entities, key=lambda entity: (entity.offset, -entity.length))
+        return FormattedText(''.join(self._parts), entities)
+
+    def _measure(self):
+        if self._measured < len(self._parts):
+            self._offset += utf16_len(''.join(self._parts[self._measured:]))
+            self._measured = len(self._parts)
+
+    def _close(self, style: Style):
+        start = self._open.pop(style)
+        if self._offset <= start:
+            return
+        kind, value = style
+        self._entities.append(MessageEntity(
+            kind, start, self._offset - start,
+            url=value if kind == MessageEntity.TEXT_LINK else None,
+            language=(value or None) if kind == MessageEntity.PRE else None
+        ))
@@ -0,0 +1,378 @@
+"""
+Telegram Formatting for Telegram Bot
+
+Перевод Markdown ассистента (заголовки, **жирный**, *курсив*, `код`, блоки
+```кода```, ссылки, списки) в текст сообщения с выделениями MessageEntity
+(telegram_entities.py) и разбиение ответа на сообщения не длиннее лимита
+за один проход по тексту.
+
+Ответ обрабатывается построчно: каждая строка разбирается один раз
+заранее скомпилированными выражениями и сразу добавляется в текущее
+сообщение. Поэтому тот же MarkdownChunker принимает и готовый ответ, и
+фрагменты потокового вывода. Сообщение делится по границе абзаца или
+строки; блок кода, ссылка и URL не разрываются, а блок кода или
+выделение длиннее лимита продолжаются в следующем сообщении. Сообщения
+отправляются без parse_mode, поэтому непарные * или _ от модели остаются
+обычным текстом и не приводят к ошибке Telegram.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from telegram import MessageEntity
+
+from telegram_entities import EntityBuilder, FormattedText, Run, Style, utf16_len
+
+# Максимальная длина сообщения Telegram (в единицах UTF-16)
+MAX_MESSAGE_LENGTH = 4096
+
+# Строка-ограничитель блока кода: ``` и необязательный язык
+_FENCE = re.compile(r'^\s*```\s*([\w+#.-]*)\s*$')
+_HEADING = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)[\s#]*$')
+_RULE = re.compile(r'^\s{0,3}([-*_])(?:\s*\1){2,}\s*$')
+_BULLET = re.compile(r'^(\s*)[-*+]\s+(?=\S)')
+# Выделения внутри строки; выделение и ссылка не переходят на следующую строку
+_INLINE = re.compile(r'''
+    `(?P<code>[^`\n]+)`
+  | \[(?P<link_text>[^\]\n]+)\]\((?P<link_url>(?:https?|tg)://[^\s()]+)\)
+  | \*\*(?P<bold>[^\n]+?)\*\*
+  | __(?P<bold2>[^\n]+?)__
+  | (?<![\w*])\*(?P<italic>[^\s*](?:[^\n*]*?[^\s*])?)\*(?![\w*])
+  | (?<![\w_])_(?P<italic2>[^\s_](?:[^\n_]*?[^\s_])?)_(?![\w_])
+  | (?P<url>https?://[^\s<>()\[\]"'*`]*[^\s<>()\[\]"'*`.,;:!?])
+''', re.VERBOSE)
+# Строка без этих символов — обычный текст, ее не нужно разбирать
+_MARKUP = re.compile(r'[_*`\[]|https?://')
+# Места, где длинную строку можно разделить: после конца предложения, затем по пробелу
+_SENTENCE_END = re.compile(r'[.!?…]\s+')
+_SPACES = re.compile(r' +')
+
+# Части строки: (тип, текст, url)
+TEXT, BOLD, ITALIC, CODE, LINK, URL = 'text', 'bold', 'italic', 'code', 'link', 'url'
+Segment = Tuple[str, str, str]
+
+RULE_TEXT = '———'
+
+def parse_inline(line: str) -> List[Segment]:
+    """Разбирает выделения внутри строки. Непарные маркеры остаются обычным текстом."""
+    if not _MARKUP.search(line):
+        return [(TEXT, line, '')] if line else []
+    segments: List[Segment] = []
+    position = 0
+    for match in _INLINE.finditer(line):
+        if match.start() > position:
+            segments.append((TEXT, line[position:match.start()], ''))
+        kind = match.lastgroup
+        if kind == 'code':
+            segments.append((CODE, match.group('code'), ''))
+        elif kind == 'link_url':
+            segments.append((LINK, match.group('link_text'), match.group('link_url')))
+        elif kind in ('bold', 'bold2'):
+            segments.append((BOLD, match.group(kind), ''))
+        elif kind in ('italic', 'italic2'):
+            segments.append((ITALIC, match.group(kind), ''))
+        else:
+            segments.append((URL, match.group('url'), ''))
+        position = match.end()
+    if position < len(line):
+        segments.append((TEXT, line[position:], ''))
+    return segments
+
+def parse_line(line: str) -> List[Segment]:
+    """Разбирает строку вне блока кода: заголовок, разделитель, пункт списка или абзац."""
+    heading = _HEADING.match(line)
+    if heading:
+        title = heading.group(1).replace('**', '').replace('__', '')
+        return [(BOLD, title, '')] if title.strip() else []
+    if _RULE.match(line):
+        return [(TEXT, RULE_TEXT, '')]
+    bullet = _BULLET.match(line)
+    if bullet:
+        return [(TEXT, bullet.group(1) + '• ', '')] + parse_inline(line[bullet.end():])
+    return parse_inline(line)
+
+# Стили выделений Markdown ассистента
+_STYLES = {BOLD: (MessageEntity.BOLD, ''), ITALIC: (MessageEntity.ITALIC, '')}
+
+def segment_runs(segments: List[Segment], styles: Tuple[Style, ...] = ()) -> List[Run]:
+    """Части строки с их стилями MessageEntity; styles — стили внешнего выделения."""
+    runs: List[Run] = []
+    for kind, text, url in segments:
+        if kind == TEXT:
+            runs.append((text, styles))
+        elif kind == URL:
+            runs.append((text, styles + ((MessageEntity.URL, ''),)))
+        elif kind == LINK:
+            runs.append((text, styles + ((MessageEntity.TEXT_LINK, url),)))
+        elif kind == CODE:
+            # Код не может находиться внутри других выделений
+            runs.append((text, ((MessageEntity.CODE, ''),)))
+        else:
+            style = _STYLES[kind]
+            # Внутри выделения разбирается вложенная разметка: ссылка или код в жирном тексте
+            runs.extend(segment_runs(parse_inline(text), styles if style in styles else styles + (style,)))
+    return runs
+
+def _runs_length(runs: List[Run]) -> int:
+    if len(runs) == 1:
+        return utf16_len(runs[0][0])
+    return utf16_len(''.join(text for text, _ in runs))
+
+def _split_text(text: str, limit: int) -> int:
+    """Позиция разделения длинного текста: конец предложения, пробел или ровно limit символов."""
+    window = text[:limit]
+    best = 0
+    for match in _SENTENCE_END.finditer(window):
+        best = match.end()
+    if best >= limit // 2:
+        return best
+    space = window.rfind(' ')
+    if space >= limit // 2:
+        return space + 1
+    return len(window)
+
+def _fit(text: str, room: int) -> int:
+    """Сколько символов текста помещается в room единиц UTF-16 (0 — нисколько)."""
+    budget = room
+    while budget > 0:
+        cut = _split_text(text, budget)
+        excess = utf16_len(text[:cut]) - room
+        if excess <= 0:
+            return cut
+        budget = min(budget, cut) - excess
+    return 0
+
+# Строка сообщения: части со стилями, блок кода (номер и стиль pre; None — вне блока) и длина в UTF-16
+_Line = Tuple[List[Run], Optional[Tuple[int, Style]], int]
+
+class MarkdownChunker:
+    """Форматирование и разбиение ответа на сообщения за один проход.
+
+    feed() принимает очередной фрагмент текста (весь ответ или дельту потока) и возвращает
+    сообщения (FormattedText), которые уже заполнены; finish() возвращает оставшиеся.
+    preview() — текущее незавершенное сообщение для промежуточного показа.
+    """
+
+    def __init__(self, max_length: int = MAX_MESSAGE_LENGTH):
+        self.max_length = max_length
+        self._partial = ''
+        self._lines: List[_Line] = []
+        self._length = 0
+        # Текущий блок кода и индекс его первой строки (None — вне блока)
+        self._block: Optional[Tuple[int, Style]] = None
+        self._blocks = 0
+        self._code_start: Optional[int] = None
+        # Число строк до последней пустой строки вне блока кода (граница абзаца) и их длина
+        self._paragraph_break = 0
+        self._paragraph_length = 0
+        self._ready: List[FormattedText] = []
+
+    def feed(self, delta: str) -> List[FormattedText]:
+        """Добавляет фрагмент ответа; возвращает готовые сообщения."""
+        if not delta:
+            return []
+        text = self._partial + delta
+        start = 0
+        while True:
+            end = text.find('\n', start)
+            if end < 0:
+                break
+            self._add_line(text[start:end])
+            start = end + 1
+        self._partial = text[start:]
+        # Как и в _add_line, \r в конце строки не учитывается: за ним может прийти перевод строки
+        while len(self._partial.rstrip('\r')) > 2 * self.max_length:
+            self._partial = self._partial[self._cut_long_line(self._partial):]
+        return self._take_ready()
+
+    def finish(self) -> List[FormattedText]:
+        """Завершает ответ; возвращает оставшиеся сообщения."""
+        if self._partial:
+            self._add_line(self._partial)
+            self._partial = ''
+        self._emit(len(self._lines))
+        return self._take_ready()
+
+    def preview(self) -> FormattedText:
+        """Текущее незавершенное сообщение вместе с незаконченной строкой, не длиннее лимита."""
+        lines = list(self._lines)
+        room = self.max_length - self._length - (1 if lines else 0)
+        if room > 0 and self._partial.strip() and not _FENCE.match(self._partial):
+            runs = self._line_runs(self._partial[:room])
+            length = _runs_length(runs)
+            if length <= room:
+                lines.append((runs, self._block, length))
+        return self._build(lines)
+
+    # --- Внутреннее ---
+
+    def _take_ready(self) -> List[FormattedText]:
+        ready, self._ready = self._ready, []
+        return ready
+
+    def _line_runs(self, line: str) -> List[Run]:
+        if self._block is not None:
+            return [(line, (self._block[1],))] if line else []
+        return segment_runs(parse_line(line))
+
+    def _add_line(self, line: str):
+        line = line.rstrip('\r')
+        while len(line) > 2 * self.max_length:
+            line = line[self._cut_long_line(line):]
+        fence = _FENCE.match(line)
+        if fence:
+            if self._block is None:
+                self._blocks += 1
+                self._block = (self._blocks, (MessageEntity.PRE, fence.group(1)))
+                self._code_start = len(self._lines)
+            else:
+                self._block = None
+                self._code_start = None
+            return
+        if self._block is not None:
+            # Строка кода длиннее сообщения делится на несколько строк
+            while utf16_len(line) > self.max_length:
+                cut = self.max_length
+                while utf16_len(line[:cut]) > self.max_length:
+                    cut -= utf16_len(line[:cut]) - self.max_length
+                self._append(self._line_runs(line[:cut]))
+                line = line[cut:]
+            self._append(self._line_runs(line))
+            return
+        if not line.strip():
+            self._append([])
+            self._paragraph_break = len(self._lines)
+            self._paragraph_length = self._length
+            return
+        runs = self._line_runs(line)
+        if _runs_length(runs) > self.max_length:
+            self._append_long(runs)
+        else:
+            self._append(runs)
+
+    def _append(self, runs: List[Run]):
+        length = _runs_length(runs)
+        # Перенесенный в новое сообщение блок кода вместе со строкой тоже может не поместиться
+        while self._lines and self._length + 1 + length > self.max_length:
+            self._overflow()
+        self._length += length + (1 if self._lines else 0)
+        self._lines.append((runs, self._block, length))
+
+    def _overflow(self):
+        """Текущее сообщение заполнено: выбирает, где его закончить."""
+        if self._code_start:
+            # Блок кода начинается с нового сообщения и, если помещается, не делится
+            self._emit(self._code_start)
+        elif self._paragraph_break and self._paragraph_length >= self.max_length // 2:
+            self._emit(self._paragraph_break)
+        else:
+            self._emit(len(self._lines))
+
+    def _emit(self, count: int):
+        """Отдает первые count строк как сообщение; остальные начинают следующее.
+
+        Блок кода, разделенный между сообщениями, продолжается в следующем отдельным выделением pre.
+        """
+        self._push(self._lines[:count])
+        self._lines = self._lines[count:]
+        if self._code_start is not None:
+            self._code_start = max(self._code_start - count, 0)
+        self._length = sum(length for _, _, length in self._lines) + max(len(self._lines) - 1, 0)
+        self._paragraph_break = 0
+        self._paragraph_length = 0
+
+    def _push(self, lines: List[_Line]):
+        message = self._build(lines)
+        # Сообщение из одних пробелов Telegram не примет
+        if message.text.strip():
+            self._ready.append(message)
+
+    def _cut_long_line(self, line: str) -> int:
+        """Добавляет начало очень длинной строки как отдельную строку; возвращает длину этого начала.
+
+        Место разделения выбирается только по первым 2 * max_length символам, поэтому оно одинаково
+        для целого ответа и для потока, в котором продолжение строки еще не пришло.
+        """
+        limit = self.max_length
+        if self._block is not None:
+            # Строку кода _add_line сам делит на строки не длиннее лимита
+            self._add_line(line[:limit])
+            return limit
+        # Позиции внутри выделений и ссылок, которые целиком видны в окне, не подходят
+        window = line[:2 * self.max_length]
+        spans = [match.span() for match in _INLINE.finditer(window)]
+        cut = 0
+        for pattern in (_SENTENCE_END, _SPACES):
+            ends = [match.end() for match in pattern.finditer(window, 0, limit)
+                    if match.end() >= limit // 2 and not any(start < match.end() < end for start, end in spans)]
+            if ends:
+                cut = ends[-1]
+                break
+        if not cut:
+            # Без подходящего пробела — перед выделением, в которое попал лимит, или ровно по лимиту
+            cut = next((start for start, end in spans if start < limit < end and start > 0), limit)
+        self._add_line(line[:cut])
+        self._emit(len(self._lines))
+        return cut
+
+    def _append_long(self, runs: List[Run]):
+        """Строка длиннее сообщения: делится между частями или внутри текста и выделений."""
+        self._emit(len(self._lines))
+        pieces: List[List[Run]] = []
+        current: List[Run] = []
+        used = 0
+        for text, styles in runs:
+            atomic = any(kind in (MessageEntity.URL, MessageEntity.TEXT_LINK, MessageEntity.CODE)
+                         for kind, _ in styles)
+            while text:
+                length = utf16_len(text)
+                room = self.max_length - used
+                if length <= room:
+                    current.append((text, styles))
+                    used += length
+                    break
+                if current and atomic and length <= self.max_length:
+                    # Ссылка или код целиком переносятся в следующее сообщение
+                    pieces.append(current)
+                    current, used = [], 0
+                    continue
+                # Текст и выделения делятся (выделение продолжается в следующем сообщении),
+                # URL длиннее сообщения становится текстом
+                styles = tuple(style for style in styles if style[0] != MessageEntity.URL)
+                cut = _fit(text, room)
+                if cut:
+                    current.append((text[:cut], styles))
+                    text = text[cut:]
+                pieces.append(current)
+                current, used = [], 0
+        pieces.append(current)
+        pieces = [piece for piece in pieces if piece]
+        for piece in pieces[:-1]:
+            self._push([(piece, None, _runs_length(piece))])
+        if pieces:
+            self._lines = [(pieces[-1], None, _runs_length(pieces[-1]))]
+            self._length = self._lines[0][2]
+
+    @staticmethod
+    def _build(lines: List[_Line]) -> FormattedText:
+        """Текст и выделения сообщения из строк; пустые строки в начале и в конце отбрасываются."""
+        start, end = 0, len(lines)
+        while start < end and not lines[start][2]:
+            start += 1
+        while end > start and not lines[end - 1][2]:
+            end -= 1
+        builder = EntityBuilder()
+        for index in range(start, end):
+            runs, block, _ = lines[index]
+            if index > start:
+                # Перевод строки внутри блока кода входит в выделение pre
+                previous = lines[index - 1][1]
+                builder.add('\n', (block[1],) if block is not None and block == previous else ())
+            for text, styles in runs:
+                builder.add(text, styles)
+        return builder.build()
+
+def format_response(text: str, max_length: int = MAX_MESSAGE_LENGTH) -> List[FormattedText]:
+    """Ответ ассистента в виде сообщений Telegram (текст и entities) не длиннее max_length."""
+    chunker = MarkdownChunker(max_length)
+    return chunker.feed(text) + chunker.finish()
@@ -0,0 +1,168 @@
+"""
+Thread Cleanup Queue for Telegram Bot
+
+Удаление потоков OpenAI вне пути обработки запроса. ID потоков сохраняются
+в таблицу thread_deletions, фоновая задача удаляет их пакетами с ограниченным
+параллелизмом и повторяет неудачные попытки с экспоненциальной задержкой.
+"""
+
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from openai import NotFoundError
+
+from storage import get_database
+
+logger = logging.getLogger(__name__)
+
+class ThreadDeletionQueue:
+    """Надежная очередь удаления потоков OpenAI."""
+
+    def __init__(self, client: Any, db_path: str = 'users.db', concurrency: int = 4,
+                 batch_size: int = 50, poll_interval: float = 5.0,
+                 retry_base_delay: float = 10.0, retry_max_delay: float = 3600.0):
+        self.client = client
+        self.db = get_database(db_path)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.deleted = 0
+        self.failed_attempts = 0
+        self.retries = 0
+        # Глубина очереди на момент последней записи или прохода воркера: /metrics и /api/stats
+        # читают ее без запроса к базе из цикла событий
+        self.depth = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def enqueue(self, thread_id: str):
+        """Ставит поток в очередь на удаление."""
+        await self.enqueue_many([thread_id])
+
+    async def enqueue_many(self, thread_ids: Iterable[str]):
+        """Ставит несколько потоков в очередь на удаление одной транзакцией."""
+        thread_ids = [thread_id for thread_id in thread_ids if thread_id]
+        if not thread_ids:
+            return
+        self.depth = await asyncio.to_thread(self._insert, thread_ids)
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _insert(self, thread_ids: List[str]) -> int:
+        with self.db.write() as cursor:
+            cursor.executemany('''
+            INSERT OR IGNORE INTO thread_deletions (thread_id, next_attempt_at)
+            VALUES (?, ?)
+            ''', [(thread_id, time.time()) for thread_id in thread_ids])
+        return self.pending_count()
+
+    def _claim_batch(self) -> List[Tuple[str, int]]:
+        with self.db.read() as cursor:
+            cursor.execute('''
+            SELECT thread_id, attempts FROM thread_deletions
+            WHERE next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+            ''', (time.time(), self.batch_size))
+            return cursor.fetchall()
+
+    def _save_results(self, done: List[str], failed: List[Tuple[str, int, str]]):
+        with self.db.write() as cursor:
+            cursor.executemany('DELETE FROM thread_deletions WHERE thread_id = ?', [(thread_id,) for thread_id in done])
+            cursor.executemany('''
+            UPDATE thread_deletions
+            SET attempts = ?, last_error = ?, next_attempt_at = ?
+            WHERE thread_id = ?
+            ''', [
+                (attempts, error[:500], time.time() + self._retry_delay(attempts), thread_id)
+                for thread_id, attempts, error in failed
+            ])
+
+    def _retry_delay(self, attempts: int) -> float:
+        return min(self.retry_base_delay * 2 ** (attempts - 1), self.retry_max_delay)
+
+    def pending_count(self) -> int:
+        """Количество потоков, ожидающих удаления."""
+        with self.db.read() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM thread_deletions')
+            return cursor.fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди, счетчики удаленных потоков, неудачных и повторных попыток."""
+        return {
+            'pending': self.depth,
+            'deleted': self.deleted,
+            'failed_attempts': self.failed_attempts,
+            'retries': self.retries
+        }
+
+    async def drain_once(self) -> int:
+        """Обрабатывает один пакет готовых к удалению потоков. Возвращает размер пакета."""
+        batch = await asyncio.to_thread(self._claim_batch)
+        if not batch:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        done: List[str] = []
+        failed: List[Tuple[str, int, str]] = []
+
+        async def delete(thread_id: str, attempts: int):
+            async with semaphore:
+                try:
+                    await self.client.beta.threads.delete(thread_id)
+                    done.append(thread_id)
+                except NotFoundError:
+                    # Поток уже удален — задача выполнена
+                    done.append(thread_id)
+                except Exception as e:
+                    failed.append((thread_id, attempts + 1, str(e)))
+                    logger.warning(f"Не удалось удалить поток {thread_id} (попытка {attempts + 1}): {e}")
+
+        await asyncio.gather(*(delete(thread_id, attempts) for thread_id, attempts in batch))
+        await asyncio.to_thread(self._save_results, done, failed)
+
+        self.deleted += len(done)
+        self.failed_attempts += len(failed)
+        self.retries += sum(1 for _, attempts in batch if attempts)
+        return len(batch)
+
+    def start(self):
+        """Запускает фоновое удаление в текущем цикле событий."""
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run_worker())
+
+    async def stop(self):
+        """Останавливает фоновое удаление. Необработанные потоки остаются в очереди."""
+        if self._task:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_worker(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for теряет отмену, если событие установлено в том же шаге цикла
+            # (пул потоков ставит их в очередь прямо перед остановкой)
+            if self._stopping:
+                return
+            self._wakeup.clear()
+            try:
+                while await self.drain_once() == self.batch_size:
+                    pass
+                self.depth = await asyncio.to_thread(self.pending_count)
+            except Exception as e:
+                logger.error(f"Ошибка очереди удаления потоков: {e}")
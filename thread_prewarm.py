@@ -0,0 +1,143 @@
+"""
+Prewarmed Thread Pool for Telegram Bot
+
+Пул заранее созданных потоков OpenAI: выбор ассистента забирает готовый поток
+вместо запроса threads.create. Фоновая задача пополняет пул, а его целевой
+размер подстраивается под частоту выбора ассистентов за последнее время.
+"""
+
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class PrewarmedThreadPool:
+    """Пул готовых потоков OpenAI с адаптивным размером."""
+
+    def __init__(self, client: Any, min_size: int = 2, max_size: int = 20,
+                 lead_time: float = 60.0, rate_window: float = 300.0, refill_concurrency: int = 4,
+                 deletion_queue: Any = None):
+        self.client = client
+        self.deletion_queue = deletion_queue
+        self.min_size = min_size
+        self.max_size = max_size
+        self.lead_time = lead_time
+        self.rate_window = rate_window
+        self.refill_concurrency = refill_concurrency
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_failures = 0
+        self.last_refill_latency = 0.0
+        self.total_refill_latency = 0.0
+        self._ready: deque = deque()
+        self._selections: deque = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def target_size(self) -> int:
+        """Целевой размер пула: ожидаемое число выборов за lead_time секунд."""
+        now = time.monotonic()
+        while self._selections and now - self._selections[0] > self.rate_window:
+            self._selections.popleft()
+        rate = len(self._selections) / self.rate_window
+        return max(self.min_size, min(self.max_size, math.ceil(rate * self.lead_time)))
+
+    async def acquire(self) -> str:
+        """Возвращает ID готового потока, создавая его на месте, если пул пуст."""
+        self._selections.append(time.monotonic())
+        if self._wakeup:
+            self._wakeup.set()
+
+        if self._ready:
+            self.hits += 1
+            return self._ready.popleft()
+
+        self.misses += 1
+        thread = await self.client.beta.threads.create()
+        return thread.id
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий в пул и задержки пополнения."""
+        return {
+            'size': len(self._ready),
+            'target_size': self.target_size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refills': self.refills,
+            'refill_failures': self.refill_failures,
+            'last_refill_latency': round(self.last_refill_latency, 4),
+            'avg_refill_latency': round(self.total_refill_latency / self.refills, 4) if self.refills else 0
+        }
+
+    def start(self):
+        """Запускает фоновое пополнение пула в текущем цикле событий."""
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run_refiller())
+
+    async def stop(self):
+        """Останавливает пополнение и удаляет неиспользованные потоки."""
+        if self._task:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        unused = list(self._ready)
+        self._ready.clear()
+        if self.deletion_queue:
+            await self.deletion_queue.enqueue_many(unused)
+            return
+
+        results = await asyncio.gather(
+            *(self.client.beta.threads.delete(thread_id) for thread_id in unused),
+            return_exceptions=True
+        )
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        if failed:
+            logger.error(f"Не удалось удалить {failed} неиспользованных потоков из пула")
+
+    async def _create_one(self):
+        started = time.monotonic()
+        try:
+            thread = await self.client.beta.threads.create()
+        except Exception as e:
+            self.refill_failures += 1
+            logger.error(f"Ошибка при пополнении пула потоков: {e}")
+            return
+        self.last_refill_latency = time.monotonic() - started
+        self.total_refill_latency += self.last_refill_latency
+        self.refills += 1
+        self._ready.append(thread.id)
+
+    async def _run_refiller(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.rate_window / 10)
+            except asyncio.TimeoutError:
+                pass
+            # wait_for теряет отмену, если событие установлено в том же шаге цикла
+            # (каждый выбор ассистента будит пополнение)
+            if self._stopping:
+                return
+            self._wakeup.clear()
+
+            missing = self.target_size() - len(self._ready)
+            while missing > 0:
+                batch = min(missing, self.refill_concurrency)
+                failures = self.refill_failures
+                await asyncio.gather(*(self._create_one() for _ in range(batch)))
+                if self.refill_failures > failures:
+                    # Не долбим API при ошибках — следующая попытка по таймеру
+                    break
+                missing = self.target_size() - len(self._ready)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Tracing for Telegram Bot
+
+Трассировка обработки обновлений. Каждое обновление получает trace_id, а
+вызовы OpenAI, Telegram Bot API и базы данных внутри его обработки
+записываются как вложенные интервалы (spans) с временем начала и
+длительностью. Строки лога получают trace_id и сохраняются в трассе.
+
+Трассы пишутся в файл JSON lines. Сохраняется доля sample_rate всех
+обновлений и, если задан slow_threshold, каждое обновление медленнее порога.
+Работа, которая продолжается в фоне после ответа обработчика (выполнение
+ассистента), пишется отдельным сегментом с тем же trace_id.
+
+В многопроцессном режиме (sharding.py) каждый воркер пишет свой файл
+(traces.0.jsonl, traces.1.jsonl, ...): строки разных процессов не
+перемешиваются, а все сегменты трассы оказываются в файле одного воркера.
+
+Просмотр: python tracing.py traces.jsonl [trace_id]
+(несколько файлов — списком через запятую или шаблоном 'traces.*.jsonl')
+"""
+
+import sys
+import glob
+import json
+import time
+import random
+import asyncio
+import logging
+import secrets
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class Span:
+    """Интервал внутри трассы. start — смещение от начала сегмента, в секундах."""
+
+    __slots__ = ('span_id', 'parent_id', 'name', 'start', 'duration', 'attrs', 'error')
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, start: float, attrs: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.duration: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'id': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.error:
+            data['error'] = self.error
+        return data
+
+class Trace:
+    """Сегмент трассы: интервалы и строки лога одной непрерывной работы."""
+
+    def __init__(self, trace_id: str, sampled: bool, segment: int = 0):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.segment = segment
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.finished = False
+        self.spans: List[Span] = []
+        self.logs: List[Dict[str, Any]] = []
+
+    def offset(self) -> float:
+        return time.perf_counter() - self.started
+
+    def open_span(self, name: str, parent_id: Optional[int], attrs: Dict[str, Any]) -> Span:
+        span = Span(len(self.spans) + 1, parent_id, name, self.offset(), attrs)
+        self.spans.append(span)
+        return span
+
+    def continuation(self) -> 'Trace':
+        """Новый сегмент той же трассы для работы, продолжающейся после ее завершения."""
+        return Trace(self.trace_id, self.sampled, self.segment + 1)
+
+    def duration(self) -> float:
+        return (self.spans[0].duration or 0.0) if self.spans else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'segment': self.segment,
+            'started_at': round(self.started_at, 6),
+            'duration': round(self.duration(), 6),
+            'spans': [span.to_dict() for span in self.spans],
+            'logs': self.logs
+        }
+
+# Текущий сегмент трассы и открытый в нем интервал
+_current: ContextVar[Optional[Tuple[Trace, Span]]] = ContextVar('trace_current', default=None)
+
+def current_trace_id() -> Optional[str]:
+    """trace_id текущей задачи или None."""
+    current = _current.get()
+    return current[0].trace_id if current else None
+
+class Tracer:
+    """Создание трасс, интервалов и запись завершенных трасс в файл JSON lines."""
+
+    def __init__(self, path: str = 'traces.jsonl', sample_rate: float = 0.0, slow_threshold: float = 0.0,
+                 flush_interval: float = 5.0, max_pending: int = 10000):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.traces = 0
+        self.exported = 0
+        self.dropped = 0
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_threshold > 0
+
+    @contextmanager
+    def trace(self, name: str, **attrs) -> Iterator[Optional[Span]]:
+        """Корневой интервал новой трассы (например, обработка одного обновления)."""
+        if not self.enabled:
+            yield None
+            return
+        self.traces += 1
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.slow_threshold <= 0:
+            yield None
+            return
+        trace = Trace(secrets.token_hex(8), sampled)
+        with self._open(trace, None, name, attrs, root=True) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Optional[Span]]:
+        """Вложенный интервал в текущей трассе. Вне трассы ничего не записывает."""
+        current = _current.get()
+        if current is None:
+            yield None
+            return
+        trace, parent = current
+        if trace.finished:
+            # Корневой интервал уже закрыт: фоновая работа пишется новым сегментом
+            with self._open(trace.continuation(), None, name, attrs, root=True) as span:
+                yield span
+            return
+        with self._open(trace, parent.span_id, name, attrs, root=False) as span:
+            yield span
+
+    @contextmanager
+    def _open(self, trace: Trace, parent_id: Optional[int], name: str, attrs: Dict[str, Any], root: bool):
+        span = trace.open_span(name, parent_id, attrs)
+        token = _current.set((trace, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = trace.offset() - span.start
+            _current.reset(token)
+            if root:
+                trace.finished = True
+                self._finish(trace)
+
+    def start_span(self, name: str, **attrs) -> Optional[Tuple[Trace, Span]]:
+        """Открывает листовой интервал без смены текущего (для парных хуков запрос/ответ)."""
+        current = _current.get()
+        if current is None or current[0].finished:
+            return None
+        trace, parent = current
+        return trace, trace.open_span(name, parent.span_id, attrs)
+
+    def end_span(self, handle: Optional[Tuple[Trace, Span]], **attrs):
+        """Закрывает интервал, открытый start_span."""
+        if handle is None:
+            return
+        trace, span = handle
+        span.duration = trace.offset() - span.start
+        span.attrs.update(attrs)
+
+    def log(self, record: logging.LogRecord):
+        """Сохраняет строку лога в текущей трассе."""
+        current = _current.get()
+        if current is None or current[0].finished:
+            return
+        trace, span = current
+        trace.logs.append({
+            't': round(trace.offset(), 6),
+            'span': span.span_id,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        })
+
+    # --- HTTP хуки ---
+
+    async def on_request(self, request: Any):
+        """Event hook httpx: интервал на каждый исходящий запрос."""
+        handle = self.start_span(f"http {request.method} {request.url.host}", path=request.url.path)
+        if handle is not None:
+            request.extensions['trace_span'] = handle
+
+    async def on_response(self, response: Any):
+        self.end_span(response.request.extensions.get('trace_span'), status=response.status_code)
+
+    # --- Запись в файл ---
+
+    def _finish(self, trace: Trace):
+        if not trace.sampled and trace.duration() < self.slow_threshold:
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(trace.to_dict())
+
+    def flush(self) -> int:
+        """Дописывает накопленные трассы в файл. Возвращает их количество."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for trace in pending:
+                    f.write(json.dumps(trace, ensure_ascii=False, default=str) + '\n')
+            self.exported += len(pending)
+            return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'traces': self.traces,
+            'exported': self.exported,
+            'pending': pending,
+            'dropped': self.dropped
+        }
+
+    def start(self):
+        """Запускает периодическую запись трасс в текущем цикле событий."""
+        if self.enabled:
+            self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Останавливает периодическую запись и дописывает оставшиеся трассы."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при записи трасс: {e}")
+
+# Общий трассировщик процесса: настраивается ботом, используется хранилищем и HTTP-клиентами
+tracer = Tracer()
+
+def install_log_correlation():
+    """Добавляет trace_id (или '-') во все записи лога и сохраняет их в текущей трассе."""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, 'traced', False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = current_trace_id() or '-'
+        if record.trace_id != '-':
+            tracer.log(record)
+        return record
+
+    record_factory.traced = True
+    logging.setLogRecordFactory(record_factory)
+
+# --- Просмотр трасс ---
+
+def load_traces(*paths: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Сегменты трасс из файлов, сгруппированные по trace_id."""
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    segment = json.loads(line)
+                    traces.setdefault(segment['trace_id'], []).append(segment)
+    for segments in traces.values():
+        segments.sort(key=lambda segment: segment['segment'])
+    return traces
+
+def print_trace(segments: List[Dict[str, Any]]):
+    """Печатает дерево интервалов трассы со смещениями от ее начала."""
+    origin = segments[0]['started_at']
+    for segment in segments:
+        base = segment['started_at'] - origin
+        children: Dict[Optional[int], List[Dict[str, Any]]] = {}
+        for span in segment['spans']:
+            children.setdefault(span['parent'], []).append(span)
+
+        def walk(parent: Optional[int], depth: int):
+            for span in children.get(parent, []):
+                duration = span['duration']
+                duration_text = f"{duration * 1000:9.1f} мс" if duration is not None else "   не закрыт"
+                attrs = ' '.join(f"{key}={value}" for key, value in span.get('attrs', {}).items())
+                error = f" ОШИБКА {span['error']}" if span.get('error') else ''
+                print(f"  +{(base + span['start']) * 1000:9.1f} мс {duration_text}  {'  ' * depth}{span['name']} {attrs}{error}")
+                walk(span['id'], depth + 1)
+
+        walk(None, 0)
+        for entry in segment['logs']:
+            print(f"  +{(base + entry['t']) * 1000:9.1f} мс  [{entry['level']}] {entry['message']}")
+
+def main():
+    """Главная функция CLI."""
+    if len(sys.argv) < 2:
+        print("Использование:")
+        print("  python tracing.py traces.jsonl           - самые медленные трассы")
+        print("  python tracing.py traces.jsonl <trace_id> - интервалы и лог одной трассы")
+        return
+
+    # Список файлов через запятую, элементы могут быть шаблонами glob
+    paths = [path for item in sys.argv[1].split(',') if item for path in (sorted(glob.glob(item)) or [item])]
+    traces = load_traces(*paths)
+    if len(sys.argv) > 2:
+        segments = traces.get(sys.argv[2])
+        if not segments:
+            print(f"Трасса {sys.argv[2]} не найдена")
+            return
+        print_trace(segments)
+        return
+
+    def total(segments):
+        last = segments[-1]
+        return last['started_at'] - segments[0]['started_at'] + last['duration']
+
+    print(f"Трасс: {len(traces)}")
+    for trace_id, segments in sorted(traces.items(), key=lambda item: total(item[1]), reverse=True)[:20]:
+        root = segments[0]['spans'][0] if segments[0]['spans'] else {}
+        print(f"{trace_id}  {total(segments) * 1000:9.1f} мс  сегментов: {len(segments)}  {root.get('name', '')} {root.get('attrs', '')}")
+
+if __name__ == '__main__':
+    main()
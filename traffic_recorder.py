@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Traffic Recorder for Telegram Bot
+
+Запись и воспроизведение реальной нагрузки. Рекордер пишет в сжатый файл
+JSON lines входящие обновления Telegram, время запросов к OpenAI и
+длительность выполнений ассистента. По умолчанию тексты сообщений и имена
+заменяются заглушками той же длины, а ID пользователей — псевдонимами.
+Команды и тексты кнопок сохраняются, поэтому маршрутизация обработчиков
+при воспроизведении не меняется.
+
+Replayer подает записанные обновления с исходными интервалами между ними
+(в реальном времени, ускоренно или без пауз). Обновления одного
+пользователя подаются строго по порядку, разные пользователи — параллельно.
+
+В многопроцессном режиме (sharding.py) каждый воркер пишет свой файл
+(traffic.0.jsonl.gz, traffic.1.jsonl.gz, ...); файлы можно передать списком
+через запятую или шаблоном — записи объединяются по времени.
+
+Запуск:
+  python traffic_recorder.py stats traffic.jsonl.gz
+  python traffic_recorder.py stats 'traffic.*.jsonl.gz'
+  python traffic_recorder.py replay traffic.jsonl.gz [1|10|max] [webhook_url]
+"""
+
+import os
+import sys
+import glob
+import gzip
+import hmac
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import secrets
+from collections import Counter
+from threading import Lock
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import api_route
+
+logger = logging.getLogger(__name__)
+
+# Поля с пользовательскими данными, которые заменяются при анонимизации
+_PRIVATE_TEXT_FIELDS = ('text', 'caption', 'query', 'first_name', 'last_name', 'username', 'title', 'phone_number')
+_PRIVATE_ID_FIELDS = ('from', 'chat', 'user', 'sender_chat')
+
+class TrafficRecorder:
+    """Запись обновлений и времени запросов к OpenAI в файл JSON lines (gzip)."""
+
+    def __init__(self, path: str = '', anonymize: bool = True, flush_interval: float = 5.0,
+                 max_pending: int = 100000):
+        self.path = path
+        self.anonymize = anonymize
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # Тексты, которые сохраняются при анонимизации (кнопки клавиатуры)
+        self.keep_texts: set = set()
+        self.recorded: Counter = Counter()
+        self.dropped = 0
+        self._salt = secrets.token_bytes(16)
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _append(self, record: Dict[str, Any]):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(record)
+            self.recorded[record['type']] += 1
+
+    # --- Запись ---
+
+    def record_update(self, update: Any):
+        """Записывает входящее обновление (объект Update или словарь Bot API)."""
+        if not self.enabled:
+            return
+        data = update.to_dict() if hasattr(update, 'to_dict') else dict(update)
+        if self.anonymize:
+            data = self._anonymize(data)
+        self._append({'type': 'update', 't': time.time(), 'update': data})
+
+    def record_run(self, assistant_type: str, outcome: str, seconds: float):
+        """Записывает длительность выполнения ассистента."""
+        if self.enabled:
+            self._append({'type': 'run', 't': time.time(), 'assistant_type': assistant_type,
+                          'outcome': outcome, 'duration': round(seconds, 6)})
+
+    async def on_request(self, request: Any):
+        """Event hook httpx: время начала запроса к OpenAI."""
+        if self.enabled:
+            request.extensions['recorder_started'] = time.perf_counter()
+
+    async def on_response(self, response: Any):
+        """Event hook httpx: маршрут, код, размеры и время до заголовков ответа."""
+        started = response.request.extensions.get('recorder_started')
+        if started is None:
+            return
+        request = response.request
+        self._append({
+            'type': 'openai',
+            't': time.time(),
+            'route': f"{request.method} {api_route(request.url.path)}",
+            'status': response.status_code,
+            'duration': round(time.perf_counter() - started, 6),
+            'request_bytes': len(request.content or b''),
+            'response_bytes': int(response.headers.get('content-length') or 0)
+        })
+
+    def _pseudonym(self, value: int) -> int:
+        digest = hmac.new(self._salt, str(value).encode('utf-8'), hashlib.sha256).digest()
+        # Положительный ID в диапазоне ID пользователей Telegram, стабильный в пределах записи
+        return int.from_bytes(digest[:5], 'big') + 1
+
+    def _anonymize(self, value: Any, key: str = '') -> Any:
+        if isinstance(value, dict):
+            result = {}
+            for name, item in value.items():
+                if name in _PRIVATE_ID_FIELDS and isinstance(item, dict) and 'id' in item:
+                    item = dict(item, id=self._pseudonym(item['id']))
+                result[name] = self._anonymize(item, name)
+            return result
+        if isinstance(value, list):
+            return [self._anonymize(item, key) for item in value]
+        if key in _PRIVATE_TEXT_FIELDS and isinstance(value, str):
+            if value in self.keep_texts:
+                return value
+            # Команда сохраняется, остальной текст заменяется заглушкой той же длины
+            command, sep, rest = value.partition(' ')
+            if command.startswith('/'):
+                return command + sep + 'x' * len(rest)
+            return 'x' * len(value)
+        return value
+
+    # --- Файл ---
+
+    def flush(self) -> int:
+        """Дописывает накопленные записи в файл. Возвращает их количество."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            # Каждый сброс — отдельный член gzip, файл читается целиком обычным gzip.open
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                for record in pending:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            return len(pending)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = len(self._pending)
+        return {'recorded': dict(self.recorded), 'pending': pending, 'dropped': self.dropped}
+
+    def start(self):
+        """Запускает периодическую запись в текущем цикле событий."""
+        if self.enabled:
+            logger.info(f"Запись трафика в {self.path}")
+            self._task = asyncio.create_task(self._run_flusher())
+
+    async def stop(self):
+        """Останавливает периодическую запись и дописывает оставшиеся записи."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error(f"Ошибка при записи трафика: {e}")
+
+# Общий рекордер процесса: настраивается ботом
+traffic_recorder = TrafficRecorder()
+
+def expand_paths(argument: str) -> List[str]:
+    """Файлы записи из аргумента: список через запятую, элементы могут быть шаблонами glob."""
+    paths: List[str] = []
+    for item in argument.split(','):
+        if item:
+            paths.extend(sorted(glob.glob(item)) or [item])
+    return paths
+
+def load_records(*paths: str) -> List[Dict[str, Any]]:
+    """Записи из файлов (gzip или обычных JSON lines), объединенные в порядке времени."""
+    records: List[Dict[str, Any]] = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record['t'])
+    return records
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """ID пользователя (или чата) из словаря обновления — ключ порядка при воспроизведении."""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        for field in ('from', 'user', 'chat'):
+            if isinstance(value.get(field), dict):
+                return value[field].get('id')
+        if isinstance(value.get('message'), dict):
+            return update_user_id({'message': value['message']})
+    return None
+
+class Replayer:
+    """Подает записанные обновления с исходными интервалами и порядком внутри пользователя.
+
+    speed — ускорение относительно записи (1 — реальное время), None — без пауз.
+    deliver(update) должен вернуться, когда обновление принято.
+    """
+
+    def __init__(self, updates: List[Dict[str, Any]], deliver: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 speed: Optional[float] = 1.0):
+        self.updates = updates
+        self.deliver = deliver
+        self.speed = speed
+        self.delivered = 0
+        self.errors = 0
+        self.lags: List[float] = []
+
+    async def run(self) -> float:
+        """Воспроизводит все обновления. Возвращает длительность в секундах."""
+        if not self.updates:
+            return 0.0
+        origin = self.updates[0]['t']
+        per_user: Dict[Any, List[Dict[str, Any]]] = {}
+        for index, record in enumerate(self.updates):
+            key = update_user_id(record['update'])
+            per_user.setdefault(key if key is not None else f"anonymous-{index}", []).append(record)
+
+        started = time.perf_counter()
+
+        async def play(records: List[Dict[str, Any]]):
+            for record in records:
+                if self.speed:
+                    due = started + (record['t'] - origin) / self.speed
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    else:
+                        # Отставание от расписания: система не успевает за записанной нагрузкой
+                        self.lags.append(-delay)
+                try:
+                    await self.deliver(record['update'])
+                    self.delivered += 1
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"Не удалось подать обновление {record['update'].get('update_id')}: {e}")
+
+        await asyncio.gather(*(play(records) for records in per_user.values()))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> str:
+        lags = sorted(self.lags)
+        p99 = lags[min(len(lags) - 1, int(0.99 * len(lags)))] if lags else 0.0
+        return (f"Подано: {self.delivered}, ошибок: {self.errors}, за {elapsed:.2f} с "
+                f"({self.delivered / elapsed if elapsed else 0:.1f} обновлений/с), "
+                f"отставаний от расписания: {len(lags)}, p99 отставания {p99 * 1000:.1f} мс")
+
+def parse_speed(value: str) -> Optional[float]:
+    """'1', '10' или 'max' (без пауз)."""
+    return None if value.lower() in ('max', '0') else float(value)
+
+def print_stats(records: List[Dict[str, Any]]):
+    """Сводка по записи: объем, длительность, пики и задержки OpenAI."""
+    counts = Counter(record['type'] for record in records)
+    updates = [record for record in records if record['type'] == 'update']
+    span = records[-1]['t'] - records[0]['t'] if records else 0.0
+    print(f"Записей: {len(records)} {dict(counts)}, длительность {span:.1f} с")
+    if updates:
+        users = {update_user_id(record['update']) for record in updates}
+        per_second = Counter(int(record['t']) for record in updates)
+        print(f"Обновлений: {len(updates)} от {len(users)} пользователей, пик {max(per_second.values())}/с")
+
+    runs: Dict[str, List[float]] = {}
+    for record in records:
+        if record['type'] == 'run':
+            runs.setdefault(record['outcome'], []).append(record['duration'])
+    for outcome, durations in sorted(runs.items()):
+        durations.sort()
+        print(f"Выполнения {outcome}: {len(durations)}, p50 {durations[len(durations) // 2]:.2f} с, "
+              f"max {durations[-1]:.2f} с")
+
+    routes: Dict[str, List[float]] = {}
+    for record in records:
+        if record['type'] == 'openai':
+            routes.setdefault(record['route'], []).append(record['duration'])
+    for route, durations in sorted(routes.items()):
+        durations.sort()
+        print(f"OpenAI {route}: {len(durations)}, p50 {durations[len(durations) // 2] * 1000:.0f} мс")
+
+async def replay_to_webhook(records: List[Dict[str, Any]], url: str, speed: Optional[float], secret: str):
+    """Подает обновления на webhook запущенного бота (см. WEBHOOK_SECRET)."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=100)) as client:
+        async def deliver(update: Dict[str, Any]):
+            response = await client.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': secret})
+            response.raise_for_status()
+
+        replayer = Replayer([record for record in records if record['type'] == 'update'], deliver, speed)
+        elapsed = await replayer.run()
+    print(replayer.report(elapsed))
+
+def main():
+    """Главная функция CLI."""
+    if len(sys.argv) < 3:
+        print("Использование:")
+        print("  python traffic_recorder.py stats <files>")
+        print("      - сводка по записи: обновления, пики, задержки OpenAI")
+        print("        <files> — файл, список через запятую или шаблон ('traffic.*.jsonl.gz')")
+        print("  python traffic_recorder.py replay <files> [1|10|max] [webhook_url]")
+        print("      - подать обновления на webhook бота (по умолчанию http://127.0.0.1:8080/telegram/webhook)")
+        print("        секрет берется из WEBHOOK_SECRET")
+        return
+
+    command = sys.argv[1].lower()
+    records = load_records(*expand_paths(sys.argv[2]))
+
+    if command == 'stats':
+        print_stats(records)
+    elif command == 'replay':
+        speed = parse_speed(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+        url = sys.argv[4] if len(sys.argv) > 4 else 'http://127.0.0.1:8080/telegram/webhook'
+        secret = os.getenv('WEBHOOK_SECRET', '')
+        if not secret:
+            print("Укажите WEBHOOK_SECRET, с которым запущен бот")
+            return
+        asyncio.run(replay_to_webhook(records, url, speed, secret))
+    else:
+        print(f"Неизвестная команда: {command}")
+
+if __name__ == '__main__':
+    main()
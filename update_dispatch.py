@@ -0,0 +1,118 @@
+"""
+Update Dispatch for Telegram Bot
+
+Параллельная обработка обновлений Telegram с сохранением порядка для каждого
+пользователя. Обновления распределяются по фиксированному числу воркеров по
+effective_user.id: обновления одного пользователя всегда попадают к одному
+воркеру и обрабатываются строго по очереди, разные пользователи — параллельно.
+"""
+
+import time
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+from tracing import tracer
+from traffic_recorder import traffic_recorder
+
+logger = logging.getLogger(__name__)
+
+class WorkerStats:
+    """Статистика одного воркера: обработанные обновления и время ожидания в очереди."""
+
+    def __init__(self):
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.processed += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.last_wait = wait
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений: параллельно между пользователями, последовательно внутри пользователя."""
+
+    def __init__(self, workers: int = 16, max_pending: int = 1024):
+        # Семафор базового класса ограничивает число обновлений в работе и в очередях
+        super().__init__(max_concurrent_updates=max_pending)
+        self.workers = workers
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stats = [WorkerStats() for _ in range(workers)]
+        self._round_robin = itertools.count()
+
+    @staticmethod
+    def update_key(update: Any) -> Optional[int]:
+        """Ключ упорядочивания: ID пользователя, а без него — ID чата."""
+        user = getattr(update, 'effective_user', None)
+        if user:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        if chat:
+            return chat.id
+        return None
+
+    def worker_index(self, update: Any) -> int:
+        """Номер воркера для обновления."""
+        key = self.update_key(update)
+        if key is None:
+            return next(self._round_robin) % self.workers
+        return key % self.workers
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        traffic_recorder.record_update(update)
+        future = asyncio.get_running_loop().create_future()
+        self._queues[self.worker_index(update)].put_nowait((update, coroutine, future, time.monotonic()))
+        await future
+
+    async def initialize(self) -> None:
+        self._queues = [asyncio.Queue() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._run_worker(index)) for index in range(self.workers)]
+        logger.info(f"Запущено воркеров обработки обновлений: {self.workers}")
+
+    async def shutdown(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Глубина очереди и время ожидания для каждого воркера."""
+        return [
+            {
+                'worker': index,
+                'queue_depth': self._queues[index].qsize() if self._queues else 0,
+                'processed': stats.processed,
+                'total_wait': round(stats.total_wait, 6),
+                'avg_wait': round(stats.total_wait / stats.processed, 4) if stats.processed else 0,
+                'max_wait': round(stats.max_wait, 4),
+                'last_wait': round(stats.last_wait, 4)
+            }
+            for index, stats in enumerate(self._stats)
+        ]
+
+    async def _run_worker(self, index: int):
+        queue = self._queues[index]
+        stats = self._stats[index]
+        while True:
+            update, coroutine, future, enqueued_at = await queue.get()
+            wait = time.monotonic() - enqueued_at
+            stats.record_wait(wait)
+            try:
+                # Каждое обновление — отдельная трасса (если трассировка включена)
+                with tracer.trace('update', update_id=getattr(update, 'update_id', None),
+                                  user_id=self.update_key(update), queue_wait=round(wait, 6)):
+                    await coroutine
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
@@ -0,0 +1,83 @@
+"""
+User Status Cache for Telegram Bot
+
+Кэш статусов пользователей в памяти процесса: проверка доступа на каждом
+обновлении становится поиском в словаре вместо запроса к SQLite. Записи
+вытесняются по LRU и устаревают по TTL. Код, меняющий статус в этом
+процессе, обновляет кэш явно; изменения из других процессов (например,
+user_utils.py) становятся видны боту не позже чем через TTL.
+"""
+
+import time
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class UserStatusCache:
+    """LRU-кэш telegram_id -> статус с TTL. Потокобезопасен.
+
+    API сервер работает в цикле событий бота, но запись в кэш идет и из рабочих потоков
+    AsyncDatabase (save_user, register_user, load_user_status выполняются вместе с запросом
+    к базе), пока цикл событий читает его в get_user_status. Без блокировки одновременные
+    move_to_end и popitem в OrderedDict могут испортить порядок LRU.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, telegram_id: int) -> Optional[str]:
+        """Возвращает статус из кэша или None."""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None or time.monotonic() >= entry[1]:
+                if entry is not None:
+                    del self._entries[telegram_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, telegram_id: int, status: str):
+        """Запоминает статус пользователя."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[telegram_id] = (status, time.monotonic() + self.ttl)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, telegram_id: int):
+        """Удаляет статус пользователя из кэша."""
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и заполненность кэша."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0
+            }
+
+# Общий кэш процесса: его используют бот и UserManager
+user_status_cache = UserStatusCache()
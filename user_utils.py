@@ -7,7 +7,6 @@ User Management Utilities for Telegram Bot
 Утилиты для управления пользователями и анализа данных.
 """
 
-import sqlite3
 import json
 import csv
 import os
@@ -16,6 +15,9 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass
 
+from storage import get_database
+from user_cache import user_status_cache
+
 # Настройка логирования
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", 
@@ -88,21 +90,19 @@ class UserManager:
     
     def __init__(self, db_path: str = 'users.db'):
         self.db_path = db_path
+        self.db = get_database(db_path)
     
     def get_user(self, telegram_id: int) -> Optional[User]:
         """Получает пользователя по Telegram ID."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT telegram_id, username, first_name, last_name, 
-                       status, registered_at, last_activity, created_at
-                FROM users WHERE telegram_id = ?
-            ''', (telegram_id,))
-            
-            row = cursor.fetchone()
-            conn.close()
+            with self.db.read() as cursor:
+                cursor.execute('''
+                    SELECT telegram_id, username, first_name, last_name, 
+                           status, registered_at, last_activity, created_at
+                    FROM users WHERE telegram_id = ?
+                ''', (telegram_id,))
+                
+                row = cursor.fetchone()
             
             if row:
                 return User(*row)
@@ -115,25 +115,22 @@ class UserManager:
     def get_all_users(self, status: Optional[str] = None) -> List[User]:
         """Получает всех пользователей с опциональной фильтрацией по статусу."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if status:
-                cursor.execute('''
-                    SELECT telegram_id, username, first_name, last_name, 
-                           status, registered_at, last_activity, created_at
-                    FROM users WHERE status = ?
-                    ORDER BY created_at DESC
-                ''', (status,))
-            else:
-                cursor.execute('''
-                    SELECT telegram_id, username, first_name, last_name, 
-                           status, registered_at, last_activity, created_at
-                    FROM users ORDER BY created_at DESC
-                ''')
-            
-            users = [User(*row) for row in cursor.fetchall()]
-            conn.close()
+            with self.db.read() as cursor:
+                if status:
+                    cursor.execute('''
+                        SELECT telegram_id, username, first_name, last_name, 
+                               status, registered_at, last_activity, created_at
+                        FROM users WHERE status = ?
+                        ORDER BY created_at DESC
+                    ''', (status,))
+                else:
+                    cursor.execute('''
+                        SELECT telegram_id, username, first_name, last_name, 
+                               status, registered_at, last_activity, created_at
+                        FROM users ORDER BY created_at DESC
+                    ''')
+                
+                users = [User(*row) for row in cursor.fetchall()]
             
             return users
             
@@ -144,19 +141,16 @@ class UserManager:
     def update_user_status(self, telegram_id: int, new_status: str) -> bool:
         """Обновляет статус пользователя."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE users SET status = ?, last_activity = CURRENT_TIMESTAMP
-                WHERE telegram_id = ?
-            ''', (new_status, telegram_id))
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                cursor.execute('''
+                    UPDATE users SET status = ?, last_activity = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ?
+                ''', (new_status, telegram_id))
+                
+                success = cursor.rowcount > 0
             
             if success:
+                user_status_cache.set(telegram_id, new_status)
                 logger.info(f"Статус пользователя {telegram_id} изменен на {new_status}")
             
             return success
@@ -168,22 +162,19 @@ class UserManager:
     def register_user(self, telegram_id: int) -> bool:
         """Регистрирует пользователя."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE users 
-                SET status = 'registered', 
-                    registered_at = CURRENT_TIMESTAMP,
-                    last_activity = CURRENT_TIMESTAMP
-                WHERE telegram_id = ?
-            ''', (telegram_id,))
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                cursor.execute('''
+                    UPDATE users 
+                    SET status = 'registered', 
+                        registered_at = CURRENT_TIMESTAMP,
+                        last_activity = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ?
+                ''', (telegram_id,))
+                
+                success = cursor.rowcount > 0
             
             if success:
+                user_status_cache.set(telegram_id, 'registered')
                 logger.info(f"Пользователь {telegram_id} зарегистрирован")
             
             return success
@@ -195,16 +186,13 @@ class UserManager:
     def delete_user(self, telegram_id: int) -> bool:
         """Удаляет пользователя из базы данных."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM users WHERE telegram_id = ?', (telegram_id,))
-            
-            success = cursor.rowcount > 0
-            conn.commit()
-            conn.close()
+            with self.db.write() as cursor:
+                cursor.execute('DELETE FROM users WHERE telegram_id = ?', (telegram_id,))
+                
+                success = cursor.rowcount > 0
             
             if success:
+                user_status_cache.invalidate(telegram_id)
                 logger.info(f"Пользователь {telegram_id} удален")
             
             return success
@@ -216,21 +204,18 @@ class UserManager:
     def get_inactive_users(self, days: int = 30) -> List[User]:
         """Получает пользователей, неактивных более указанного количества дней."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cutoff_date = datetime.now() - timedelta(days=days)
-            
-            cursor.execute('''
-                SELECT telegram_id, username, first_name, last_name, 
-                       status, registered_at, last_activity, created_at
-                FROM users 
-                WHERE last_activity < ?
-                ORDER BY last_activity ASC
-            ''', (cutoff_date.isoformat(),))
-            
-            users = [User(*row) for row in cursor.fetchall()]
-            conn.close()
+            with self.db.read() as cursor:
+                cutoff_date = datetime.now() - timedelta(days=days)
+                
+                cursor.execute('''
+                    SELECT telegram_id, username, first_name, last_name, 
+                           status, registered_at, last_activity, created_at
+                    FROM users 
+                    WHERE last_activity < ?
+                    ORDER BY last_activity ASC
+                ''', (cutoff_date.isoformat(),))
+                
+                users = [User(*row) for row in cursor.fetchall()]
             
             return users
             
@@ -241,37 +226,33 @@ class UserManager:
     def get_registration_stats(self) -> Dict[str, Any]:
         """Получает статистику регистрации пользователей."""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Общая статистика
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM users WHERE status = ?', ('registered',))
-            registered_users = cursor.fetchone()[0]
-            
-            # Статистика по дням
-            cursor.execute('''
-                SELECT DATE(created_at) as date, COUNT(*) as count
-                FROM users
-                WHERE created_at > datetime('now', '-30 days')
-                GROUP BY DATE(created_at)
-                ORDER BY date DESC
-            ''')
-            daily_registrations = dict(cursor.fetchall())
-            
-            # Статистика по регистрации
-            cursor.execute('''
-                SELECT DATE(registered_at) as date, COUNT(*) as count
-                FROM users
-                WHERE registered_at > datetime('now', '-30 days')
-                GROUP BY DATE(registered_at)
-                ORDER BY date DESC
-            ''')
-            daily_activations = dict(cursor.fetchall())
-            
-            conn.close()
+            with self.db.read() as cursor:
+                # Общая статистика
+                cursor.execute('SELECT COUNT(*) FROM users')
+                total_users = cursor.fetchone()[0]
+                
+                cursor.execute('SELECT COUNT(*) FROM users WHERE status = ?', ('registered',))
+                registered_users = cursor.fetchone()[0]
+                
+                # Статистика по дням
+                cursor.execute('''
+                    SELECT DATE(created_at) as date, COUNT(*) as count
+                    FROM users
+                    WHERE created_at > datetime('now', '-30 days')
+                    GROUP BY DATE(created_at)
+                    ORDER BY date DESC
+                ''')
+                daily_registrations = dict(cursor.fetchall())
+                
+                # Статистика по регистрации
+                cursor.execute('''
+                    SELECT DATE(registered_at) as date, COUNT(*) as count
+                    FROM users
+                    WHERE registered_at > datetime('now', '-30 days')
+                    GROUP BY DATE(registered_at)
+                    ORDER BY date DESC
+                ''')
+                daily_activations = dict(cursor.fetchall())
             
             return {
                 'total_users': total_users,